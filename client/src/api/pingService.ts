@@ -12,6 +12,20 @@ export type Ping = {
   user: User
 }
 
+export type TrailPing = Ping & {
+  depth: number
+  root_ping: number
+}
+
+export type PingTrailResponse = {
+  root_ping: number
+  pings: TrailPing[]
+  error?: {
+    code: string
+    message: string
+  }
+}
+
 export type PingResponse = {
   ping: Ping
   error?: {
@@ -28,6 +42,26 @@ export type PingsResponse = {
   }
 }
 
+export type PingCluster = {
+  row: number
+  column: number
+  // [south, west, north, east] of the grid cell
+  bounds: [number, number, number, number]
+  count: number
+  latitude: number
+  longitude: number
+  latest: Ping
+}
+
+export type PingClustersResponse = {
+  zoom: number
+  clusters: PingCluster[]
+  error?: {
+    code: string
+    message: string
+  }
+}
+
 // Create a new ping (optionally as a response to the latest ping)
 export async function createPing(parent?: number): Promise<PingResponse> {
   try {
@@ -63,6 +97,22 @@ export async function fetchLatestPings(): Promise<PingsResponse> {
   }
 }
 
+// Get pings aggregated into grid cells, e.g. for the globe view. The grid has
+// 2**zoom rows and columns; deeper zooms need a [west, south, east, north] bbox.
+export async function fetchPingClusters(
+  zoom: number,
+  bbox?: [number, number, number, number],
+): Promise<PingClustersResponse> {
+  try {
+    const params: Record<string, string | number> = { zoom }
+    if (bbox) params.bbox = bbox.join(',')
+    const response = await api().get('/pings/clusters/', { params })
+    return response.data as PingClustersResponse
+  } catch (error) {
+    throw error
+  }
+}
+
 // Respond to a specific ping (trail creation)
 export async function respondToPing(parentId: number): Promise<PingResponse> {
   try {
@@ -76,3 +126,42 @@ export async function respondToPing(parentId: number): Promise<PingResponse> {
     throw error
   }
 }
+
+// Get the full trail (ancestors and descendants) of a ping in one request
+export async function fetchPingTrail(pingId: number): Promise<PingTrailResponse> {
+  try {
+    const response = await api().get(`/pings/${pingId}/trail/`)
+    return response.data as PingTrailResponse
+  } catch (error) {
+    throw error
+  }
+}
+
+// Subscribe to newly created pings and trail responses pushed by the server.
+// EventSource cannot send headers, so the stream is opened with a single-use
+// ticket, fetched with the access token, instead of the token itself. The
+// server ends the stream with an "expired" event once the access token
+// expires; onExpired should refresh it and subscribe again.
+export async function subscribeToPings(
+  onPing: (ping: Ping, isResponse: boolean) => void,
+  onExpired: () => void,
+): Promise<EventSource> {
+  const { data } = await api().post('/pings/stream/ticket/')
+  const baseUrl = import.meta.env.VITE_API_BASE_URL || 'http://localhost:3000/api'
+  const source = new EventSource(
+    `${baseUrl}/pings/stream/?${new URLSearchParams({ ticket: data.ticket })}`,
+    { withCredentials: true },
+  )
+  source.addEventListener('ping', (event) => onPing(JSON.parse(event.data), false))
+  source.addEventListener('response', (event) => onPing(JSON.parse(event.data), true))
+  // Bulk uploads arrive as one event carrying the whole batch.
+  source.addEventListener('pings', (event) =>
+    (JSON.parse(event.data) as Ping[]).forEach((ping) => onPing(ping, ping.parent_ping !== null)),
+  )
+  // The ticket is spent, so reconnecting needs a new one.
+  source.addEventListener('expired', () => {
+    source.close()
+    onExpired()
+  })
+  return source
+}
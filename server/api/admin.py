@@ -42,7 +42,10 @@ class UserAdmin(BaseUserAdmin):
             "latitude",
             "longitude",
             "parent_ping",
+            "root_ping",
+            "depth",
         )
+        list_select_related = ("user",)
         search_fields = ("user",)
         list_filter = ("user", "timestamp")
         ordering = ("-timestamp",)
@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from .caches import invalidate_user
+        from .metrics import install_query_timing
+        from .models import User
+
+        post_save.connect(invalidate_user, sender=User)
+        post_delete.connect(invalidate_user, sender=User)
+        connection_created.connect(install_query_timing)
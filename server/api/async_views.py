@@ -0,0 +1,328 @@
+"""
+ASGI-native versions of the hot read endpoints.
+
+Under ASGI every synchronous DRF view occupies a worker thread for the whole
+request. These views run on the event loop and use the async ORM instead,
+while reusing PingViewSet's queryset, filters, paginator and serializers so
+their responses match the synchronous endpoints byte for byte. They run the
+same permission and throttle checks, on the event loop, so those must not
+query the database. Non-GET methods on shared URLs are handed to the
+synchronous views.
+"""
+
+import asyncio
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import ValidationError
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated, NotFound
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from .authentication import (
+    UserClaimsJWTAuthentication,
+    redeem_stream_ticket,
+    user_from_claims,
+)
+from .broker import get_broker
+from .caches import latest_pings_cache, ping_changes, user_cache
+from .exception_handlers import custom_exception_handler
+from .models import Ping, User
+from .serializers import PingReadSerializer, UserSerializer
+from .views import (
+    LATEST_PINGS_COUNT,
+    PING_SET_AGGREGATES,
+    CurrentUserView,
+    PingViewSet,
+    attach_validators,
+    hash_payload,
+    make_validators,
+    render_latest_payload,
+    validators_from_aggregates,
+    validators_from_rows,
+)
+
+# Seconds between comment lines that keep idle event streams open.
+STREAM_KEEPALIVE_INTERVAL = 15
+
+
+class StreamingUnavailable(APIException):
+    status_code = status.HTTP_501_NOT_IMPLEMENTED
+    default_detail = "Event streams are only served by the ASGI application."
+    default_code = "streaming_unavailable"
+
+
+async def authenticate_async(request, allow_ticket=False):
+    """
+    Authenticates a request with an access token from the Authorization
+    header or, when ``allow_ticket`` is set (EventSource cannot set headers),
+    a StreamTicket in the ``ticket`` query parameter, and returns the user
+    and the validated token. Tokens with user claims are authenticated
+    without leaving the event loop.
+    """
+    authentication = UserClaimsJWTAuthentication()
+    raw_ticket = request.GET.get("ticket") if allow_ticket else None
+    if raw_ticket is not None:
+        validated_token = await sync_to_async(redeem_stream_ticket)(raw_ticket)
+    else:
+        header = authentication.get_header(request)
+        raw_token = authentication.get_raw_token(header) if header else None
+        if raw_token is None:
+            raise NotAuthenticated()
+        validated_token = authentication.get_validated_token(raw_token)
+    user = user_from_claims(validated_token)
+    if user is None:
+        user = await sync_to_async(authentication.get_user)(validated_token)
+    return user, validated_token
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    return HttpResponse(
+        JSONRenderer().render(data), status=status, content_type="application/json"
+    )
+
+
+def async_api_view(allow_ticket=False):
+    """
+    Authenticates the request and renders APIExceptions in the same error
+    envelope as custom_exception_handler.
+    """
+
+    def decorator(func):
+        @wraps(func)
+        async def view(request, *args, **kwargs):
+            try:
+                request.user, request.auth = await authenticate_async(
+                    request, allow_ticket
+                )
+                return await func(request, *args, **kwargs)
+            except APIException as exc:
+                response = custom_exception_handler(exc, {"request": request})
+                error = json_response(response.data, status=response.status_code)
+                # Such as Retry-After of throttled requests.
+                for header, value in response.items():
+                    if header != "Content-Type":
+                        error[header] = value
+                return error
+
+        return view
+
+    return decorator
+
+
+def with_sync_fallback(async_view, sync_view):
+    """Serves GET and HEAD asynchronously and everything else synchronously."""
+
+    @csrf_exempt
+    async def view(request, *args, **kwargs):
+        if request.method in ("GET", "HEAD"):
+            return await async_view(request, *args, **kwargs)
+        return await sync_to_async(sync_view)(request, *args, **kwargs)
+
+    return view
+
+
+def get_view(view_class, request, action=None, **kwargs):
+    """
+    Instantiates ``view_class`` as as_view() would for ``action``, with the
+    permission classes of its @action, and runs its permission and throttle
+    checks on the request async_api_view authenticated.
+    """
+    drf_request = Request(request)
+    drf_request.user = request.user
+    drf_request.auth = request.auth
+    initkwargs = {}
+    if action is not None:
+        initkwargs = {**getattr(getattr(view_class, action), "kwargs", {})}
+        initkwargs["action"] = action
+    view = view_class(
+        **initkwargs, request=drf_request, format_kwarg=None, args=(), kwargs=kwargs
+    )
+    view.initial(drf_request)
+    return view, drf_request
+
+
+def get_viewset(request, action, **kwargs):
+    return get_view(PingViewSet, request, action, **kwargs)
+
+
+async def conditional(request, arender, etag_parts, last_modified=None):
+    etag, last_modified = make_validators(
+        request.get_full_path(),
+        JSONRenderer.format,
+        await ping_changes.ageneration(),
+        await ping_changes.alast_modified(),
+        etag_parts,
+        last_modified,
+    )
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        response = await arender()
+    return attach_validators(response, etag, last_modified)
+
+
+@async_api_view()
+async def ping_list(request):
+    viewset, drf_request = get_viewset(request, "list")
+
+    def filter_querysets():
+        # Filter validation may look up related rows, which is synchronous.
+        return (
+            viewset.filter_queryset(viewset.get_queryset()),
+            viewset.filter_queryset(Ping.objects.all()),
+        )
+
+    paginator = viewset.paginator
+    page = None
+    if paginator.is_cursor_page(drf_request):
+        # As PingViewSet.list, cursor pages are validated by their own rows.
+        queryset = await sync_to_async(viewset.filter_queryset)(viewset.get_queryset())
+        page = await paginator.apaginate_queryset(queryset, drf_request, viewset)
+        etag_parts, last_modified = validators_from_rows(page)
+    else:
+        queryset, validator_queryset = await sync_to_async(filter_querysets)()
+        stats = await validator_queryset.order_by().aaggregate(**PING_SET_AGGREGATES)
+        paginator.count = stats["count"]
+        etag_parts, last_modified = validators_from_aggregates(stats)
+
+    async def render():
+        rows = page
+        if rows is None:
+            rows = await paginator.apaginate_queryset(queryset, drf_request, viewset)
+        data = viewset.get_serializer(rows, many=True).data
+        return json_response(paginator.get_paginated_response(data).data)
+
+    return await conditional(request, render, etag_parts, last_modified)
+
+
+@async_api_view()
+async def ping_latest(request):
+    viewset, _ = get_viewset(request, "latest")
+
+    async def build():
+        latest_pings = viewset.get_queryset().order_by("-timestamp")
+        rows = [row async for row in latest_pings[:LATEST_PINGS_COUNT]]
+        return render_latest_payload(viewset.get_serializer(rows, many=True).data)
+
+    (payload, newest), hit = await latest_pings_cache.aget_or_set(build)
+
+    async def render():
+        response = HttpResponse(payload, content_type="application/json")
+        response["X-Cache"] = "HIT" if hit else "MISS"
+        return response
+
+    return await conditional(request, render, (hash_payload(payload),), newest)
+
+
+@async_api_view()
+async def ping_detail(request, pk):
+    viewset, drf_request = get_viewset(request, "retrieve", pk=pk)
+    # Filter validation may look up related rows, which is synchronous.
+    queryset = await sync_to_async(viewset.filter_queryset)(viewset.get_queryset())
+    try:
+        ping = await queryset.filter(pk=pk).afirst()
+    except (ValueError, ValidationError):
+        ping = None
+    if ping is None:
+        raise NotFound("No Ping matches the given query.")
+    viewset.check_object_permissions(drf_request, ping)
+    (row,) = PingReadSerializer.rows([ping])
+
+    async def render():
+        return json_response(PingReadSerializer(row).data)
+
+    return await conditional(
+        request, render, (row["id"],), row["timestamp"].timestamp()
+    )
+
+
+@async_api_view()
+async def current_user(request):
+    get_view(CurrentUserView, request)
+    return json_response(UserSerializer(request.user).data)
+
+
+def format_event(event):
+    return f"event: {event['type']}\nid: {event['id']}\ndata: {event['data']}\n\n"
+
+
+@async_api_view(allow_ticket=True)
+async def ping_stream(request):
+    """
+    Server-Sent Events stream of newly created pings ("ping" events) and
+    trail responses ("response" events). Consumers that fall too far behind
+    receive an "overflow" event and are disconnected.
+
+    Opened with a StreamTicket from ``pings/stream/ticket/``, or an access
+    token in the Authorization header. The stream ends with an "expired"
+    event when that access token expires, or at a keepalive once the user
+    is deactivated or deleted, and the client has to open a new one.
+
+    Only served under ASGI: a WSGI server would collect the endless stream
+    into a list, never answering and holding a worker thread for good.
+    """
+    if not isinstance(request, ASGIRequest):
+        raise StreamingUnavailable()
+    expires_at = request.auth.get("stream_exp", request.auth["exp"])
+    user_id = request.user.pk
+    broker = get_broker()
+    subscription = broker.subscribe()
+
+    async def user_is_active():
+        try:
+            user = await sync_to_async(user_cache.get)(user_id)
+        except User.DoesNotExist:
+            return False
+        return user.is_active
+
+    async def events():
+        try:
+            yield "retry: 3000\n\n"
+            while (remaining := expires_at - time.time()) > 0:
+                try:
+                    event = await asyncio.wait_for(
+                        subscription.get(),
+                        timeout=min(STREAM_KEEPALIVE_INTERVAL, remaining),
+                    )
+                except TimeoutError:
+                    if not await user_is_active():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                if event is None:
+                    yield "event: overflow\ndata: {}\n\n"
+                    return
+                yield format_event(event)
+            yield "event: expired\ndata: {}\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(events(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+ping_list_view = with_sync_fallback(
+    ping_list, PingViewSet.as_view({"get": "list", "post": "create"})
+)
+ping_detail_view = with_sync_fallback(
+    ping_detail,
+    PingViewSet.as_view(
+        {
+            "get": "retrieve",
+            "put": "update",
+            "patch": "partial_update",
+            "delete": "destroy",
+        }
+    ),
+)
+current_user_view = with_sync_fallback(current_user, CurrentUserView.as_view())
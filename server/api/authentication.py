@@ -0,0 +1,202 @@
+"""
+Access tokens that carry the user's public fields, so authenticated
+requests need not load the user.
+
+At login and refresh the fields of UserSerializer and a user version, the
+user's ``updated_at``, are written into the access token.
+UserClaimsJWTAuthentication builds the request user from them as a model
+instance whose other fields are deferred: they are loaded, all in one
+query, only when one of them is read.
+
+Claims can be up to ACCESS_TOKEN_LIFETIME stale. When api.caches.user_cache
+holds a newer version of the user, that is used instead, and an inactive
+user is turned away, so edits and deactivation take effect early in
+processes that have the user cached. Refreshing reloads the user, and so
+always picks up deactivation.
+
+Tokens without the claims, such as those issued before this was deployed,
+fall back to loading the user, through api.caches.user_cache.
+
+The ping event stream is opened with a StreamTicket instead of an access
+token, as EventSource can only pass it in the query string.
+"""
+
+from datetime import timedelta
+
+from django.db import router
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import (
+    AuthenticationFailed,
+    InvalidToken,
+    TokenError,
+)
+from rest_framework_simplejwt.serializers import (
+    TokenObtainPairSerializer,
+    TokenRefreshSerializer,
+)
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import Token
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from .blacklist import RevocableRefreshToken, get_blacklist
+from .caches import user_cache
+from .models import User
+from .serializers import UserSerializer
+
+USER_CLAIMS = ("email", "name", "code_name")
+VERSION_CLAIM = "user_version"
+
+
+def set_user_claims(token, user):
+    for claim in USER_CLAIMS:
+        token[claim] = getattr(user, claim)
+    token[VERSION_CLAIM] = user.updated_at.isoformat()
+
+
+def check_user_is_active(user):
+    if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+        raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+
+def user_from_claims(token):
+    """
+    The user of ``token`` built from its claims, without a query, or None
+    when the token does not carry them. A newer version of the user in
+    user_cache takes precedence; raises AuthenticationFailed if it is
+    inactive.
+    """
+    if VERSION_CLAIM not in token:
+        return None
+    version = parse_datetime(token[VERSION_CLAIM])
+    cached = user_cache.peek(token[api_settings.USER_ID_CLAIM])
+    if cached is not None and cached.updated_at > version:
+        check_user_is_active(cached)
+        return cached
+    values = {
+        "id": token[api_settings.USER_ID_CLAIM],
+        "updated_at": version,
+        **{claim: token[claim] for claim in USER_CLAIMS},
+    }
+    fields = [f for f in User._meta.concrete_fields if f.attname in values]
+    return User.from_db(
+        router.db_for_read(User), values, [values[f.attname] for f in fields]
+    )
+
+
+class UserClaimsRefreshToken(RevocableRefreshToken):
+    """A refresh token whose access tokens carry the user claims."""
+
+    user = None
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token.user = user
+        return token
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        if self.user is None:
+            self.user = User.objects.get(
+                **{api_settings.USER_ID_FIELD: self[api_settings.USER_ID_CLAIM]}
+            )
+        set_user_claims(access, self.user)
+        return access
+
+
+class UserClaimsTokenObtainPairSerializer(TokenObtainPairSerializer):
+    token_class = UserClaimsRefreshToken
+
+    def validate(self, attrs):
+        data = super().validate(attrs)
+        data["user"] = UserSerializer(self.user).data
+        return data
+
+
+class UserClaimsTokenRefreshSerializer(TokenRefreshSerializer):
+    """
+    TokenRefreshSerializer.validate, passing the user it loads to check
+    that the account is active on to the new access token's claims rather
+    than loading it again.
+    """
+
+    token_class = UserClaimsRefreshToken
+
+    def validate(self, attrs):
+        refresh = self.token_class(attrs["refresh"])
+        try:
+            user = User.objects.get(
+                **{api_settings.USER_ID_FIELD: refresh[api_settings.USER_ID_CLAIM]}
+            )
+        except (KeyError, User.DoesNotExist):
+            user = None
+        if user is None or not api_settings.USER_AUTHENTICATION_RULE(user):
+            raise AuthenticationFailed(
+                self.error_messages["no_active_account"], "no_active_account"
+            )
+        refresh.user = user
+        data = {"access": str(refresh.access_token)}
+
+        if api_settings.ROTATE_REFRESH_TOKENS:
+            if api_settings.BLACKLIST_AFTER_ROTATION:
+                refresh.blacklist()
+            refresh.set_jti()
+            refresh.set_exp()
+            refresh.set_iat()
+            data["refresh"] = str(refresh)
+
+        data["user"] = UserSerializer(user).data
+        return data
+
+
+class UserClaimsJWTAuthentication(JWTAuthentication):
+    def get_user(self, validated_token):
+        user = user_from_claims(validated_token)
+        if user is not None:
+            return user
+        if api_settings.CHECK_REVOKE_TOKEN:
+            return super().get_user(validated_token)
+        try:
+            user = user_cache.get(validated_token[api_settings.USER_ID_CLAIM])
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+        except User.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        check_user_is_active(user)
+        return user
+
+
+class StreamTicket(Token):
+    """
+    A single use token opening one ping event stream. Query strings end up
+    in server and proxy access logs, so the ticket expires within seconds
+    and is revoked once redeemed. It carries the user claims of the access
+    token it was issued for and, as ``stream_exp``, that token's expiry,
+    which is when the stream ends.
+    """
+
+    token_type = "stream"
+    lifetime = timedelta(seconds=30)
+
+    @classmethod
+    def for_access_token(cls, user, access_token):
+        ticket = cls.for_user(user)
+        set_user_claims(ticket, user)
+        ticket["stream_exp"] = access_token["exp"]
+        return ticket
+
+
+def redeem_stream_ticket(raw_ticket):
+    """The valid, unused StreamTicket ``raw_ticket``, now revoked."""
+    try:
+        ticket = StreamTicket(raw_ticket)
+    except TokenError as e:
+        raise InvalidToken(e.args[0])
+    if not get_blacklist().revoke(
+        ticket[api_settings.JTI_CLAIM], datetime_from_epoch(ticket["exp"])
+    ):
+        raise InvalidToken(_("Stream ticket was already used"))
+    return ticket
@@ -0,0 +1,548 @@
+"""
+Micro benchmarks for the API, run with ``manage.py benchmark <scenario>``.
+
+Each scenario seeds its own data inside a transaction that is rolled back
+when it finishes, so they can be pointed at a development database.
+"""
+
+import math
+import random
+import statistics
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth import hashers
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from . import geo
+from .authentication import UserClaimsJWTAuthentication, UserClaimsRefreshToken
+from .filters import GeoFilterBackend, distance_km
+from .metrics import RequestTimings
+from .models import Ping, PingRollup, User
+from .pagination import KeysetPagination
+from .rollups import rollup_pings
+from .serializers import MAX_BULK_PINGS, PingReadSerializer, PingSerializer
+from .views import (
+    CurrentUserView,
+    CustomTokenBlacklistView,
+    CustomTokenRefreshView,
+    PingViewSet,
+)
+
+SCENARIOS = {}
+BATCH_SIZE = 5000
+
+
+def scenario(name):
+    def decorator(func):
+        SCENARIOS[name] = func
+        return func
+
+    return decorator
+
+
+def measure(func, repeat=20):
+    """Times ``func`` and returns summary statistics in milliseconds."""
+    func()  # warm up
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "min_ms": round(min(samples), 3),
+        "median_ms": round(statistics.median(samples), 3),
+        "mean_ms": round(statistics.fmean(samples), 3),
+    }
+
+
+class _Rollback(Exception):
+    pass
+
+
+@contextmanager
+def scratch_data():
+    """Runs the block in a transaction that is always rolled back."""
+    try:
+        with transaction.atomic():
+            yield
+            raise _Rollback
+    except _Rollback:
+        pass
+
+
+def create_users(count):
+    users = [
+        User(email=f"bench{i}@example.com", code_name=f"bench{i}", name="Bench")
+        for i in range(count)
+    ]
+    return User.objects.bulk_create(users, batch_size=BATCH_SIZE)
+
+
+def create_pings(count, users):
+    pings = [
+        Ping(
+            user=users[i % len(users)],
+            latitude=(i * 7.3) % 180 - 90,
+            longitude=(i * 13.7) % 360 - 180,
+        )
+        for i in range(count)
+    ]
+    return Ping.objects.bulk_create(pings, batch_size=BATCH_SIZE)
+
+
+def create_uniform_pings(count, users, rng):
+    """Creates pings distributed uniformly over the sphere."""
+    for start in range(0, count, BATCH_SIZE):
+        Ping.objects.bulk_create(
+            Ping(
+                user=users[i % len(users)],
+                latitude=math.degrees(math.asin(rng.uniform(-1, 1))),
+                longitude=rng.uniform(-180, 180),
+            )
+            for i in range(start, min(start + BATCH_SIZE, count))
+        )
+
+
+@scenario("pagination")
+def pagination_scenario(size):
+    """Deep page latency of page number versus keyset pagination."""
+    factory = APIRequestFactory(HTTP_HOST="localhost")
+    queryset = Ping.objects.order_by("-timestamp")
+    page_size = KeysetPagination.page_size
+    results = []
+    with scratch_data():
+        create_pings(size, create_users(10))
+        ordered = Ping.objects.order_by("-timestamp", "-id")
+        page = 1
+        while (page - 1) * page_size < size:
+            request = Request(factory.get("/api/v1/pings/", {"page": page}))
+            offset = measure(
+                lambda: list(
+                    PageNumberPagination().paginate_queryset(queryset, request)
+                )
+            )
+
+            if page == 1:
+                keyset_request = Request(factory.get("/api/v1/pings/"))
+            else:
+                boundary = ordered[(page - 1) * page_size - 1]
+                paginator = KeysetPagination()
+                paginator.base_url = "/api/v1/pings/"
+                paginator.field = "timestamp"
+                keyset_request = Request(
+                    factory.get(paginator.encode_cursor(boundary))
+                )
+            keyset = measure(
+                lambda: KeysetPagination().paginate_queryset(queryset, keyset_request)
+            )
+
+            results.append({"page": page, "offset": offset, "keyset": keyset})
+            page *= 10
+    return results
+
+
+@scenario("serializers")
+def serializers_scenario(size):
+    """Serializing ``size`` pings with PingSerializer versus PingReadSerializer."""
+    results = {}
+    with scratch_data():
+        create_pings(size, create_users(10))
+        queryset = PingViewSet.queryset.order_by("-timestamp")
+        pings = list(queryset)
+        rows = list(PingReadSerializer.values(queryset))
+        results["serialize"] = {
+            "model_serializer": measure(
+                lambda: PingSerializer(pings, many=True).data, repeat=5
+            ),
+            "values_serializer": measure(
+                lambda: PingReadSerializer(rows, many=True).data, repeat=5
+            ),
+        }
+        results["query_and_serialize"] = {
+            "model_serializer": measure(
+                lambda: PingSerializer(queryset.all(), many=True).data, repeat=5
+            ),
+            "values_serializer": measure(
+                lambda: PingReadSerializer(
+                    PingReadSerializer.values(queryset), many=True
+                ).data,
+                repeat=5,
+            ),
+        }
+    return results
+
+
+def throughput(func, count):
+    """Runs ``func`` once and returns its rate over ``count`` items."""
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    return {
+        "pings": count,
+        "seconds": round(elapsed, 3),
+        "pings_per_second": round(count / elapsed, 1),
+    }
+
+
+@scenario("bulk_ingest")
+def bulk_ingest_scenario(size):
+    """Ingesting pings one POST at a time versus through /pings/bulk/."""
+    factory = APIRequestFactory(HTTP_HOST="localhost")
+    create_view = PingViewSet.as_view({"post": "create"})
+    bulk_view = PingViewSet.as_view({"post": "bulk"})
+    # Single POSTs are slow enough that a sample gives the rate.
+    single_count = min(size, 1000)
+    results = {}
+    with scratch_data():
+        user = create_users(1)[0]
+        fixes = [
+            {"latitude": (i * 7.3) % 180 - 90, "longitude": (i * 13.7) % 360 - 180}
+            for i in range(size)
+        ]
+
+        def post(view, url, data):
+            request = factory.post(url, data, format="json")
+            force_authenticate(request, user=user)
+            response = view(request)
+            assert response.status_code == 201, response.data
+
+        def single_posts():
+            for fix in fixes[:single_count]:
+                post(create_view, "/api/v1/pings/", {**fix, "user_id": user.id})
+
+        def bulk_posts():
+            for start in range(0, size, MAX_BULK_PINGS):
+                batch = fixes[start : start + MAX_BULK_PINGS]
+                post(bulk_view, "/api/v1/pings/bulk/", {"pings": batch})
+
+        results["single"] = throughput(single_posts, single_count)
+        results["bulk"] = throughput(bulk_posts, size)
+    results["speedup"] = round(
+        results["bulk"]["pings_per_second"] / results["single"]["pings_per_second"],
+        1,
+    )
+    return results
+
+
+@scenario("export")
+def export_scenario(size):
+    """Streaming ``size`` pings from /pings/export/ as NDJSON and CSV."""
+    factory = APIRequestFactory(HTTP_HOST="localhost")
+    view = PingViewSet.as_view({"get": "export"}, **PingViewSet.export.kwargs)
+    results = {}
+    with scratch_data():
+        user = create_users(1)[0]
+        create_pings(size, [user])
+        for export_format in ("ndjson", "csv"):
+            request = factory.get("/api/v1/pings/export/", {"format": export_format})
+            force_authenticate(request, user=user)
+            # Tracing slows the export down, so timings are taken separately.
+            start = time.perf_counter()
+            size_bytes = sum(len(chunk) for chunk in view(request).streaming_content)
+            elapsed = time.perf_counter() - start
+            tracemalloc.start()
+            try:
+                for _ in view(request).streaming_content:
+                    pass
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            results[export_format] = {
+                "rows": size,
+                "megabytes": round(size_bytes / 2**20, 1),
+                "seconds": round(elapsed, 3),
+                "rows_per_second": round(size / elapsed, 1),
+                "peak_traced_mb": round(peak / 2**20, 2),
+            }
+    return results
+
+
+GEO_QUERIES = {
+    "radius_500km_london": {"near": "51.5074,-0.1278", "radius_km": 500},
+    "radius_5km_london": {"near": "51.5074,-0.1278", "radius_km": 5},
+    "bbox_europe": {"bbox": "-12,35,30,60"},
+    "bbox_city": {"bbox": "-0.3,51.4,0.1,51.6"},
+    "bbox_antimeridian": {"bbox": "170,-25,-170,-10"},
+}
+
+
+def _unindexed(queryset, params):
+    """The same spatial filter over expressions no index can serve."""
+    if "bbox" in params:
+        boxes = geo.bbox_boxes(*map(float, params["bbox"].split(",")))
+    else:
+        latitude, longitude = map(float, params["near"].split(","))
+        boxes = geo.radius_boxes(latitude, longitude, params["radius_km"])
+    condition = Q()
+    for min_lat, min_lon, max_lat, max_lon in boxes:
+        condition |= Q(
+            scan_lat__gte=min_lat,
+            scan_lat__lte=max_lat,
+            scan_lon__gte=min_lon,
+            scan_lon__lte=max_lon,
+        )
+    queryset = queryset.alias(
+        scan_lat=F("latitude") + 0.0, scan_lon=F("longitude") + 0.0
+    ).filter(condition)
+    if "near" in params:
+        queryset = queryset.alias(
+            distance_km=distance_km(latitude, longitude)
+        ).filter(distance_km__lte=params["radius_km"])
+    return queryset
+
+
+@scenario("geo")
+def geo_scenario(size):
+    """Spatial filters through GeoFilterBackend versus full scans."""
+    factory = APIRequestFactory()
+    backend = GeoFilterBackend()
+    rng = random.Random(0)
+    results = {"vendor": connection.vendor}
+    with scratch_data():
+        create_uniform_pings(size, create_users(10), rng)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+        for name, params in GEO_QUERIES.items():
+            request = Request(factory.get("/api/v1/pings/", params))
+            queryset = backend.filter_queryset(request, Ping.objects.only("id"), None)
+            scan_queryset = _unindexed(Ping.objects.only("id"), params)
+            results[name] = {
+                "matches": queryset.count(),
+                "plan": queryset.explain().splitlines()[-1].strip(),
+                "indexed": measure(lambda: list(queryset.all()), repeat=5),
+                "full_scan": measure(lambda: list(scan_queryset.all()), repeat=3),
+            }
+    return results
+
+
+@scenario("clusters")
+def clusters_scenario(size):
+    """/pings/clusters/ at several zooms versus rendering every ping."""
+    factory = APIRequestFactory(HTTP_HOST="localhost")
+    view = PingViewSet.as_view({"get": "clusters"}, **PingViewSet.clusters.kwargs)
+    results = {}
+    with scratch_data():
+        user = create_users(1)[0]
+        create_uniform_pings(size, [user], random.Random(0))
+
+        def render_all():
+            rows = PingReadSerializer.values(PingViewSet.queryset)
+            return JSONRenderer().render(PingReadSerializer(rows, many=True).data)
+
+        results["all_pings"] = {
+            "bytes": len(render_all()),
+            **measure(render_all, repeat=3),
+        }
+        for name, params in {
+            "zoom_2": {"zoom": 2},
+            "zoom_4": {"zoom": 4},
+            "zoom_6": {"zoom": 6},
+            "zoom_8_europe": {"zoom": 8, "bbox": "-12,35,30,60"},
+        }.items():
+            request = factory.get("/api/v1/pings/clusters/", params)
+            force_authenticate(request, user=user)
+
+            def render():
+                response = view(request)
+                response.render()
+                return response
+
+            response = render()
+            results[name] = {
+                "clusters": len(response.data["clusters"]),
+                "bytes": len(response.content),
+                **measure(render, repeat=5),
+            }
+    return results
+
+
+@scenario("stats")
+def stats_scenario(size):
+    """/pings/stats/ served live from pings versus from rollups."""
+    factory = APIRequestFactory(HTTP_HOST="localhost")
+    view = PingViewSet.as_view({"get": "stats"}, **PingViewSet.stats.kwargs)
+    now = timezone.now()
+    results = {}
+    with scratch_data():
+        users = create_users(10)
+        pings = create_pings(size, users)
+        # Spread the pings over the last day.
+        for ping in pings:
+            ping.timestamp = now - timedelta(seconds=(ping.id * 7919) % 86400)
+        Ping.objects.bulk_update(pings, ["timestamp"], batch_size=BATCH_SIZE)
+        PingRollup.objects.all().delete()
+        requests = {
+            "hourly_24h": {"interval": "hour", "since": now - timedelta(days=1)},
+            "per_minute_1h": {"interval": "minute"},
+            "hourly_24h_user": {
+                "interval": "hour",
+                "since": now - timedelta(days=1),
+                "user": users[0].id,
+            },
+        }
+        for name in requests:
+            request = factory.get("/api/v1/pings/stats/", requests[name])
+            force_authenticate(request, user=users[0])
+            requests[name] = request
+
+        for name, request in requests.items():
+            results[name] = {"live": measure(lambda: view(request), repeat=5)}
+        start = time.perf_counter()
+        buckets = rollup_pings()
+        results["rollup"] = {
+            "buckets": buckets,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+        for name, request in requests.items():
+            results[name]["rollups"] = measure(lambda: view(request), repeat=5)
+    return results
+
+
+@scenario("auth")
+def auth_scenario(size):
+    """
+    Authenticated GETs with SimpleJWT's JWTAuthentication, which loads the
+    user, versus UserClaimsJWTAuthentication, which builds it from claims.
+    """
+    factory = APIRequestFactory(HTTP_HOST="localhost")
+    backends = {
+        "load_user": JWTAuthentication,
+        "user_claims": UserClaimsJWTAuthentication,
+    }
+    views = {
+        "current_user": (CurrentUserView, {}, "/api/v1/auth/current_user/"),
+        "latest": (
+            PingViewSet,
+            {"actions": {"get": "latest"}},
+            "/api/v1/pings/latest/",
+        ),
+    }
+    results = {}
+    with scratch_data():
+        user = create_users(1)[0]
+        create_pings(size, [user])
+        access = UserClaimsRefreshToken.for_user(user).access_token
+        authorization = f"Bearer {access}"
+        for name, (view_class, kwargs, url) in views.items():
+            results[name] = {}
+            for backend, authentication_class in backends.items():
+                view = view_class.as_view(
+                    **kwargs, authentication_classes=[authentication_class]
+                )
+
+                def get():
+                    request = factory.get(url, HTTP_AUTHORIZATION=authorization)
+                    response = view(request)
+                    assert response.status_code == 200, response.data
+
+                timings = measure(get, repeat=200)
+                with CaptureQueriesContext(connection) as context:
+                    get()
+                results[name][backend] = {**timings, "queries": len(context)}
+    return results
+
+
+@scenario("refresh")
+def refresh_scenario(size):
+    """
+    ``size`` refresh token rotations through /auth/refresh/, each with the
+    token the previous one returned, then a logout.
+    """
+    factory = APIRequestFactory(HTTP_HOST="localhost")
+    refresh_view = CustomTokenRefreshView.as_view()
+    logout_view = CustomTokenBlacklistView.as_view()
+    results = {}
+    with scratch_data():
+        user = create_users(1)[0]
+        refresh = str(UserClaimsRefreshToken.for_user(user))
+
+        def post(view, url, token):
+            request = factory.post(url, {"refresh": token}, format="json")
+            response = view(request)
+            assert response.status_code in (200, 204), response.data
+            return response
+
+        def rotate():
+            nonlocal refresh
+            for _ in range(size):
+                response = post(refresh_view, "/api/v1/auth/refresh/", refresh)
+                refresh = response.cookies["refresh_token"].value
+
+        timings = RequestTimings()
+        start = time.perf_counter()
+        with connection.execute_wrapper(timings):
+            rotate()
+        elapsed = time.perf_counter() - start
+        results["rotate"] = {
+            "refreshes": size,
+            "seconds": round(elapsed, 3),
+            "refreshes_per_second": round(size / elapsed, 1),
+            "queries_per_refresh": round(timings.queries / size, 1),
+            "db_ms_per_refresh": round(timings.db_time * 1000 / size, 3),
+        }
+        timings = RequestTimings()
+        with connection.execute_wrapper(timings):
+            post(logout_view, "/api/v1/auth/logout/", refresh)
+        results["logout"] = {"queries": timings.queries}
+    return results
+
+
+@scenario("login")
+def login_scenario(size):
+    """
+    Password checks as logins run them, from 1, 8 and 32 threads at once:
+    directly on the request threads versus through api.hashing's pool.
+    Meanwhile /auth/current_user/ is served on the main thread, its latency
+    showing what a burst of logins leaves other requests.
+    """
+    factory = APIRequestFactory(HTTP_HOST="localhost")
+    view = CurrentUserView.as_view()
+    # Each check takes a hash's full cost, so a sample gives the rate.
+    count = min(size, 64)
+    password = "benchPassword123!"
+    user = User(email="bench@example.com", code_name="bench", name="Bench")
+    user.set_password(password)
+    checks = {
+        "request_threads": lambda: hashers.check_password(password, user.password),
+        "pool": lambda: user.check_password(password),
+    }
+
+    def current_user():
+        request = factory.get("/api/v1/auth/current_user/")
+        force_authenticate(request, user=user)
+        start = time.perf_counter()
+        view(request)
+        return (time.perf_counter() - start) * 1000
+
+    results = {}
+    for concurrency in (1, 8, 32):
+        results[concurrency] = {}
+        for name, check in checks.items():
+            with ThreadPoolExecutor(concurrency) as executor:
+                start = time.perf_counter()
+                futures = [executor.submit(check) for _ in range(count)]
+                latencies = []
+                while not all(future.done() for future in futures):
+                    latencies.append(current_user())
+                    time.sleep(0.005)
+                assert all(future.result() for future in futures)
+                elapsed = time.perf_counter() - start
+            results[concurrency][name] = {
+                "logins_per_second": round(count / elapsed, 2),
+                "current_user_median_ms": round(statistics.median(latencies), 3),
+                "current_user_max_ms": round(max(latencies), 3),
+            }
+    return results
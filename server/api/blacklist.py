@@ -0,0 +1,156 @@
+"""
+Revoked refresh tokens.
+
+SimpleJWT's token_blacklist app stores every refresh token it issues, full
+text included, as an OutstandingToken, and adds a BlacklistedToken row for
+each one rotated or logged out: over a dozen queries per refresh, into
+tables nothing prunes. RevocableRefreshToken records nothing when issued
+and only the id and expiry of revoked tokens, in the backend named by the
+TOKEN_BLACKLIST_BACKEND setting:
+
+- DatabaseBlacklist keeps RevokedToken rows, looked up by primary key and
+  pruned through their expiry index by ``manage.py prune_tokens``.
+- CacheBlacklist keeps keys in a Django cache that expire with the tokens.
+  It is only safe with a cache shared by every server process that never
+  evicts keys early, such as Redis without an eviction policy.
+
+Revoking is an atomic insert-if-absent, so a refresh token can be rotated
+once even by concurrent requests: the others are told it is blacklisted.
+"""
+
+import math
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections, router
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.serializers import TokenBlacklistSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import BlacklistMixin, RefreshToken
+from rest_framework_simplejwt.utils import datetime_from_epoch
+
+from .models import RevokedToken
+
+PRUNE_BATCH_SIZE = 5000
+
+
+class DatabaseBlacklist:
+    def revoke(self, jti, expires_at):
+        """Revokes ``jti`` until ``expires_at``; False if it already was."""
+        connection = connections[router.db_for_write(RevokedToken)]
+        table = connection.ops.quote_name(RevokedToken._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table} (jti, expires_at) VALUES (%s, %s) "
+                "ON CONFLICT (jti) DO NOTHING",
+                [jti, connection.ops.adapt_datetimefield_value(expires_at)],
+            )
+            return cursor.rowcount == 1
+
+    def is_revoked(self, jti):
+        return RevokedToken.objects.filter(jti=jti).exists()
+
+    def prune(self, batch_size=PRUNE_BATCH_SIZE):
+        """Deletes expired entries ``batch_size`` at a time, yielding counts."""
+        now = timezone.now()
+        expired = RevokedToken.objects.filter(expires_at__lte=now)
+        while True:
+            batch = list(expired.values_list("jti", flat=True)[:batch_size])
+            if not batch:
+                return
+            yield RevokedToken.objects.filter(jti__in=batch).delete()[0]
+
+
+class CacheBlacklist:
+    def __init__(self):
+        self.cache = caches[getattr(settings, "TOKEN_BLACKLIST_CACHE", "default")]
+
+    def key(self, jti):
+        return f"api:revoked:{jti}"
+
+    def revoke(self, jti, expires_at):
+        timeout = math.ceil((expires_at - timezone.now()).total_seconds())
+        return self.cache.add(self.key(jti), 1, timeout=max(timeout, 1))
+
+    def is_revoked(self, jti):
+        return self.cache.has_key(self.key(jti))
+
+    def prune(self, batch_size=PRUNE_BATCH_SIZE):
+        # Keys expire with their tokens.
+        yield from ()
+
+
+def prune_outstanding_tokens(batch_size=PRUNE_BATCH_SIZE):
+    """
+    Deletes the token_blacklist app's expired rows, written before
+    RevocableRefreshToken was used, ``batch_size`` tokens at a time.
+    """
+    if not apps.is_installed("rest_framework_simplejwt.token_blacklist"):
+        return
+    from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+
+    expired = OutstandingToken.objects.filter(expires_at__lte=timezone.now())
+    while True:
+        batch = list(expired.values_list("id", flat=True)[:batch_size])
+        if not batch:
+            return
+        OutstandingToken.objects.filter(id__in=batch).delete()
+        yield len(batch)
+
+
+_blacklist = None
+_blacklist_lock = threading.Lock()
+
+
+def get_blacklist():
+    global _blacklist
+    if _blacklist is None:
+        with _blacklist_lock:
+            if _blacklist is None:
+                blacklist_class = import_string(
+                    getattr(
+                        settings,
+                        "TOKEN_BLACKLIST_BACKEND",
+                        "api.blacklist.DatabaseBlacklist",
+                    )
+                )
+                _blacklist = blacklist_class()
+    return _blacklist
+
+
+class RevocableRefreshToken(RefreshToken):
+    """A refresh token that is recorded in get_blacklist() once revoked."""
+
+    @classmethod
+    def for_user(cls, user):
+        # Skips BlacklistMixin.for_user, which stores every issued token.
+        return super(BlacklistMixin, cls).for_user(user)
+
+    def outstand(self):
+        return None
+
+    def verify(self, *args, **kwargs):
+        self.check_blacklist()
+        # BlacklistMixin.verify would check the old tables as well.
+        super(BlacklistMixin, self).verify(*args, **kwargs)
+
+    def check_blacklist(self):
+        if get_blacklist().is_revoked(self[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        """Revokes the token; raises TokenError if it already was."""
+        revoked = get_blacklist().revoke(
+            self[api_settings.JTI_CLAIM], datetime_from_epoch(self["exp"])
+        )
+        if not revoked:
+            raise TokenError(_("Token is blacklisted"))
+
+
+class RevocableTokenBlacklistSerializer(TokenBlacklistSerializer):
+    token_class = RevocableRefreshToken
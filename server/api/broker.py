@@ -0,0 +1,104 @@
+"""
+Fan-out of ping events to streaming subscribers.
+
+Views publish from synchronous code; subscribers consume from the ASGI event
+loop. The broker in use is configured by the ``PING_BROKER`` setting so the
+in-process implementation can be replaced by one backed by an external
+pub/sub service when running several server processes.
+"""
+
+import asyncio
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+from rest_framework.renderers import JSONRenderer
+
+# Queued events a subscriber may fall behind by before it is disconnected.
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class Subscription:
+    """An event queue bound to the event loop of the consuming request."""
+
+    def __init__(self, max_size=SUBSCRIBER_QUEUE_SIZE):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_size)
+        self.overflowed = False
+
+    def deliver(self, event):
+        # Runs on self.loop, so it never races get().
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A slow consumer is cut off rather than buffered without bound;
+            # it reconnects and refetches what it missed.
+            self.overflowed = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+    async def get(self):
+        """Returns the next event, or None once the subscriber overflowed."""
+        return await self.queue.get()
+
+
+class InProcessBroker:
+    """Delivers events to subscribers within the current process only."""
+
+    def __init__(self, max_queue_size=SUBSCRIBER_QUEUE_SIZE):
+        self.max_queue_size = max_queue_size
+        self.subscriptions = set()
+        self.lock = threading.Lock()
+
+    def subscribe(self):
+        subscription = Subscription(self.max_queue_size)
+        with self.lock:
+            self.subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self.subscriptions.discard(subscription)
+
+    def publish(self, event):
+        with self.lock:
+            subscriptions = list(self.subscriptions)
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.deliver, event)
+            except RuntimeError:
+                # The consuming event loop has shut down.
+                self.unsubscribe(subscription)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                broker_class = import_string(
+                    getattr(settings, "PING_BROKER", "api.broker.InProcessBroker")
+                )
+                _broker = broker_class()
+    return _broker
+
+
+def publish_on_commit(event_type, event_id, data):
+    """
+    Publishes ``data`` as an ``event_type`` event once the write commits. The
+    payload is rendered once here rather than once per subscriber.
+    """
+    event = {
+        "type": event_type,
+        "id": event_id,
+        "data": JSONRenderer().render(data).decode(),
+    }
+    transaction.on_commit(lambda: get_broker().publish(event), robust=True)
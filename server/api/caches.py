@@ -0,0 +1,265 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import metrics
+from .models import User
+
+
+class ChangeTracker:
+    """
+    A generation counter and last write time for a set of rows, kept in the
+    cache backend so every worker sharing it sees the same values.
+
+    Writers call ``changed()``, which bumps both once the surrounding
+    transaction commits. Readers fold the generation into cache keys and
+    HTTP validators.
+    """
+
+    def __init__(self, key, alias="default"):
+        self.key = key
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def generation(self):
+        return self.cache.get(f"{self.key}:generation", 0)
+
+    async def ageneration(self):
+        return await self.cache.aget(f"{self.key}:generation", 0)
+
+    def last_modified(self):
+        """Epoch seconds of the last recorded write, or None if unknown."""
+        return self.cache.get(f"{self.key}:modified")
+
+    async def alast_modified(self):
+        return await self.cache.aget(f"{self.key}:modified")
+
+    def changed(self):
+        transaction.on_commit(self._bump, robust=True)
+
+    def _bump(self):
+        increment(self.cache, f"{self.key}:generation")
+        self.cache.set(f"{self.key}:modified", time.time(), timeout=None)
+
+
+def increment(cache, key, timeout=None):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Missing counter; add() keeps concurrent initialisations safe.
+        if cache.add(key, 1, timeout=timeout):
+            return 1
+        return cache.incr(key)
+
+
+async def aincrement(cache, key):
+    try:
+        return await cache.aincr(key)
+    except ValueError:
+        if await cache.aadd(key, 1, timeout=None):
+            return 1
+        return await cache.aincr(key)
+
+
+class GenerationalCache:
+    """
+    Caches a single payload under the generation of a ChangeTracker.
+
+    Writers bump the generation instead of deleting the payload, so a reader
+    that raced a write can only ever store its result under a generation
+    nobody reads any more. Hit and miss counters live in the cache backend
+    itself so they aggregate across workers when a shared backend is
+    configured.
+    """
+
+    def __init__(self, key, tracker, timeout=60):
+        self.key = key
+        self.tracker = tracker
+        self.timeout = timeout
+
+    @property
+    def cache(self):
+        return self.tracker.cache
+
+    def get_or_set(self, build):
+        """
+        Returns ``(payload, hit)``, calling ``build`` to produce the payload
+        when the current generation is not cached yet.
+        """
+        payload_key = f"{self.key}:{self.tracker.generation()}"
+        payload = self.cache.get(payload_key)
+        if payload is not None:
+            increment(self.cache, f"{self.key}:hits")
+            return payload, True
+        increment(self.cache, f"{self.key}:misses")
+        payload = build()
+        self.cache.set(payload_key, payload, self.timeout)
+        return payload, False
+
+    async def aget_or_set(self, abuild):
+        """Async variant of get_or_set taking a coroutine function."""
+        payload_key = f"{self.key}:{await self.tracker.ageneration()}"
+        payload = await self.cache.aget(payload_key)
+        if payload is not None:
+            await aincrement(self.cache, f"{self.key}:hits")
+            return payload, True
+        await aincrement(self.cache, f"{self.key}:misses")
+        payload = await abuild()
+        await self.cache.aset(payload_key, payload, self.timeout)
+        return payload, False
+
+    def stats(self):
+        counts = self.cache.get_many([f"{self.key}:hits", f"{self.key}:misses"])
+        hits = counts.get(f"{self.key}:hits", 0)
+        misses = counts.get(f"{self.key}:misses", 0)
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_ratio": round(hits / total, 4) if total else None,
+        }
+
+    def reset_stats(self):
+        self.cache.delete_many([f"{self.key}:hits", f"{self.key}:misses"])
+
+
+ping_changes = ChangeTracker("api:pings")
+
+latest_pings_cache = GenerationalCache(
+    "api:pings:latest",
+    ping_changes,
+    timeout=getattr(settings, "LATEST_PINGS_CACHE_TIMEOUT", 60),
+)
+
+
+class UserCache:
+    """
+    A small in-process LRU cache of users by id, whose entries expire after
+    ``timeout`` seconds.
+
+    Saving or deleting a user evicts it from the cache of the process that
+    did so (see ApiConfig.ready); other processes see the change once their
+    entry expires, so ``timeout`` bounds how stale a user can be. Callers get
+    their own copy of the cached user. Unlike GenerationalCache the counters
+    are per process.
+    """
+
+    def __init__(self, size=1024, timeout=30, enabled=True):
+        self.size = size
+        self.timeout = timeout
+        self.enabled = enabled
+        # {user id: (expiry, user)}, least recently used first.
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, user_id):
+        """The user with ``user_id``; raises User.DoesNotExist like get()."""
+        if not self.enabled:
+            return User.objects.get(pk=user_id)
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(user_id)
+                self.hits += 1
+                return copy.copy(entry[1])
+            self.misses += 1
+        user = User.objects.get(pk=user_id)
+        with self.lock:
+            self.entries[user_id] = (now + self.timeout, user)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return copy.copy(user)
+
+    def peek(self, user_id):
+        """The cached user with ``user_id``, or None, without a query."""
+        if not self.enabled:
+            return None
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None or entry[0] <= time.monotonic():
+                return None
+            return copy.copy(entry[1])
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self.entries),
+                "max_size": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 4) if total else None,
+            }
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = self.misses = self.evictions = 0
+
+
+def invalidate_user(sender, instance, **kwargs):
+    """post_save / post_delete receiver evicting a user from user_cache."""
+    user_cache.invalidate(instance.pk)
+    # A concurrent request may have cached the old row before the commit.
+    transaction.on_commit(lambda: user_cache.invalidate(instance.pk), robust=True)
+
+
+user_cache = UserCache(
+    size=getattr(settings, "USER_CACHE_SIZE", 1024),
+    timeout=getattr(settings, "USER_CACHE_TIMEOUT", 30),
+    enabled=getattr(settings, "USER_CACHE_ENABLED", True),
+)
+
+# The counters are per process, like those of api.metrics.
+metrics.registry.register(
+    metrics.Callback(
+        "user_cache_hits_total",
+        "Users found in user_cache.",
+        lambda: user_cache.stats()["hits"],
+        type="counter",
+    )
+)
+metrics.registry.register(
+    metrics.Callback(
+        "user_cache_misses_total",
+        "Users loaded into user_cache.",
+        lambda: user_cache.stats()["misses"],
+        type="counter",
+    )
+)
+metrics.registry.register(
+    metrics.Callback(
+        "user_cache_evictions_total",
+        "Users evicted from a full user_cache.",
+        lambda: user_cache.stats()["evictions"],
+        type="counter",
+    )
+)
+metrics.registry.register(
+    metrics.Callback(
+        "user_cache_size",
+        "Users in user_cache.",
+        lambda: user_cache.stats()["size"],
+    )
+)
@@ -0,0 +1,191 @@
+import math
+
+from django.db import connections
+from django.db.models import BooleanField, F, FloatField, Func, IntegerField, Q, Value
+from django.db.models.functions import (
+    ASin,
+    Cast,
+    Cos,
+    Floor,
+    Least,
+    Power,
+    Radians,
+    Sin,
+    Sqrt,
+)
+from django_filters.rest_framework import FilterSet, NumberFilter
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from . import geo
+from .models import Ping
+
+
+class PointInBox(Func):
+    """
+    ``point(longitude, latitude) <@ box(...)`` on Postgres, which the GiST
+    index created by migration 0008 answers.
+    """
+
+    output_field = BooleanField()
+
+    def __init__(self, box):
+        min_lat, min_lon, max_lat, max_lon = box
+        super().__init__(
+            F("longitude"),
+            F("latitude"),
+            *(Value(float(value)) for value in (min_lon, min_lat, max_lon, max_lat)),
+        )
+
+    def as_sql(self, compiler, connection, **extra_context):
+        parts, params = [], []
+        for expression in self.get_source_expressions():
+            sql, expression_params = compiler.compile(expression)
+            parts.append(sql)
+            params.extend(expression_params)
+        template = "(point(%s, %s) <@ box(point(%s, %s), point(%s, %s)))"
+        return template % tuple(parts), params
+
+
+def boxes_q(boxes, vendor=None):
+    """The exact condition for positions inside any of ``boxes``."""
+    condition = Q()
+    for box in boxes:
+        if vendor == "postgresql":
+            condition |= Q(PointInBox(box))
+            continue
+        min_lat, min_lon, max_lat, max_lon = box
+        condition |= Q(
+            latitude__gte=min_lat,
+            latitude__lte=max_lat,
+            longitude__gte=min_lon,
+            longitude__lte=max_lon,
+        )
+    return condition
+
+
+def distance_km(latitude, longitude):
+    """Haversine distance in km from a point to each ping's position."""
+    half_dlat = Radians(F("latitude") - latitude) / 2
+    half_dlon = Radians(F("longitude") - longitude) / 2
+    a = Power(Sin(half_dlat), 2) + Value(math.cos(math.radians(latitude))) * Cos(
+        Radians(F("latitude"))
+    ) * Power(Sin(half_dlon), 2)
+    # Rounding can push ``a`` just above 1, outside the domain of asin.
+    return Value(2 * geo.EARTH_RADIUS_KM) * ASin(
+        Sqrt(Least(a, Value(1.0), output_field=FloatField()))
+    )
+
+
+def grid_cell(zoom):
+    """
+    The row and column of each ping's cell in the grid at ``zoom`` (see
+    geo.cell_size). Positions on the north pole and on the antimeridian at
+    +180 fall into the last row and column.
+    """
+    height, width = geo.cell_size(zoom)
+    last = Value(2**zoom - 1)
+    row = Floor((F("latitude") + 90.0) / height)
+    column = Floor((F("longitude") + 180.0) / width)
+    return (
+        Cast(Least(row, last), IntegerField()),
+        Cast(Least(column, last), IntegerField()),
+    )
+
+
+def _parse_floats(params, name, count):
+    try:
+        values = [float(value) for value in params[name].split(",")]
+    except ValueError:
+        values = []
+    if len(values) != count or not all(math.isfinite(value) for value in values):
+        raise ValidationError({name: [f"Expected {count} comma separated numbers."]})
+    return values
+
+
+class GeoFilterBackend(BaseFilterBackend):
+    """
+    Filters pings by position:
+
+    - ``bbox=west,south,east,north`` keeps pings inside a viewport. A west
+      edge east of the east edge wraps across the antimeridian.
+    - ``near=lat,lon&radius_km=500`` keeps pings within a great-circle
+      distance of a point.
+
+    On Postgres boxes are matched against a GiST index on the position;
+    elsewhere the (latitude, longitude) index serves them. Radius queries
+    narrow the rows to the circle's bounding boxes before computing
+    distances.
+    """
+
+    def get_bbox(self, params):
+        """Returns the boxes of the ``bbox`` parameter, or None."""
+        if "bbox" not in params:
+            return None
+        west, south, east, north = _parse_floats(params, "bbox", 4)
+        if not -90 <= south <= north <= 90:
+            raise ValidationError(
+                {"bbox": ["Latitudes must satisfy -90 <= south <= north <= 90."]}
+            )
+        return geo.bbox_boxes(west, south, east, north)
+
+    def get_near(self, params):
+        """Returns ``(latitude, longitude, radius_km)`` of a radius query, or None."""
+        if "near" not in params and "radius_km" not in params:
+            return None
+        if "near" not in params or "radius_km" not in params:
+            raise ValidationError(
+                {"near": ["near and radius_km must be given together."]}
+            )
+        latitude, longitude = _parse_floats(params, "near", 2)
+        (radius_km,) = _parse_floats(params, "radius_km", 1)
+        if not -90 <= latitude <= 90:
+            raise ValidationError({"near": ["Latitude must be within -90..90."]})
+        if radius_km <= 0:
+            raise ValidationError({"radius_km": ["Must be greater than 0."]})
+        return latitude, geo.normalize_longitude(longitude), radius_km
+
+    def get_boxes(self, params):
+        """
+        Boxes bounding every position the query can match: the viewport if
+        there is one, else the radius query's boxes, else the whole world.
+        """
+        boxes = self.get_bbox(params)
+        near = self.get_near(params)
+        if boxes is None and near is not None:
+            boxes = geo.radius_boxes(*near)
+        return boxes or [(-90.0, -180.0, 90.0, 180.0)]
+
+    def filter_queryset(self, request, queryset, view):
+        params = request.query_params
+        vendor = connections[queryset.db].vendor
+        boxes = self.get_bbox(params)
+        if boxes is not None:
+            queryset = queryset.filter(boxes_q(boxes, vendor))
+
+        near = self.get_near(params)
+        if near is not None:
+            latitude, longitude, radius_km = near
+            boxes = geo.radius_boxes(latitude, longitude, radius_km)
+            queryset = (
+                queryset.filter(boxes_q(boxes, vendor))
+                .alias(distance_km=distance_km(latitude, longitude))
+                .filter(distance_km__lte=radius_km)
+            )
+        return queryset
+
+
+class PingFilterSet(FilterSet):
+    # A trail's root is stored without a root_ping, but belongs to it.
+    root_ping = NumberFilter(method="filter_root_ping")
+
+    class Meta:
+        model = Ping
+        fields = {
+            "user": ["exact"],
+            "timestamp": ["exact", "gte", "lt"],
+            "depth": ["exact"],
+        }
+
+    def filter_root_ping(self, queryset, name, value):
+        return queryset.in_trail(int(value))
@@ -0,0 +1,84 @@
+"""
+Geometry helpers for spatial lookups on pings.
+
+Boxes are ``(min_lat, min_lon, max_lat, max_lon)`` tuples in degrees that
+never cross the antimeridian; queries that do are split into two boxes.
+"""
+
+import math
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def normalize_longitude(longitude):
+    """Maps a longitude into [-180, 180)."""
+    return (longitude + 180.0) % 360.0 - 180.0
+
+
+def bbox_boxes(min_lon, min_lat, max_lon, max_lat):
+    """
+    Splits a viewport into boxes that do not cross the antimeridian. A box
+    whose west edge is east of its east edge wraps across it, as do boxes
+    with edges outside [-180, 180] from maps that pan around the globe.
+    """
+    if max_lon - min_lon >= 360.0:
+        return [(min_lat, -180.0, max_lat, 180.0)]
+    west, east = normalize_longitude(min_lon), normalize_longitude(max_lon)
+    if max_lon == 180.0 or (east == -180.0 and max_lon > min_lon):
+        east = 180.0
+    if west <= east:
+        return [(min_lat, west, max_lat, east)]
+    return [(min_lat, west, max_lat, 180.0), (min_lat, -180.0, max_lat, east)]
+
+
+def radius_boxes(latitude, longitude, radius_km):
+    """Returns boxes bounding the circle of ``radius_km`` around a point."""
+    angle = radius_km / EARTH_RADIUS_KM
+    delta_lat = math.degrees(angle)
+    min_lat, max_lat = latitude - delta_lat, latitude + delta_lat
+    if min_lat <= -90.0 or max_lat >= 90.0 or angle >= math.pi / 2:
+        # The circle contains a pole, so it spans every longitude.
+        return [(max(min_lat, -90.0), -180.0, min(max_lat, 90.0), 180.0)]
+    delta_lon = math.degrees(
+        math.asin(math.sin(angle) / math.cos(math.radians(latitude)))
+    )
+    return bbox_boxes(longitude - delta_lon, min_lat, longitude + delta_lon, max_lat)
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def cell_size(zoom):
+    """
+    Returns the ``(height, width)`` in degrees of the cells of the grid at
+    ``zoom``, which splits the globe into 2**zoom rows and columns.
+    """
+    return 180.0 / 2**zoom, 360.0 / 2**zoom
+
+
+def grid_cell_count(boxes, zoom):
+    """The number of cells of the grid at ``zoom`` that ``boxes`` touch."""
+    height, width = cell_size(zoom)
+    count = 0
+    for min_lat, min_lon, max_lat, max_lon in boxes:
+        rows = math.floor((max_lat + 90.0) / height) - math.floor(
+            (min_lat + 90.0) / height
+        )
+        columns = math.floor((max_lon + 180.0) / width) - math.floor(
+            (min_lon + 180.0) / width
+        )
+        count += min(rows + 1, 2**zoom) * min(columns + 1, 2**zoom)
+    return count
+
+
+def cell_bounds(row, column, zoom):
+    """Returns the ``(min_lat, min_lon, max_lat, max_lon)`` of a grid cell."""
+    height, width = cell_size(zoom)
+    min_lat, min_lon = -90.0 + row * height, -180.0 + column * width
+    return (min_lat, min_lon, min_lat + height, min_lon + width)
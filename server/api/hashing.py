@@ -0,0 +1,96 @@
+"""
+Password hashing on a bounded pool of worker threads.
+
+User.set_password and User.check_password hash through ``run()``, so at
+most PASSWORD_HASHING_WORKERS hashes are computed at once per process and
+at most PASSWORD_HASHING_QUEUE more wait for a worker. hashlib releases the
+GIL while hashing, so a burst of logins occupies those workers' CPU time
+rather than every request thread's. Logins beyond the queue wait up to
+PASSWORD_HASHING_TIMEOUT seconds for a slot and are then turned away with
+503 Service Unavailable.
+
+Hashes are upgraded on login, as with Django's check_password, when
+PASSWORD_HASHERS puts another algorithm first or when the cost of the
+preferred hasher, e.g. PASSWORD_PBKDF2_ITERATIONS, changes.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class PasswordHashingBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = "Too many logins at once, try again shortly."
+    default_code = "password_hashing_busy"
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """Django's PBKDF2 hasher with PASSWORD_PBKDF2_ITERATIONS iterations."""
+
+    @property
+    def iterations(self):
+        return getattr(
+            settings,
+            "PASSWORD_PBKDF2_ITERATIONS",
+            hashers.PBKDF2PasswordHasher.iterations,
+        )
+
+
+class HashingPool:
+    def __init__(self, workers, queue_size, timeout):
+        self.timeout = timeout
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="hashing")
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def run(self, func, *args):
+        """Calls ``func(*args)`` on a worker and waits for its result."""
+        if not self.slots.acquire(timeout=self.timeout):
+            raise PasswordHashingBusy()
+        try:
+            return self.executor.submit(func, *args).result()
+        finally:
+            self.slots.release()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = HashingPool(
+                    workers=getattr(
+                        settings,
+                        "PASSWORD_HASHING_WORKERS",
+                        max(1, (os.cpu_count() or 2) // 2),
+                    ),
+                    queue_size=getattr(settings, "PASSWORD_HASHING_QUEUE", 64),
+                    timeout=getattr(settings, "PASSWORD_HASHING_TIMEOUT", 5),
+                )
+    return _pool
+
+
+def make_password(password):
+    return get_pool().run(hashers.make_password, password)
+
+
+def check_password(password, encoded, setter=None):
+    """
+    Django's check_password, verifying on the pool. ``setter`` is called to
+    store a new hash when ``encoded`` uses an outdated algorithm or cost.
+    """
+    is_correct, must_update = get_pool().run(
+        hashers.verify_password, password, encoded
+    )
+    if setter and is_correct and must_update:
+        setter(password)
+    return is_correct
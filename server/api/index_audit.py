@@ -0,0 +1,191 @@
+"""
+EXPLAIN-based audit of the queries behind the ping endpoints, run with
+``manage.py audit_indexes``.
+
+The querysets are built by PingViewSet itself for every supported
+combination of list filters and ordering, for both the first and a
+following keyset page, next to the queries of latest, trail, clusters and
+stats. Each is explained and reported when its plan reads a table with a
+full scan or sorts rows that an index could have returned in order.
+
+On Postgres sequential scans are disabled while explaining, so that a
+``Seq Scan`` in the plan means that no index can serve the query rather
+than that the planner preferred a scan of a small table.
+"""
+
+import re
+
+from django.db import connections, transaction
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from .models import Ping
+from .pagination import KeysetPagination
+from .rollups import INTERVALS, bucket_querysets, floor_time
+from .views import DEFAULT_CLUSTER_ZOOM, LATEST_PINGS_COUNT, PingViewSet
+
+TIMESTAMP = "2026-01-01T00:00:00Z"
+
+
+def list_filters(ping):
+    """The list filters to audit, referring to an existing ping and its user."""
+    return {
+        "all": {},
+        "user": {"user": ping.user_id},
+        "since": {"timestamp__gte": TIMESTAMP},
+        "range": {"timestamp__gte": TIMESTAMP, "timestamp__lt": "2026-01-02T00:00Z"},
+        "user_since": {"user": ping.user_id, "timestamp__gte": TIMESTAMP},
+        "root_ping": {"root_ping": ping.id},
+        "depth": {"depth": 0},
+        "bbox": {"bbox": "-10,40,10,55"},
+        "near": {"near": "51.5,-0.1", "radius_km": 50},
+    }
+
+
+LIST_ORDERINGS = ["-timestamp", "timestamp", "latitude", "-longitude"]
+
+SCAN_PATTERNS = [
+    # Postgres
+    re.compile(r"\bSeq Scan on (?P<table>\w+)"),
+    # sqlite; walking a whole index is only fine when a LIMIT stops it early.
+    re.compile(r"\bSCAN (?P<table>\w+)\b(?P<ordered> USING (?:COVERING )?INDEX)?"),
+]
+SORT_PATTERNS = [
+    re.compile(r"(?<!Incremental )\bSort\b"),
+    re.compile(r"USE TEMP B-TREE FOR ORDER BY"),
+]
+# Queries whose remaining issues are expected, with the reason.
+ACCEPTED = [
+    (
+        re.compile(r"ordering=-?(latitude|longitude)"),
+        "position orderings sort the filtered rows; an index for every filter "
+        "and ordering pair would slow down every write",
+    ),
+    (
+        re.compile(r"^list (bbox|near) "),
+        "the position index narrows the rows, which are sorted afterwards",
+    ),
+    (re.compile(r"^(list root_ping |trail$)"), "sorts the pings of one trail"),
+]
+ALIAS_PATTERN = re.compile(r'(?:FROM|JOIN)\s+"?(\w+)"?(?:\s+(?:AS\s+)?"?(\w+)"?)?')
+
+
+def explain(queryset):
+    """
+    Returns the plan of a QuerySet or RawQuerySet as a list of lines, with
+    the explained SQL and whether it has a LIMIT.
+    """
+    connection = connections[queryset.db]
+    if hasattr(queryset, "raw_query"):
+        sql, params = queryset.raw_query, queryset.params
+        limited = False
+    else:
+        sql, params = queryset.query.sql_with_params()
+        limited = queryset.query.high_mark is not None
+    prefix = connection.ops.explain_query_prefix()
+    with transaction.atomic(using=connection.alias):
+        with connection.cursor() as cursor:
+            if connection.vendor == "postgresql":
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute(f"{prefix} {sql}", params)
+            rows = cursor.fetchall()
+    # sqlite returns (id, parent, notused, detail) rows, Postgres one column.
+    return [str(row[-1]) for row in rows], sql, limited
+
+
+def find_issues(plan, sql, limited, tables):
+    """
+    Lists the full scans of ``tables``, as opposed to those of CTEs, and the
+    sorts in ``plan``.
+    """
+    aliases = {alias or table: table for table, alias in ALIAS_PATTERN.findall(sql)}
+    issues = []
+    for line in plan:
+        for pattern in SCAN_PATTERNS:
+            match = pattern.search(line)
+            if match is None or (limited and match.groupdict().get("ordered")):
+                continue
+            table = aliases.get(match["table"], match["table"])
+            if table in tables:
+                issues.append(f"full scan of {table}")
+        if any(pattern.search(line) for pattern in SORT_PATTERNS):
+            issues.append("sort")
+    return issues
+
+
+factory = APIRequestFactory(HTTP_HOST="localhost")
+
+
+def _view(action, params=None, path="/api/v1/pings/"):
+    request = Request(factory.get(path, params or {}))
+    return PingViewSet(request=request, action=action, format_kwarg=None, kwargs={})
+
+
+def list_querysets(ping):
+    """Yields ``(name, queryset)`` for the first and next page of each list."""
+    for filter_name, filters in list_filters(ping).items():
+        for ordering in LIST_ORDERINGS:
+            params = dict(filters)
+            if ordering != PingViewSet.ordering[0]:
+                params["ordering"] = ordering
+            view = _view("list", params)
+            queryset = view.filter_queryset(view.get_queryset())
+            paginator = KeysetPagination()
+            name = f"list {filter_name} ordering={ordering}"
+            yield name, paginator.get_page_queryset(queryset, view.request)
+
+            field = paginator.field
+            value = timezone.now() if field == "timestamp" else 0.0
+            next_url = paginator.encode_cursor({field: value, "id": ping.id})
+            request = Request(factory.get(next_url))
+            yield (
+                f"{name} next page",
+                KeysetPagination().get_page_queryset(queryset, request),
+            )
+
+
+def other_querysets(ping):
+    """Yields ``(name, queryset)`` for the other read endpoints."""
+    view = _view("latest")
+    yield "latest", view.get_queryset().order_by("-timestamp")[:LATEST_PINGS_COUNT]
+
+    yield "trail", Ping.objects.trail(ping.id)
+
+    view = _view("clusters", {"bbox": "-10,40,10,55"})
+    yield "clusters bbox", view.cluster_cells(
+        view.filter_queryset(Ping.objects.all()), DEFAULT_CLUSTER_ZOOM
+    )
+
+    for interval in INTERVALS:
+        until = floor_time(timezone.now(), interval) + INTERVALS[interval]
+        since = until - 60 * INTERVALS[interval]
+        for user_id in (None, ping.user_id):
+            rollups, pings = bucket_querysets(interval, since, until, user_id)
+            suffix = " user" if user_id else ""
+            yield f"stats {interval}{suffix} rollups", rollups
+            yield f"stats {interval}{suffix} live", pings
+
+
+def audit(ping):
+    """
+    Returns a report entry per audited query. Filters refer to ``ping`` and
+    its user, as filters on missing rows are rejected before querying.
+    """
+    tables = set(connections[ping._state.db].introspection.table_names())
+    report = []
+    for name, queryset in (*list_querysets(ping), *other_querysets(ping)):
+        plan, sql, limited = explain(queryset)
+        issues = find_issues(plan, sql, limited, tables)
+        accepted = next(
+            (reason for pattern, reason in ACCEPTED if pattern.search(name)), None
+        )
+        report.append(
+            {
+                "query": name,
+                "issues": issues,
+                "accepted": accepted if issues else None,
+                "plan": plan,
+            }
+        )
+    return report
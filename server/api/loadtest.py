@@ -0,0 +1,485 @@
+"""
+Concurrent HTTP load generator for comparing deployments of the API, run
+with ``manage.py loadtest``.
+
+Unlike the benchmarks in ``api.benchmarks`` this talks to running servers
+over keep-alive connections, so it measures the whole stack: the server,
+its worker model and the database. It only uses the standard library so it
+can run next to the server without extra dependencies.
+
+To compare sync WSGI against async ASGI serving, start the same code base
+under both against the same local Postgres database (seeded with seed_db):
+
+    gunicorn BasisPoint.wsgi -b 127.0.0.1:8001 -w 4 --threads 8
+    ASYNC_READ_VIEWS=True uvicorn BasisPoint.asgi:application \\
+        --port 8002 --workers 4
+
+and load both with the same concurrency:
+
+    manage.py loadtest --target wsgi=http://127.0.0.1:8001/api/v1/ \\
+        --target asgi=http://127.0.0.1:8002/api/v1/ \\
+        --code-name <user> --password <password> --concurrency 256
+
+Both servers are in requirements.txt, and uvicorn is what the Dockerfile
+runs. Any other ASGI server works as well.
+
+With ``--scenario`` each connection is instead a session of a logged in
+user going through weighted steps: login, refresh, list, latest,
+current_user, create and respond. Results are reported per step, along
+with the database queries each step ran when the server has
+DB_QUERY_COUNT_HEADER on. ``--serve`` starts such a server locally, and
+``--json`` results of one commit can be checked against another's with
+``--compare``:
+
+    manage.py seed_db --users 100 --pings 1000000
+    manage.py loadtest --serve --scenario mixed --seeded-users 100 \\
+        --json baseline.json
+    # ...change the code...
+    manage.py loadtest --serve --scenario mixed --seeded-users 100 \\
+        --compare baseline.json
+"""
+
+import asyncio
+import json
+import random
+import statistics
+import time
+from urllib.parse import urljoin, urlsplit
+
+
+class LoadTestError(Exception):
+    pass
+
+
+class Connection:
+    """A minimal keep-alive HTTP/1.1 client connection."""
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        if parts.scheme != "http":
+            raise LoadTestError(f"Only http:// targets are supported: {url}")
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.reader = self.writer = None
+        # Headers of the last response, and the cookies set so far.
+        self.headers = {}
+        self.cookies = {}
+
+    async def request(self, method, path, headers=None, body=b""):
+        """Sends a request and returns ``(status, body)``."""
+        reused = self.writer is not None
+        try:
+            return await self.send(method, path, headers, body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            self.close()
+            if not reused:
+                raise
+        # The server closed the idle connection; retry once on a new one.
+        return await self.send(method, path, headers, body)
+
+    async def send(self, method, path, headers, body):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host, self.port
+            )
+        lines = [
+            f"{method} {path} HTTP/1.1",
+            f"Host: {self.host}:{self.port}",
+            f"Content-Length: {len(body)}",
+        ]
+        lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+        await self.writer.drain()
+        return await self.read_response()
+
+    async def read_response(self):
+        version, status = (await self.reader.readuntil(b"\r\n")).split()[:2]
+        status = int(status)
+        headers = {}
+        while (line := await self.reader.readuntil(b"\r\n")) != b"\r\n":
+            name, _, value = line.decode("latin-1").partition(":")
+            name, value = name.strip().lower(), value.strip()
+            headers[name] = value
+            if name == "set-cookie":
+                cookie, _, _ = value.partition(";")
+                cookie_name, _, cookie_value = cookie.partition("=")
+                self.cookies[cookie_name.strip()] = cookie_value.strip()
+        self.headers = headers
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = bytearray()
+            while size := await self.read_chunk_size():
+                body += await self.reader.readexactly(size + 2)
+                del body[-2:]
+            await self.reader.readuntil(b"\r\n")
+        else:
+            body = await self.reader.readexactly(int(headers.get("content-length", 0)))
+
+        keep_alive = "keep-alive" if version == b"HTTP/1.1" else "close"
+        if headers.get("connection", keep_alive).lower() == "close":
+            self.close()
+        return status, bytes(body)
+
+    async def read_chunk_size(self):
+        line = await self.reader.readuntil(b"\r\n")
+        return int(line.split(b";")[0], 16)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def percentile(samples, percent):
+    """Nearest-rank percentile of sorted ``samples``."""
+    index = max(0, round(percent / 100 * len(samples)) - 1)
+    return samples[min(index, len(samples) - 1)]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    summary = {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+    }
+    if latencies:
+        summary.update(
+            {
+                "mean_ms": round(statistics.fmean(latencies), 3),
+                "p50_ms": round(percentile(latencies, 50), 3),
+                "p95_ms": round(percentile(latencies, 95), 3),
+                "p99_ms": round(percentile(latencies, 99), 3),
+                "max_ms": round(latencies[-1], 3),
+            }
+        )
+    return summary
+
+
+async def obtain_token(base_url, code_name, password):
+    connection = Connection(base_url)
+    body = json.dumps({"code_name": code_name, "password": password}).encode()
+    try:
+        status, content = await connection.request(
+            "POST",
+            urlsplit(urljoin(base_url, "auth/login/")).path,
+            {"Content-Type": "application/json"},
+            body,
+        )
+    finally:
+        connection.close()
+    if status != 200:
+        raise LoadTestError(f"Login against {base_url} failed with {status}")
+    return json.loads(content)["access"]
+
+
+async def run_load(base_url, paths, token, concurrency, duration, warmup=1.0):
+    """
+    Keeps ``concurrency`` connections busy requesting ``paths`` in turn for
+    ``duration`` seconds after a ``warmup`` period, and returns latency and
+    throughput statistics per path and overall.
+    """
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    targets = [urlsplit(urljoin(base_url, path)) for path in paths]
+    latencies = {path: [] for path in paths}
+    errors = {path: 0 for path in paths}
+    loop = asyncio.get_running_loop()
+    start = loop.time() + warmup
+    deadline = start + duration
+
+    async def worker(offset):
+        connection = Connection(base_url)
+        i = offset
+        try:
+            while (now := loop.time()) < deadline:
+                path, target = paths[i % len(paths)], targets[i % len(paths)]
+                i += 1
+                request_path = f"{target.path}?{target.query}".rstrip("?")
+                sent = time.perf_counter()
+                try:
+                    status, _ = await connection.request("GET", request_path, headers)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    status = None
+                elapsed_ms = (time.perf_counter() - sent) * 1000
+                if now < start:
+                    continue
+                if status == 200:
+                    latencies[path].append(elapsed_ms)
+                else:
+                    errors[path] += 1
+        finally:
+            connection.close()
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    result = {
+        path: summarize(latencies[path], errors[path], duration) for path in paths
+    }
+    result["total"] = summarize(
+        [sample for samples in latencies.values() for sample in samples],
+        sum(errors.values()),
+        duration,
+    )
+    return result
+
+
+# Set by api.middleware.PerformanceMiddleware when DB_QUERY_COUNT_HEADER is on.
+QUERY_COUNT_HEADER = "x-db-queries"
+# Ping ids a session remembers to respond to.
+SESSION_PING_IDS = 100
+
+
+class Session:
+    """
+    A virtual user driven through a scenario: one keep-alive connection with
+    its own access token, refresh cookie and the ids of pings it has seen.
+    """
+
+    def __init__(self, base_url, code_name, password, rng):
+        self.base_url = base_url
+        self.connection = Connection(base_url)
+        self.code_name = code_name
+        self.password = password
+        self.rng = rng
+        self.access = None
+        self.user_id = None
+        self.ping_ids = []
+
+    async def call(self, method, path, data=None):
+        """Sends a request and returns ``(status, JSON body, query count)``."""
+        headers = {}
+        body = b""
+        if self.access:
+            headers["Authorization"] = f"Bearer {self.access}"
+        if self.connection.cookies:
+            headers["Cookie"] = "; ".join(
+                f"{name}={value}" for name, value in self.connection.cookies.items()
+            )
+        if data is not None:
+            headers["Content-Type"] = "application/json"
+            body = json.dumps(data).encode()
+        path = urlsplit(urljoin(self.base_url, path)).path
+        status, content = await self.connection.request(method, path, headers, body)
+        try:
+            payload = json.loads(content) if content else None
+        except ValueError:
+            payload = None
+        queries = self.connection.headers.get(QUERY_COUNT_HEADER)
+        return status, payload, int(queries) if queries else None
+
+    def remember(self, pings):
+        self.ping_ids.extend(ping["id"] for ping in pings)
+        del self.ping_ids[:-SESSION_PING_IDS]
+
+    def random_position(self):
+        return {
+            "latitude": round(self.rng.uniform(-90, 90), 6),
+            "longitude": round(self.rng.uniform(-180, 180), 6),
+        }
+
+    def close(self):
+        self.connection.close()
+
+
+# Scenario steps. Each sends one request and returns ``(ok, query count)``.
+
+
+async def login(session):
+    credentials = {"code_name": session.code_name, "password": session.password}
+    status, data, queries = await session.call("POST", "auth/login/", credentials)
+    if status == 200:
+        session.access = data["access"]
+        session.user_id = data["user"]["id"]
+    return status == 200, queries
+
+
+async def refresh(session):
+    # The refresh token travels in the cookie set by login.
+    status, data, queries = await session.call("POST", "auth/refresh/", {})
+    if status == 200:
+        session.access = data["access"]
+    return status == 200, queries
+
+
+async def list_pings(session):
+    status, data, queries = await session.call("GET", "pings/")
+    if status == 200:
+        session.remember(data["results"])
+    return status == 200, queries
+
+
+async def latest(session):
+    status, data, queries = await session.call("GET", "pings/latest/")
+    if status == 200:
+        session.remember(data)
+    return status == 200, queries
+
+
+async def current_user(session):
+    status, _, queries = await session.call("GET", "auth/current_user/")
+    return status == 200, queries
+
+
+async def create(session):
+    data = {**session.random_position(), "user_id": session.user_id}
+    status, data, queries = await session.call("POST", "pings/", data)
+    if status == 201:
+        session.remember([data])
+    return status == 201, queries
+
+
+async def respond(session):
+    if not session.ping_ids:
+        await latest(session)
+    if not session.ping_ids:
+        return False, None
+    parent = session.rng.choice(session.ping_ids)
+    path = f"pings/{parent}/respond/"
+    status, data, queries = await session.call("POST", path, session.random_position())
+    if status == 201:
+        session.remember([data["ping"]])
+    return status == 201, queries
+
+
+STEPS = {
+    "login": login,
+    "refresh": refresh,
+    "list": list_pings,
+    "latest": latest,
+    "current_user": current_user,
+    "create": create,
+    "respond": respond,
+}
+
+# Built-in scenarios, as relative weights of their steps.
+SCENARIOS = {
+    "read": {"list": 6, "latest": 3, "current_user": 1},
+    "write": {"create": 1, "respond": 1},
+    "auth": {"login": 1, "refresh": 4},
+    "mixed": {
+        "list": 10,
+        "latest": 6,
+        "current_user": 2,
+        "create": 2,
+        "respond": 2,
+        "refresh": 1,
+        "login": 0.2,
+    },
+}
+
+
+def load_scenario(scenario):
+    """
+    Returns the step weights of a built-in scenario, or of a JSON file
+    mapping step names to weights, e.g. ``{"list": 5, "create": 1}``.
+    """
+    if scenario in SCENARIOS:
+        return dict(SCENARIOS[scenario])
+    try:
+        with open(scenario) as f:
+            weights = json.load(f)
+    except OSError:
+        choices = ", ".join(SCENARIOS)
+        raise LoadTestError(f"No scenario {scenario!r}; choose from {choices}.")
+    except ValueError as e:
+        raise LoadTestError(f"{scenario}: invalid JSON ({e})")
+    if not isinstance(weights, dict) or not weights:
+        raise LoadTestError(f"{scenario}: expected an object of step weights")
+    unknown = set(weights) - set(STEPS)
+    if unknown:
+        raise LoadTestError(f"{scenario}: unknown steps {', '.join(sorted(unknown))}")
+    if not all(isinstance(w, (int, float)) and w >= 0 for w in weights.values()):
+        raise LoadTestError(f"{scenario}: weights must be non-negative numbers")
+    return weights
+
+
+async def run_scenario(
+    base_url, weights, credentials, concurrency, duration, warmup=1.0, seed=0
+):
+    """
+    Runs ``concurrency`` sessions, each logged in as one of ``credentials``
+    (``(code_name, password)`` pairs) in turn, picking steps at random by
+    ``weights`` for ``duration`` seconds after a ``warmup`` period. Returns
+    throughput, latency and query count statistics per step and overall.
+
+    Step choices are seeded per session, so runs with the same seed and
+    concurrency issue comparable request mixes.
+    """
+    steps = list(weights)
+    step_weights = [weights[step] for step in steps]
+    latencies = {step: [] for step in steps}
+    errors = {step: 0 for step in steps}
+    queries = {step: [] for step in steps}
+    loop = asyncio.get_running_loop()
+    start = loop.time() + warmup
+    deadline = start + duration
+
+    async def worker(offset):
+        code_name, password = credentials[offset % len(credentials)]
+        session = Session(base_url, code_name, password, random.Random(seed + offset))
+        try:
+            ok, _ = await login(session)
+            if not ok:
+                raise LoadTestError(f"Login as {code_name} failed")
+            while (now := loop.time()) < deadline:
+                step = session.rng.choices(steps, step_weights)[0]
+                sent = time.perf_counter()
+                try:
+                    ok, count = await STEPS[step](session)
+                except (ConnectionError, asyncio.IncompleteReadError):
+                    ok, count = False, None
+                elapsed_ms = (time.perf_counter() - sent) * 1000
+                if now < start:
+                    continue
+                if ok:
+                    latencies[step].append(elapsed_ms)
+                else:
+                    errors[step] += 1
+                if count is not None:
+                    queries[step].append(count)
+        finally:
+            session.close()
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    result = {}
+    for step in steps:
+        result[step] = summarize(latencies[step], errors[step], duration)
+        if queries[step]:
+            result[step]["queries_mean"] = round(statistics.fmean(queries[step]), 2)
+            result[step]["queries_max"] = max(queries[step])
+    result["total"] = summarize(
+        [sample for samples in latencies.values() for sample in samples],
+        sum(errors.values()),
+        duration,
+    )
+    return result
+
+
+def compare(baseline, current, tolerance=0.2):
+    """
+    Lists the regressions of ``current`` against ``baseline`` results: p95
+    latency or throughput worse by more than ``tolerance`` (a fraction), more
+    queries per request, or errors where there were none.
+    """
+    regressions = []
+    for step, now in current.items():
+        before = baseline.get(step)
+        if not isinstance(now, dict) or not isinstance(before, dict):
+            continue
+        if before.get("p95_ms") and now.get("p95_ms"):
+            if now["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+                regressions.append(
+                    f"{step}: p95 {before['p95_ms']}ms -> {now['p95_ms']}ms"
+                )
+        if before.get("throughput_rps") and now.get("throughput_rps") is not None:
+            if now["throughput_rps"] < before["throughput_rps"] * (1 - tolerance):
+                regressions.append(
+                    f"{step}: throughput {before['throughput_rps']} -> "
+                    f"{now['throughput_rps']} rps"
+                )
+        if now.get("queries_mean", 0) > before.get("queries_mean", float("inf")):
+            regressions.append(
+                f"{step}: queries {before['queries_mean']} -> {now['queries_mean']}"
+            )
+        if now.get("errors") and not before.get("errors"):
+            regressions.append(f"{step}: {now['errors']} errors")
+    return regressions
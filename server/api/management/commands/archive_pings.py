@@ -0,0 +1,46 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.retention import ARCHIVE_BATCH_SIZE, archive_pings
+
+
+class Command(BaseCommand):
+    help = (
+        "Move trails whose pings are all older than the retention period into "
+        "gzip-compressed NDJSON archives. Safe to interrupt and run again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than-days",
+            type=int,
+            default=settings.PING_RETENTION_DAYS,
+            help="Archive trails older than this (default: PING_RETENTION_DAYS).",
+        )
+        parser.add_argument(
+            "--directory",
+            default=settings.PING_ARCHIVE_DIR,
+            help="Where to write archives (default: PING_ARCHIVE_DIR).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=ARCHIVE_BATCH_SIZE,
+            help="Trails archived per file and transaction.",
+        )
+
+    def handle(self, *args, **options):
+        total = files = 0
+        for path, archived in archive_pings(
+            options["directory"],
+            timedelta(days=options["older_than_days"]),
+            batch_size=options["batch_size"],
+        ):
+            files += 1
+            total += archived
+            self.stdout.write(f"{path}: {archived} pings")
+        self.stdout.write(
+            self.style.SUCCESS(f"Archived {total} pings into {files} files.")
+        )
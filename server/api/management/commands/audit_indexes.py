@@ -0,0 +1,63 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.index_audit import audit
+from api.models import Ping
+
+
+class Command(BaseCommand):
+    help = (
+        "EXPLAIN the queries behind the ping endpoints for every supported "
+        "filter and ordering, and report full table scans and sorts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verbose-plans",
+            action="store_true",
+            help="Print the plan of every query, not just of those with issues.",
+        )
+        parser.add_argument(
+            "--fail",
+            action="store_true",
+            help="Exit with an error when any query has unexpected issues, e.g. "
+            "in CI.",
+        )
+        parser.add_argument(
+            "--json", dest="json_path", help="Write the report to this JSON file."
+        )
+
+    def handle(self, *args, **options):
+        ping = Ping.objects.order_by("id").first()
+        if ping is None:
+            raise CommandError("No pings to audit with; run seed_db first.")
+        report = audit(ping)
+        flagged = [
+            entry for entry in report if entry["issues"] and not entry["accepted"]
+        ]
+        for entry in report:
+            issues = ", ".join(sorted(set(entry["issues"])))
+            if not issues:
+                self.stdout.write(f"{entry['query']}: ok")
+            elif entry["accepted"]:
+                self.stdout.write(
+                    f"{entry['query']}: {issues} (accepted: {entry['accepted']})"
+                )
+            else:
+                self.stdout.write(self.style.WARNING(f"{entry['query']}: {issues}"))
+            if entry in flagged or options["verbose_plans"]:
+                for line in entry["plan"]:
+                    self.stdout.write(f"    {line}")
+
+        if options["json_path"]:
+            with open(options["json_path"], "w") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['json_path']}"))
+
+        summary = f"{len(flagged)} of {len(report)} queries have unexpected issues."
+        if flagged and options["fail"]:
+            raise CommandError(summary)
+        self.stdout.write(
+            self.style.WARNING(summary) if flagged else self.style.SUCCESS(summary)
+        )
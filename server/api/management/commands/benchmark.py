@@ -0,0 +1,42 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import SCENARIOS
+
+
+class Command(BaseCommand):
+    help = "Run API benchmark scenarios against the configured database."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "scenarios",
+            nargs="*",
+            help=f"Scenarios to run (default: all). Available: {', '.join(SCENARIOS)}",
+        )
+        parser.add_argument(
+            "--size",
+            type=int,
+            default=100_000,
+            help="Number of rows to seed for each scenario.",
+        )
+        parser.add_argument(
+            "--json", dest="json_path", help="Write the results to this JSON file."
+        )
+
+    def handle(self, *args, **options):
+        names = options["scenarios"] or list(SCENARIOS)
+        unknown = set(names) - set(SCENARIOS)
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        results = {}
+        for name in names:
+            self.stdout.write(self.style.NOTICE(f"Running {name}..."))
+            results[name] = SCENARIOS[name](options["size"])
+            self.stdout.write(json.dumps(results[name], indent=2))
+
+        if options["json_path"]:
+            with open(options["json_path"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['json_path']}"))
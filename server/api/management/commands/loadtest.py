@@ -0,0 +1,273 @@
+import asyncio
+import json
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.loadtest import (
+    SCENARIOS,
+    LoadTestError,
+    compare,
+    load_scenario,
+    obtain_token,
+    run_load,
+    run_scenario,
+)
+from api.seeding import SEED_PASSWORD
+
+DEFAULT_PATHS = ["pings/", "pings/latest/", "auth/current_user/"]
+DEFAULT_SERVER_COMMAND = f"{sys.executable} manage.py runserver --noreload {{address}}"
+# Seconds to wait for a server started with --serve to accept connections.
+SERVER_START_TIMEOUT = 30
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Load test running API servers and compare their throughput and "
+        "latency. See api/loadtest.py for how to start the servers."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--target",
+            action="append",
+            default=[],
+            metavar="NAME=URL",
+            help="API base URL to load, e.g. asgi=http://127.0.0.1:8002/api/v1/. "
+            "May be repeated; targets are loaded one after another.",
+        )
+        parser.add_argument(
+            "--serve",
+            action="store_true",
+            help="Start a local server to load as the target 'local', with "
+            "DB_QUERY_COUNT_HEADER on and THROTTLE_LOGINS off, and stop it "
+            "afterwards.",
+        )
+        parser.add_argument(
+            "--server-command",
+            default=DEFAULT_SERVER_COMMAND,
+            help="Command starting the --serve server; {address} is replaced "
+            "with host:port (default: runserver).",
+        )
+        parser.add_argument(
+            "--path",
+            action="append",
+            dest="paths",
+            help="Path relative to the base URL to request, may be repeated "
+            f"(default: {', '.join(DEFAULT_PATHS)}).",
+        )
+        parser.add_argument(
+            "--scenario",
+            help="Run a scenario of login, refresh, list, latest, create and "
+            f"respond steps instead of GET paths: {', '.join(SCENARIOS)}, or a "
+            'JSON file of step weights such as {"list": 5, "create": 1}.',
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0, help="Random seed of --scenario runs."
+        )
+        parser.add_argument("--concurrency", type=int, default=64)
+        parser.add_argument(
+            "--duration", type=float, default=10.0, help="Seconds to measure."
+        )
+        parser.add_argument(
+            "--warmup", type=float, default=1.0, help="Seconds to run unmeasured."
+        )
+        parser.add_argument("--token", help="Access token to send.")
+        parser.add_argument("--code-name", help="Log in as this user instead.")
+        parser.add_argument("--password")
+        parser.add_argument(
+            "--seeded-users",
+            type=int,
+            metavar="N",
+            help="Spread --scenario sessions over the first N agents created by "
+            "`seed_db --users` with the same --seed.",
+        )
+        parser.add_argument(
+            "--json", dest="json_path", help="Write the results to this JSON file."
+        )
+        parser.add_argument(
+            "--compare",
+            metavar="BASELINE",
+            help="Compare with the results of an earlier --json run and fail on "
+            "regressions.",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.2,
+            help="Fraction by which p95 latency and throughput may get worse "
+            "before --compare fails (default: 0.2).",
+        )
+
+    def handle(self, *args, **options):
+        targets = {}
+        for target in options["target"]:
+            name, sep, url = target.partition("=")
+            if not sep or not url:
+                raise CommandError(f"Expected NAME=URL, got {target!r}")
+            targets[name] = url if url.endswith("/") else f"{url}/"
+        if not targets and not options["serve"]:
+            raise CommandError("Give at least one --target, or --serve.")
+        paths = [path.lstrip("/") for path in options["paths"] or DEFAULT_PATHS]
+        weights = credentials = None
+        if options["scenario"]:
+            try:
+                weights = load_scenario(options["scenario"])
+            except LoadTestError as e:
+                raise CommandError(str(e))
+            credentials = self.get_credentials(options)
+
+        results = {}
+        with self.local_server(options) as local_url:
+            if local_url:
+                targets["local"] = local_url
+            for name, url in targets.items():
+                self.stdout.write(self.style.NOTICE(f"Loading {name} ({url})..."))
+                try:
+                    load = self.load(url, paths, weights, credentials, options)
+                    results[name] = asyncio.run(load)
+                except (LoadTestError, OSError) as e:
+                    raise CommandError(f"{name}: {e}")
+                self.stdout.write(json.dumps(results[name], indent=2))
+
+        if options["json_path"]:
+            with open(options["json_path"], "w") as f:
+                json.dump(results, f, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['json_path']}"))
+        if options["compare"]:
+            self.compare(results, options)
+
+    def get_credentials(self, options):
+        if options["seeded_users"]:
+            prefix = f"seed{options['seed']}a"
+            return [
+                (f"{prefix}{i:07d}", SEED_PASSWORD)
+                for i in range(options["seeded_users"])
+            ]
+        if not options["code_name"] or not options["password"]:
+            raise CommandError(
+                "--scenario needs --code-name and --password, or --seeded-users."
+            )
+        return [(options["code_name"], options["password"])]
+
+    @contextmanager
+    def local_server(self, options):
+        """Starts the --serve server and yields its base URL, or None."""
+        if not options["serve"]:
+            yield None
+            return
+        address = f"127.0.0.1:{free_port()}"
+        command = shlex.split(options["server_command"].format(address=address))
+        env = {**os.environ, "DB_QUERY_COUNT_HEADER": "True"}
+        env.setdefault("DJANGO_ALLOWED_HOSTS", "localhost,127.0.0.1")
+        # Scenario sessions all log in from this one address.
+        env.setdefault("THROTTLE_LOGINS", "False")
+        self.stdout.write(self.style.NOTICE(f"Starting {' '.join(command)}"))
+        server = subprocess.Popen(
+            command,
+            cwd=settings.BASE_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            host, port = address.split(":")
+            deadline = time.monotonic() + SERVER_START_TIMEOUT
+            while True:
+                if server.poll() is not None:
+                    raise CommandError(f"The server exited with {server.returncode}")
+                try:
+                    socket.create_connection((host, int(port)), timeout=1).close()
+                    break
+                except OSError:
+                    if time.monotonic() > deadline:
+                        raise CommandError("The server did not start in time.")
+                    time.sleep(0.2)
+            yield f"http://{address}/api/v1/"
+        finally:
+            server.terminate()
+            server.wait()
+
+    async def load(self, url, paths, weights, credentials, options):
+        if weights is not None:
+            result = await run_scenario(
+                url,
+                weights,
+                credentials,
+                concurrency=options["concurrency"],
+                duration=options["duration"],
+                warmup=options["warmup"],
+                seed=options["seed"],
+            )
+            return {
+                "meta": {
+                    "scenario": options["scenario"],
+                    "weights": weights,
+                    "concurrency": options["concurrency"],
+                    "duration": options["duration"],
+                    "seed": options["seed"],
+                    "commit": git_commit(),
+                    "date": datetime.now(timezone.utc).isoformat(),
+                },
+                **result,
+            }
+        token = options["token"]
+        if token is None and options["code_name"]:
+            token = await obtain_token(url, options["code_name"], options["password"])
+        return await run_load(
+            url,
+            paths,
+            token,
+            concurrency=options["concurrency"],
+            duration=options["duration"],
+            warmup=options["warmup"],
+        )
+
+    def compare(self, results, options):
+        with open(options["compare"]) as f:
+            baseline = json.load(f)
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline:
+                self.stdout.write(self.style.WARNING(f"{name}: not in the baseline"))
+                continue
+            if baseline[name].get("meta", {}).get("scenario") != result.get(
+                "meta", {}
+            ).get("scenario"):
+                self.stdout.write(
+                    self.style.WARNING(f"{name}: the baseline ran another scenario")
+                )
+            for regression in compare(baseline[name], result, options["tolerance"]):
+                regressions.append(f"{name} {regression}")
+        for regression in regressions:
+            self.stdout.write(self.style.ERROR(regression))
+        if regressions:
+            raise CommandError(f"{len(regressions)} regressions against the baseline.")
+        self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from api.partitions import (
+    PartitionError,
+    convert_to_partitioned,
+    detach_partitions,
+    ensure_partitions,
+    partitions,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Manage the monthly partitions of api_ping on PostgreSQL: convert the "
+        "table once, then run `create` periodically (e.g. daily) to add "
+        "upcoming months and `detach` to retire old ones."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("action", choices=["convert", "create", "detach", "list"])
+        parser.add_argument(
+            "--months-ahead",
+            type=int,
+            default=3,
+            help="Months after the current one to create partitions for.",
+        )
+        parser.add_argument(
+            "--keep-months",
+            type=int,
+            default=12,
+            help="Months, the current one included, to keep attached on detach.",
+        )
+        parser.add_argument(
+            "--drop",
+            action="store_true",
+            help="Drop detached partitions instead of keeping them as tables.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            if options["action"] == "convert":
+                names = list(
+                    convert_to_partitioned(
+                        connection, months_ahead=options["months_ahead"]
+                    ).values()
+                )
+                message = f"Partitioned api_ping into {len(names)} months."
+            elif options["action"] == "create":
+                names = ensure_partitions(
+                    connection, months_ahead=options["months_ahead"]
+                )
+                message = f"Created {len(names)} partitions."
+            elif options["action"] == "detach":
+                names = detach_partitions(
+                    connection, options["keep_months"], drop=options["drop"]
+                )
+                verb = "Dropped" if options["drop"] else "Detached"
+                message = f"{verb} {len(names)} partitions."
+            else:
+                names = list(partitions(connection).values())
+                message = f"{len(names)} monthly partitions."
+        except PartitionError as error:
+            raise CommandError(str(error))
+        for name in names:
+            self.stdout.write(name)
+        self.stdout.write(self.style.SUCCESS(message))
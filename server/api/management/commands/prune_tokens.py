@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from api.blacklist import PRUNE_BATCH_SIZE, get_blacklist, prune_outstanding_tokens
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired revoked refresh tokens, and the expired rows of "
+        "SimpleJWT's token_blacklist tables, in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=PRUNE_BATCH_SIZE,
+            help="Rows deleted per statement.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        revoked = sum(get_blacklist().prune(batch_size))
+        outstanding = sum(prune_outstanding_tokens(batch_size))
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Pruned {revoked} revoked and {outstanding} outstanding tokens."
+            )
+        )
@@ -0,0 +1,40 @@
+from argparse import ArgumentTypeError
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from api.rollups import rebuild_rollups, rollup_pings
+
+
+def aware_datetime(value):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ArgumentTypeError(f"Not an ISO 8601 datetime: {value!r}")
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
+
+
+class Command(BaseCommand):
+    help = (
+        "Update the per-minute ping rollups behind /pings/stats/. Meant to run "
+        "every minute or so; each run only recomputes recent minutes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--since",
+            type=aware_datetime,
+            help="Recompute every minute from this ISO 8601 time on.",
+        )
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Discard all rollups and recompute them from every ping.",
+        )
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            written = rebuild_rollups()
+        else:
+            written = rollup_pings(since=options["since"])
+        self.stdout.write(self.style.SUCCESS(f"Wrote {written} rollup buckets."))
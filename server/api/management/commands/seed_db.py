@@ -1,7 +1,15 @@
+import time
+from argparse import ArgumentTypeError
+
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 
+from api.caches import ping_changes
 from api.models import Ping, User
+from api.rollups import newest_rollup, rollup_pings
+from api.seeding import SEED_BATCH_SIZE, SEED_PASSWORD, seed_pings, seed_users
+
+from .rollup_pings import aware_datetime
 
 # Seed MI6 agents (see .project/SPEC.md - User model requirements)
 agents = [
@@ -26,8 +34,77 @@ agents = [
 ]
 
 
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise ArgumentTypeError(f"Expected a positive integer: {value!r}")
+    return number
+
+
+def ratio(value):
+    number = float(value)
+    if not 0 <= number <= 1:
+        raise ArgumentTypeError(f"Expected a number between 0 and 1: {value!r}")
+    return number
+
+
 class Command(BaseCommand):
-    help = "Seed the database with initial data."
+    help = (
+        "Seed the database with initial data. With --pings, also generate "
+        "synthetic agents and pings in bulk for load tests and benchmarks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--users",
+            type=positive_int,
+            default=100,
+            help="Synthetic agents to ping as (default: 100).",
+        )
+        parser.add_argument(
+            "--pings", type=positive_int, help="Synthetic pings to generate."
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Random seed; the same seed generates the same data.",
+        )
+        parser.add_argument(
+            "--days",
+            type=float,
+            default=30,
+            help="Spread the pings over this many days (default: 30).",
+        )
+        parser.add_argument(
+            "--until",
+            type=aware_datetime,
+            help="Time of the last ping as ISO 8601 (default: now).",
+        )
+        parser.add_argument(
+            "--reply-ratio",
+            type=ratio,
+            default=0.3,
+            help="Share of pings answering an earlier ping (default: 0.3).",
+        )
+        parser.add_argument(
+            "--max-depth",
+            type=int,
+            default=10,
+            help="Deepest answer in a trail (default: 10).",
+        )
+        parser.add_argument(
+            "--max-children",
+            type=positive_int,
+            default=3,
+            help="Most answers to a single ping (default: 3).",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=positive_int,
+            default=SEED_BATCH_SIZE,
+            help=f"Pings loaded per transaction (default: {SEED_BATCH_SIZE}).",
+        )
 
     def handle(self, *args, **options):
         self.stdout.write(self.style.SUCCESS("Seeding database..."))
@@ -38,6 +115,44 @@ class Command(BaseCommand):
         self.seed_superuser()
         self.seed_agents()
         self.seed_pings()
+        if options["pings"]:
+            self.seed_synthetic(options)
+
+    def seed_synthetic(self, options):
+        started = time.perf_counter()
+        user_ids = seed_users(options["users"], seed=options["seed"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{len(user_ids)} synthetic agents ready, "
+                f"all with the password {SEED_PASSWORD!r}."
+            )
+        )
+        until = options["until"] or timezone.now()
+        first_id, last_id = seed_pings(
+            user_ids,
+            options["pings"],
+            until,
+            days=options["days"],
+            seed=options["seed"],
+            batch_size=options["batch_size"],
+            reply_ratio=options["reply_ratio"],
+            max_depth=options["max_depth"],
+            max_children=options["max_children"],
+        )
+        ping_changes.changed()
+        # Stats count pings after the newest rollup live, so only pings
+        # seeded before it need rolling up now.
+        first = Ping.objects.get(id=first_id).timestamp
+        newest = newest_rollup()
+        if newest is not None and newest >= first:
+            rollup_pings(since=first)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Created pings {first_id}..{last_id} in {elapsed:.1f}s "
+                f"({options['pings'] / elapsed:,.0f} pings/s)."
+            )
+        )
 
     def seed_superuser(self):
         # Seed MI6 supervisor "M" as a superuser
@@ -0,0 +1,250 @@
+"""
+In-process request metrics, rendered in the Prometheus text format by the
+``metrics/`` endpoint and recorded by api.middleware.PerformanceMiddleware.
+Serializers report their share of a request's time through
+``serializing()``.
+
+Each server process keeps its own counts, so with several workers every
+worker has to be scraped (or the numbers read as a sample of the whole).
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n")
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self.values)
+        for labels, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labels, labels), value
+
+
+class Histogram:
+    """
+    A histogram with fixed upper bucket bounds. Observations are counted in
+    their own bucket and made cumulative when rendered.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # {labels: [[count per bucket, +Inf last], sum]}
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self.lock:
+            values = {labels: (list(c), s) for labels, (c, s) in self.values.items()}
+        bounds = [*self.buckets, float("inf")]
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                le = (("le", _format_value(bound)),)
+                yield (
+                    f"{self.name}_bucket",
+                    _format_labels(self.labels, labels, le),
+                    cumulative,
+                )
+            yield f"{self.name}_sum", _format_labels(self.labels, labels), total
+            yield f"{self.name}_count", _format_labels(self.labels, labels), cumulative
+
+
+class Callback:
+    """A metric whose unlabelled value is read from ``read()`` when rendered."""
+
+    def __init__(self, name, documentation, read, type="gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+        self.type = type
+
+    def samples(self):
+        yield self.name, "", self.read()
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Timings of the request being handled, when it is sampled.
+current_timings = ContextVar("current_timings", default=None)
+
+
+def time_queries(execute, sql, params, many, context):
+    """
+    Execute wrapper adding queries to the current request's timings. The
+    timings are found through their context variable, so queries that async
+    views and sync views under ASGI run in worker threads count as well.
+    """
+    timings = current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    return timings(execute, sql, params, many, context)
+
+
+def install_query_timing(sender, connection, **kwargs):
+    """Adds time_queries to database connections as they are opened."""
+    if time_queries not in connection.execute_wrappers:
+        # First, so connection.execute_wrapper() blocks still pop their own.
+        connection.execute_wrappers.insert(0, time_queries)
+
+
+class RequestTimings:
+    """
+    Where a request spent its time, filled in by time_queries, or another
+    database execute wrapper, and by serializers through ``serializing()``.
+    """
+
+    __slots__ = ("db_time", "queries", "serializer_time", "serializing_depth")
+
+    def __init__(self):
+        self.db_time = 0.0
+        self.queries = 0
+        self.serializer_time = 0.0
+        self.serializing_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+
+class serializing:
+    """
+    Adds the time spent in the block, less its database queries, to the
+    serializer time of the current request. Nested blocks count once.
+    """
+
+    __slots__ = ("timings", "start", "db_time")
+
+    def __enter__(self):
+        self.timings = timings = current_timings.get()
+        if timings is not None:
+            timings.serializing_depth += 1
+            if timings.serializing_depth == 1:
+                self.db_time = timings.db_time
+                self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        timings = self.timings
+        if timings is not None:
+            timings.serializing_depth -= 1
+            if timings.serializing_depth == 0:
+                elapsed = time.perf_counter() - self.start
+                timings.serializer_time += elapsed - (timings.db_time - self.db_time)
+
+
+registry = Registry()
+
+requests_total = registry.register(
+    Counter(
+        "http_requests_total",
+        "Requests handled, sampled or not.",
+        ["view", "method", "status"],
+    )
+)
+request_duration = registry.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Wall time spent handling sampled requests.",
+        ["view", "method"],
+    )
+)
+db_duration = registry.register(
+    Histogram(
+        "http_request_db_duration_seconds",
+        "Time sampled requests spent in database queries.",
+        ["view", "method"],
+    )
+)
+db_queries = registry.register(
+    Histogram(
+        "http_request_db_queries",
+        "Database queries run by sampled requests.",
+        ["view", "method"],
+        buckets=QUERY_BUCKETS,
+    )
+)
+serializer_duration = registry.register(
+    Histogram(
+        "http_request_serializer_duration_seconds",
+        "Time sampled requests spent serializing, excluding database queries.",
+        ["view", "method"],
+    )
+)
+response_size = registry.register(
+    Histogram(
+        "http_response_size_bytes",
+        "Body size of sampled, non-streaming responses.",
+        ["view", "method"],
+        buckets=SIZE_BUCKETS,
+    )
+)
@@ -0,0 +1,116 @@
+import random
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from . import metrics
+from .metrics import RequestTimings, current_timings
+
+
+class PerformanceMiddleware:
+    """
+    Records per view wall time, database time and query count, serializer
+    time and response size into api.metrics, and reports them in a
+    ``Server-Timing`` header.
+
+    Every request is counted, but only a PERFORMANCE_SAMPLE_RATE share of
+    them is timed. With DB_QUERY_COUNT_HEADER on, every request is timed
+    and its query count is also sent in an ``X-DB-Queries`` header for the
+    load tests in api.loadtest.
+
+    The middleware runs synchronously under WSGI and natively under ASGI,
+    so async views aren't adapted to a thread on its account. Queries are
+    counted by metrics.time_queries in whichever thread runs them, but not
+    those that streaming responses run after the view returns.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        self.query_count_header = getattr(settings, "DB_QUERY_COUNT_HEADER", False)
+        self.sample_rate = (
+            1.0
+            if self.query_count_header
+            else getattr(settings, "PERFORMANCE_SAMPLE_RATE", 1.0)
+        )
+        self.server_timing = getattr(settings, "SERVER_TIMING_HEADER", True)
+
+    def sampled(self):
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not self.sampled():
+            response = self.get_response(request)
+            self.count(request, response)
+            return response
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.record(request, response, time.perf_counter() - start, timings)
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            response = await self.get_response(request)
+            self.count(request, response)
+            return response
+
+        timings = RequestTimings()
+        token = current_timings.set(timings)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return self.record(request, response, time.perf_counter() - start, timings)
+
+    def count(self, request, response):
+        metrics.requests_total.inc(
+            view_name(request), request.method, str(response.status_code)
+        )
+
+    def record(self, request, response, elapsed, timings):
+        labels = (view_name(request), request.method)
+        metrics.requests_total.inc(*labels, str(response.status_code))
+        metrics.request_duration.observe(elapsed, *labels)
+        metrics.db_duration.observe(timings.db_time, *labels)
+        metrics.db_queries.observe(timings.queries, *labels)
+        metrics.serializer_duration.observe(timings.serializer_time, *labels)
+        if not response.streaming:
+            metrics.response_size.observe(len(response.content), *labels)
+
+        if self.server_timing:
+            response["Server-Timing"] = server_timing(elapsed, timings)
+        if self.query_count_header:
+            response["X-DB-Queries"] = str(timings.queries)
+        return response
+
+
+def view_name(request):
+    """The URL name of the view that handled ``request``, used as a label."""
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.view_name or match.route
+
+
+def server_timing(elapsed, timings):
+    return ", ".join(
+        [
+            f"total;dur={elapsed * 1000:.2f}",
+            f'db;dur={timings.db_time * 1000:.2f};desc="{timings.queries} queries"',
+            f"serializer;dur={timings.serializer_time * 1000:.2f}",
+        ]
+    )
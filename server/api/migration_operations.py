@@ -0,0 +1,118 @@
+"""
+Migration operations that avoid locking ``api_ping`` against writes while
+indexes are built on large tables.
+
+On Postgres they build and drop indexes CONCURRENTLY, which cannot run in a
+transaction, so migrations using them must set ``atomic = False``. Other
+databases get plain AddIndex / RemoveIndex behaviour, as do partitioned
+tables (see api.partitions), whose indexes Postgres cannot build
+concurrently.
+"""
+
+from django.db import migrations, models
+
+
+def concurrently(schema_editor, model):
+    """Whether indexes on ``model`` can be built and dropped CONCURRENTLY."""
+    connection = schema_editor.connection
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT 1 FROM pg_partitioned_table p
+            JOIN pg_class c ON c.oid = p.partrelid
+            WHERE c.relname = %s AND pg_table_is_visible(c.oid)
+            """,
+            [model._meta.db_table],
+        )
+        return cursor.fetchone() is None
+
+
+class AddIndexConcurrently(migrations.AddIndex):
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not concurrently(schema_editor, model):
+            return super().database_forwards(
+                app_label, schema_editor, from_state, to_state
+            )
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.add_index(model, self.index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not concurrently(schema_editor, model):
+            return super().database_backwards(
+                app_label, schema_editor, from_state, to_state
+            )
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            schema_editor.remove_index(model, self.index, concurrently=True)
+
+
+class RemoveIndexConcurrently(migrations.RemoveIndex):
+    def get_index(self, app_label, state):
+        model_state = state.models[app_label, self.model_name_lower]
+        return model_state.get_index_by_name(self.name)
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        model = from_state.apps.get_model(app_label, self.model_name)
+        if not concurrently(schema_editor, model):
+            return super().database_forwards(
+                app_label, schema_editor, from_state, to_state
+            )
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            index = self.get_index(app_label, from_state)
+            schema_editor.remove_index(model, index, concurrently=True)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        model = to_state.apps.get_model(app_label, self.model_name)
+        if not concurrently(schema_editor, model):
+            return super().database_backwards(
+                app_label, schema_editor, from_state, to_state
+            )
+        if self.allow_migrate_model(schema_editor.connection.alias, model):
+            index = self.get_index(app_label, to_state)
+            schema_editor.add_index(model, index, concurrently=True)
+
+
+class AlterFieldIndexConcurrently(migrations.AlterField):
+    """
+    AlterField for a change to ``db_index`` alone, which builds or drops the
+    field's own index.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        from_model = from_state.apps.get_model(app_label, self.model_name)
+        to_model = to_state.apps.get_model(app_label, self.model_name)
+        if not concurrently(schema_editor, to_model):
+            return super().database_forwards(
+                app_label, schema_editor, from_state, to_state
+            )
+        if not self.allow_migrate_model(schema_editor.connection.alias, to_model):
+            return
+        old_field = from_model._meta.get_field(self.name)
+        new_field = to_model._meta.get_field(self.name)
+        was_indexed = schema_editor._field_should_be_indexed(from_model, old_field)
+        is_indexed = schema_editor._field_should_be_indexed(to_model, new_field)
+        if is_indexed and not was_indexed:
+            schema_editor.execute(
+                schema_editor._create_index_sql(
+                    to_model, fields=[new_field], concurrently=True
+                )
+            )
+        elif was_indexed and not is_indexed:
+            # As BaseDatabaseSchemaEditor._alter_field finds it, leaving
+            # Meta.indexes on the column alone.
+            index_names = schema_editor._constraint_names(
+                from_model,
+                [old_field.column],
+                index=True,
+                type_=models.Index.suffix,
+                exclude={index.name for index in from_model._meta.indexes},
+            )
+            for index_name in index_names:
+                schema_editor.execute(
+                    schema_editor._delete_index_sql(
+                        from_model, index_name, concurrently=True
+                    )
+                )
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.3 on 2026-10-17 19:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_alter_user_code_name'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ping',
+            name='depth',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='ping',
+            name='root_ping',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='trail_pings', to='api.ping'),
+        ),
+        migrations.AddIndex(
+            model_name='ping',
+            index=models.Index(fields=['root_ping', 'depth'], name='api_ping_root_pi_231c95_idx'),
+        ),
+    ]
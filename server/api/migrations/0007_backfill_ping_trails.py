@@ -0,0 +1,53 @@
+# Generated by Django 5.2.3 on 2026-10-17 19:52
+
+from django.db import migrations
+
+MAX_TRAIL_DEPTH = 1000
+
+
+def backfill_ping_trails(apps, schema_editor):
+    """
+    Sets root_ping and depth on every answer; roots keep a NULL root_ping.
+    Postgres joins the CTE in a single UPDATE ... FROM; sqlite, without it
+    before 3.33, looks each row up.
+    """
+    Ping = apps.get_model("api", "Ping")
+    table = Ping._meta.db_table
+    subtree = f"""
+        WITH RECURSIVE subtree(id, root_id, depth) AS (
+            SELECT id, id, 0 FROM {table} WHERE parent_ping_id IS NULL
+            UNION ALL
+            SELECT c.id, s.root_id, s.depth + 1
+            FROM {table} c JOIN subtree s ON c.parent_ping_id = s.id
+            WHERE s.depth < %s
+        )
+    """
+    if schema_editor.connection.vendor == "postgresql":
+        update = f"""
+            UPDATE {table} SET root_ping_id = s.root_id, depth = s.depth
+            FROM subtree s WHERE s.id = {table}.id AND s.depth > 0
+        """
+    else:
+        update = f"""
+            UPDATE {table} SET
+                root_ping_id = (
+                    SELECT root_id FROM subtree WHERE subtree.id = {table}.id
+                ),
+                depth = (
+                    SELECT depth FROM subtree WHERE subtree.id = {table}.id
+                )
+            WHERE id IN (SELECT id FROM subtree WHERE depth > 0)
+        """
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(subtree + update, [MAX_TRAIL_DEPTH])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_ping_root_ping_depth'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_ping_trails, migrations.RunPython.noop),
+    ]
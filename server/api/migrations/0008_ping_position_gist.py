@@ -0,0 +1,34 @@
+from django.db import migrations
+
+INDEX_NAME = "api_ping_position_gist"
+
+
+def create_position_index(apps, schema_editor):
+    # Only Postgres has the point type and GiST indexes; other databases
+    # answer position queries from the (latitude, longitude) B-tree.
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    table = apps.get_model("api", "Ping")._meta.db_table
+    schema_editor.execute(
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {INDEX_NAME} "
+        f"ON {table} USING gist (point(longitude, latitude))"
+    )
+
+
+def drop_position_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {INDEX_NAME}")
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('api', '0007_backfill_ping_trails'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_position_index, drop_position_index),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.3 on 2026-10-17 20:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_ping_position_gist'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('count', models.PositiveIntegerField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'bucket'], name='api_pingrol_user_id_224b6c_idx')],
+                'constraints': [models.UniqueConstraint(fields=('bucket', 'user'), name='api_pingrollup_bucket_user_uniq')],
+            },
+        ),
+    ]
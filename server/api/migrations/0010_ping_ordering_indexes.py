@@ -0,0 +1,34 @@
+# Generated by Django 5.2.3 on 2026-10-17 20:50
+
+from django.db import migrations, models
+
+from api.migration_operations import AddIndexConcurrently, RemoveIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # Indexes are built CONCURRENTLY on Postgres, outside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('api', '0009_pingrollup'),
+    ]
+
+    # The new indexes are built before the ones they replace are dropped.
+    operations = [
+        AddIndexConcurrently(
+            model_name='ping',
+            index=models.Index(fields=['-timestamp', '-id'], name='api_ping_timesta_b11a52_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='ping',
+            index=models.Index(fields=['user', '-timestamp', '-id'], name='api_ping_user_id_cdbd8c_idx'),
+        ),
+        RemoveIndexConcurrently(
+            model_name='ping',
+            name='api_ping_user_id_e5a01c_idx',
+        ),
+        RemoveIndexConcurrently(
+            model_name='ping',
+            name='api_ping_timesta_318bcf_idx',
+        ),
+    ]
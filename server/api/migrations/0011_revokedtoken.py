@@ -0,0 +1,40 @@
+# Generated by Django 5.2.3 on 2026-10-17 21:20
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def copy_blacklisted_tokens(apps, schema_editor):
+    """Carries over tokens blacklisted by token_blacklist that are still live."""
+    BlacklistedToken = apps.get_model("token_blacklist", "BlacklistedToken")
+    RevokedToken = apps.get_model("api", "RevokedToken")
+    live = BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now())
+    RevokedToken.objects.bulk_create(
+        (
+            RevokedToken(jti=jti, expires_at=expires_at)
+            for jti, expires_at in live.values_list(
+                "token__jti", "token__expires_at"
+            ).iterator()
+        ),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_ping_ordering_indexes'),
+        ('token_blacklist', '0012_alter_outstandingtoken_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevokedToken',
+            fields=[
+                ('jti', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.RunPython(copy_blacklisted_tokens, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.3 on 2026-10-17 21:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from api.migration_operations import AlterFieldIndexConcurrently, RemoveIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # Indexes are dropped CONCURRENTLY on Postgres, outside a transaction.
+    atomic = False
+
+    dependencies = [
+        ('api', '0011_revokedtoken'),
+    ]
+
+    # Both duplicate another index: the user foreign key's leads
+    # api_ping_user_id_cdbd8c_idx, and parent_ping's explicit one the
+    # foreign key's own.
+    operations = [
+        AlterFieldIndexConcurrently(
+            model_name='ping',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='pings', to=settings.AUTH_USER_MODEL),
+        ),
+        RemoveIndexConcurrently(
+            model_name='ping',
+            name='api_ping_parent__53c4b0_idx',
+        ),
+    ]
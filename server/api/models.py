@@ -1,3 +1,4 @@
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.contrib.auth.models import (
     AbstractBaseUser,
@@ -6,17 +7,28 @@ from django.contrib.auth.models import (
 )
 from django.contrib.auth.password_validation import validate_password
 from django.core.validators import RegexValidator
-from django.db import models
+from django.db import connections, models
+
+from . import hashing
+
+# Upper bound on hops followed when walking a trail, guards against cycles
+# introduced by re-parenting pings.
+MAX_TRAIL_DEPTH = 1000
 
 
 class UserManager(BaseUserManager):
-    def create_user(self, email, password=None, **extra_fields):
+    def create_user(self, email, password=None, validate=True, **extra_fields):
+        """
+        ``validate=False`` skips the password validators, for callers that
+        already ran them, such as RegisterSerializer.
+        """
         if not email:
             raise ValueError("The Email field must be set")
         email = self.normalize_email(email)
         user = self.model(email=email, **extra_fields)
         if password:
-            validate_password(password, user=user)
+            if validate:
+                validate_password(password, user=user)
             user.set_password(password)
         else:
             raise ValueError("The Password field must be set")
@@ -71,10 +83,134 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.email
 
+    # Hashing runs on the bounded pool of api.hashing.
+    def set_password(self, raw_password):
+        self.password = hashing.make_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        def setter(raw_password):
+            self.set_password(raw_password)
+            # Password hash upgrades shouldn't be considered password changes.
+            self._password = None
+            self.save(update_fields=["password"])
+
+        return hashing.check_password(raw_password, self.password, setter)
+
+    async def acheck_password(self, raw_password):
+        return await sync_to_async(self.check_password)(raw_password)
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        # Reading a deferred field loads the others with it: users built from
+        # token claims (api.authentication) defer all but a few.
+        deferred = self.get_deferred_fields()
+        if fields is not None and deferred.issuperset(fields):
+            fields = deferred
+        super().refresh_from_db(using, fields, from_queryset)
+
+
+def update_from_subtree(connection, table):
+    """
+    An UPDATE of ``table`` to the ``root_id`` and ``depth`` of the rows of a
+    ``subtree`` CTE. Postgres joins the CTE once; sqlite has no UPDATE ...
+    FROM before 3.33, so it looks each row up instead.
+    """
+    if connection.vendor == "postgresql":
+        return f"""
+            UPDATE {table} SET root_ping_id = s.root_id, depth = s.depth
+            FROM subtree s WHERE s.id = {table}.id
+        """
+    return f"""
+        UPDATE {table} SET
+            root_ping_id = (
+                SELECT root_id FROM subtree WHERE subtree.id = {table}.id LIMIT 1
+            ),
+            depth = (
+                SELECT depth FROM subtree WHERE subtree.id = {table}.id LIMIT 1
+            )
+        WHERE id IN (SELECT id FROM subtree)
+    """
+
+
+class PingQuerySet(models.QuerySet):
+    def trail(self, ping_id, max_depth=MAX_TRAIL_DEPTH):
+        """
+        Returns the ancestors and descendants of a ping, the ping itself
+        included, in a single recursive query ordered by trail depth.
+        """
+        table = self.model._meta.db_table
+        sql = f"""
+            WITH RECURSIVE ancestors(id, parent_ping_id, hops) AS (
+                SELECT id, parent_ping_id, 0 FROM {table} WHERE id = %s
+                UNION ALL
+                SELECT p.id, p.parent_ping_id, a.hops + 1
+                FROM {table} p JOIN ancestors a ON p.id = a.parent_ping_id
+                WHERE a.hops < %s
+            ),
+            descendants(id, hops) AS (
+                SELECT id, 0 FROM {table} WHERE id = %s
+                UNION ALL
+                SELECT p.id, d.hops + 1
+                FROM {table} p JOIN descendants d ON p.parent_ping_id = d.id
+                WHERE d.hops < %s
+            ),
+            chain(id) AS (
+                SELECT id FROM ancestors
+                UNION
+                SELECT id FROM descendants
+            )
+            SELECT p.* FROM {table} p
+            WHERE p.id IN (SELECT id FROM chain)
+            ORDER BY p.depth, p.timestamp, p.id
+        """
+        return self.model.objects.raw(sql, [ping_id, max_depth, ping_id, max_depth])
+
+    def in_trail(self, root_id):
+        """The pings of the trail rooted at ``root_id``, the root included."""
+        return self.filter(models.Q(root_ping=root_id) | models.Q(pk=root_id))
+
+    def rebuild_trails(self, ping_ids, max_depth=MAX_TRAIL_DEPTH):
+        """
+        Recomputes ``root_ping`` and ``depth`` for the subtrees rooted at
+        ``ping_ids``, trusting the stored values of their parents. The given
+        pings must not be ancestors of one another.
+        """
+        ping_ids = list(ping_ids)
+        if not ping_ids:
+            return
+        table = self.model._meta.db_table
+        placeholders = ", ".join(["%s"] * len(ping_ids))
+        subtree = f"""
+            WITH RECURSIVE subtree(id, root_id, depth) AS (
+                SELECT p.id,
+                    CASE WHEN parent.id IS NULL THEN NULL
+                        ELSE COALESCE(parent.root_ping_id, parent.id) END,
+                    CASE WHEN parent.id IS NULL THEN 0
+                        ELSE parent.depth + 1 END
+                FROM {table} p
+                LEFT JOIN {table} parent ON parent.id = p.parent_ping_id
+                WHERE p.id IN ({placeholders})
+                UNION ALL
+                SELECT c.id, COALESCE(s.root_id, s.id), s.depth + 1
+                FROM {table} c JOIN subtree s ON c.parent_ping_id = s.id
+                WHERE s.depth < %s
+            )
+        """
+        connection = connections[self.db]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                subtree + update_from_subtree(connection, table),
+                [*ping_ids, max_depth],
+            )
+
 
 class Ping(models.Model):
+    # Indexed by the (user, -timestamp, -id) index.
     user = models.ForeignKey(
-        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="pings"
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="pings",
+        db_index=False,
     )
     latitude = models.FloatField()
     longitude = models.FloatField()
@@ -86,14 +222,76 @@ class Ping(models.Model):
         on_delete=models.SET_NULL,
         related_name="child_pings",
     )
+    # Denormalized trail position, maintained on write so that trail lookups
+    # are an indexed scan instead of a walk over parent_ping. Roots have no
+    # root_ping, which saves an UPDATE once their primary key is known; see
+    # trail_root_id. Indexed by the (root_ping, depth) index.
+    root_ping = models.ForeignKey(
+        "self",
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name="trail_pings",
+        db_index=False,
+    )
+    depth = models.PositiveIntegerField(default=0)
+
+    objects = PingQuerySet.as_manager()
 
     def __str__(self):
         return f"Ping by {self.user.email} at {self.timestamp} ({self.latitude}, {self.longitude})"
 
+    @property
+    def trail_root_id(self):
+        """The id of the root of this ping's trail, its own for a root."""
+        return self.root_ping_id or self.pk
+
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.parent_ping_id is not None:
+            parent = self.parent_ping
+            self.root_ping_id = parent.trail_root_id
+            self.depth = parent.depth + 1
+        super().save(*args, **kwargs)
+
     class Meta:
         indexes = [
-            models.Index(fields=["user"]),
-            models.Index(fields=["timestamp"]),
+            # The default ordering, with the id tie-break keyset pages use.
+            models.Index(fields=["-timestamp", "-id"]),
+            # A user's pings in the default ordering. Also serves filters on
+            # the user alone, so the user foreign key has no index of its own.
+            models.Index(fields=["user", "-timestamp", "-id"]),
             models.Index(fields=["latitude", "longitude"]),
-            models.Index(fields=["parent_ping"]),
+            # parent_ping is indexed as a foreign key.
+            models.Index(fields=["root_ping", "depth"]),
+        ]
+
+
+class PingRollup(models.Model):
+    """
+    Pings created per user per minute, maintained by ``manage.py
+    rollup_pings`` so that time-bucketed statistics do not scan pings.
+    """
+
+    bucket = models.DateTimeField()
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+"
+    )
+    count = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["bucket", "user"], name="api_pingrollup_bucket_user_uniq"
+            )
         ]
+        indexes = [models.Index(fields=["user", "bucket"])]
+
+
+class RevokedToken(models.Model):
+    """
+    A refresh token revoked by rotation or logout, kept until it expires. See
+    api.blacklist.
+    """
+
+    jti = models.CharField(max_length=255, primary_key=True)
+    expires_at = models.DateTimeField(db_index=True)
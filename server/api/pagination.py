@@ -0,0 +1,173 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from asgiref.sync import sync_to_async
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def _encode_value(value):
+    # isoformat keeps microseconds, which the keyset comparison relies on.
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset pagination over ``(<ordering field>, id)``.
+
+    Pages are fetched with a ``(field, id) < (last field, last id)`` condition
+    instead of an OFFSET, so deep pages cost the same as the first one and do
+    not shift when new rows are inserted. The cursor is an opaque token
+    holding the boundary row's key. Orderings that are not a single field, or
+    requests that ask for a ``page`` explicitly, fall back to page number
+    pagination.
+
+    First pages keep the ``count`` of page number pagination. Views that
+    have already counted the rows, as the ping list does for its validators,
+    set ``count`` so it isn't counted again. Pages reached through a cursor
+    leave it out rather than count every row on each page.
+    """
+
+    cursor_query_param = "cursor"
+    page_size = api_settings.PAGE_SIZE
+    invalid_cursor_message = "Invalid cursor"
+    fallback_class = PageNumberPagination
+    count = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_queryset = self.get_page_queryset(queryset, request)
+        if page_queryset is None:
+            return self.fallback.paginate_queryset(queryset, request, view)
+        if self.count is None and self.position is None:
+            self.count = queryset.order_by().count()
+        return self.set_page(list(page_queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """Async variant of paginate_queryset for async views."""
+        page_queryset = self.get_page_queryset(queryset, request)
+        if page_queryset is None:
+            return await sync_to_async(self.fallback.paginate_queryset)(
+                queryset, request, view
+            )
+        if self.count is None and self.position is None:
+            self.count = await queryset.order_by().acount()
+        return self.set_page([row async for row in page_queryset])
+
+    def is_cursor_page(self, request):
+        return self.cursor_query_param in request.query_params
+
+    def get_page_queryset(self, queryset, request):
+        """
+        Returns the unevaluated queryset for the requested page, fetching one
+        extra row to detect a following page, or None when falling back to
+        page number pagination.
+        """
+        self.request = request
+        self.fallback = None
+        ordering = queryset.query.order_by or queryset.model._meta.ordering
+        if (
+            len(ordering) != 1
+            or self.fallback_class.page_query_param in request.query_params
+        ):
+            self.fallback = self.fallback_class()
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.field = ordering[0].lstrip("-")
+        descending = ordering[0].startswith("-")
+        self.position, self.reverse = self.decode_cursor(request, queryset.model)
+
+        # Walking backwards flips the ordering; results are flipped back below.
+        if descending != self.reverse:
+            order_by = (f"-{self.field}", "-id")
+            lookup = "lt"
+        else:
+            order_by = (self.field, "id")
+            lookup = "gt"
+        queryset = queryset.order_by(*order_by)
+        if self.position is not None:
+            value, pk = self.position
+            # The redundant inclusive bound lets the planner range scan the
+            # index on the ordering field instead of evaluating the OR.
+            queryset = queryset.filter(
+                Q(**{f"{self.field}__{lookup}e": value}),
+                Q(**{f"{self.field}__{lookup}": value}) | Q(**{f"id__{lookup}": pk}),
+            )
+        return queryset[: self.page_size + 1]
+
+    def set_page(self, results):
+        has_more = len(results) > self.page_size
+        results = results[: self.page_size]
+        if self.reverse:
+            results.reverse()
+            self.has_next, self.has_previous = self.position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, self.position is not None
+        self.page = results
+        return results
+
+    def decode_cursor(self, request, model):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None, False
+        try:
+            token = json.loads(urlsafe_b64decode(encoded.encode("ascii")))
+            value = model._meta.get_field(self.field).to_python(token["v"])
+            pk = int(token["id"])
+            reverse = bool(token.get("r", False))
+        except (TypeError, ValueError, KeyError, ValidationError, FieldDoesNotExist):
+            raise NotFound(self.invalid_cursor_message)
+        return (value, pk), reverse
+
+    def encode_cursor(self, instance, reverse=False):
+        if isinstance(instance, dict):
+            value, pk = instance[self.field], instance["id"]
+        else:
+            value, pk = getattr(instance, self.field), instance.id
+        token = {"v": _encode_value(value), "id": pk}
+        if reverse:
+            token["r"] = True
+        encoded = urlsafe_b64encode(
+            json.dumps(token, separators=(",", ":")).encode("ascii")
+        ).decode("ascii")
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_next_link(self):
+        if self.fallback is not None:
+            return self.fallback.get_next_link()
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_previous_link(self):
+        if self.fallback is not None:
+            return self.fallback.get_previous_link()
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        if self.fallback is not None:
+            return self.fallback.get_paginated_response(data)
+        counted = {"count": self.count} if self.position is None else {}
+        return Response(
+            {
+                **counted,
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,
+            }
+        )
+
+    def get_paginated_response_schema(self, schema):
+        return self.fallback_class().get_paginated_response_schema(schema)
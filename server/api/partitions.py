@@ -0,0 +1,278 @@
+"""
+Monthly range partitioning of api_ping by timestamp on Postgres, managed
+with ``manage.py ping_partitions``.
+
+convert_to_partitioned() rebuilds api_ping once as a table partitioned by
+month, with a default partition catching rows outside every month that has
+been created. From then on ensure_partitions() creates upcoming months
+ahead of time and detach_partitions() detaches old months, leaving them as
+standalone archive tables or dropping them.
+
+Postgres requires unique constraints on a partitioned table to include the
+partition key, so the primary key becomes ``(id, timestamp)``. Ids keep
+coming from a single sequence and stay unique, and a plain index on id
+serves lookups by primary key. For the same reason ``parent_ping`` and
+``root_ping`` cannot stay foreign key constraints. Django already handles
+their on_delete behaviour, and detaching a month first turns pings answering
+pings in it into trail roots, as deleting those pings would.
+
+Indexes are defined on the partitioned table and cascade to every
+partition, so each month has small indexes of its own. Queries filtering or
+ordering by timestamp only touch the months they need.
+"""
+
+from datetime import datetime, timezone
+
+from django.db import transaction
+
+from .caches import ping_changes
+from .models import Ping
+
+TABLE = Ping._meta.db_table
+DEFAULT_PARTITION = f"{TABLE}_default"
+SEQUENCE = f"{TABLE}_id_partitioned_seq"
+
+
+class PartitionError(Exception):
+    pass
+
+
+def month_start(value):
+    return datetime(value.year, value.month, 1, tzinfo=timezone.utc)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(month):
+    return f"{TABLE}_p{month:%Y_%m}"
+
+
+def _literal(value):
+    return f"'{value.isoformat()}'"
+
+
+def create_partition_statements(month, move_from_default=False):
+    """
+    SQL creating the partition for ``month``. Postgres refuses to create a
+    partition while the default partition holds rows in its range, so when
+    ``move_from_default`` is set those rows are moved over.
+    """
+    name = partition_name(month)
+    start, end = _literal(month), _literal(add_months(month, 1))
+    create = (
+        f"CREATE TABLE {name} PARTITION OF {TABLE} FOR VALUES FROM ({start}) TO ({end})"
+    )
+    if not move_from_default:
+        return [create]
+    in_range = f"timestamp >= {start} AND timestamp < {end}"
+    return [
+        f"ALTER TABLE {TABLE} DETACH PARTITION {DEFAULT_PARTITION}",
+        create,
+        f"INSERT INTO {name} SELECT * FROM {DEFAULT_PARTITION} WHERE {in_range}",
+        f"DELETE FROM {DEFAULT_PARTITION} WHERE {in_range}",
+        f"ALTER TABLE {TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT",
+    ]
+
+
+def _require_postgres(connection):
+    if connection.vendor != "postgresql":
+        raise PartitionError("Partitioning api_ping requires PostgreSQL.")
+
+
+def _fetch(cursor, sql, params=()):
+    cursor.execute(sql, params)
+    return cursor.fetchall()
+
+
+def is_partitioned(connection, table=TABLE):
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cursor:
+        return bool(
+            _fetch(
+                cursor,
+                """
+                SELECT 1 FROM pg_partitioned_table p
+                JOIN pg_class c ON c.oid = p.partrelid
+                WHERE c.relname = %s AND pg_table_is_visible(c.oid)
+                """,
+                [table],
+            )
+        )
+
+
+def partitions(connection):
+    """Returns ``{month: name}`` of the monthly partitions of api_ping."""
+    _require_postgres(connection)
+    with connection.cursor() as cursor:
+        names = _fetch(
+            cursor,
+            """
+            SELECT c.relname FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = %s AND pg_table_is_visible(p.oid)
+            """,
+            [TABLE],
+        )
+    months = {}
+    for (name,) in names:
+        if name == DEFAULT_PARTITION:
+            continue
+        month = datetime.strptime(name[len(TABLE) + 2 :], "%Y_%m")
+        months[month.replace(tzinfo=timezone.utc)] = name
+    return dict(sorted(months.items()))
+
+
+def ensure_partitions(connection, months_ahead=3, now=None):
+    """
+    Creates the partitions of the current month and ``months_ahead``
+    following ones that do not exist yet, and returns their names.
+    """
+    _require_postgres(connection)
+    if not is_partitioned(connection):
+        raise PartitionError(f"{TABLE} is not partitioned; run convert first.")
+    current = month_start(now or datetime.now(timezone.utc))
+    existing = partitions(connection)
+    created = []
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        for offset in range(months_ahead + 1):
+            month = add_months(current, offset)
+            if month in existing:
+                continue
+            start, end = _literal(month), _literal(add_months(month, 1))
+            (in_default,) = _fetch(
+                cursor,
+                f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} "
+                f"WHERE timestamp >= {start} AND timestamp < {end})",
+            )[0]
+            for sql in create_partition_statements(month, in_default):
+                cursor.execute(sql)
+            created.append(partition_name(month))
+    return created
+
+
+def convert_to_partitioned(connection, months_ahead=3, now=None):
+    """
+    Rebuilds api_ping as a partitioned table holding the same rows, indexes
+    and foreign keys, apart from the primary key and trail references
+    described in the module docstring.
+
+    The table is locked and copied in one transaction, so run this in a
+    maintenance window.
+    """
+    _require_postgres(connection)
+    if is_partitioned(connection):
+        raise PartitionError(f"{TABLE} is already partitioned.")
+    legacy = f"{TABLE}_unpartitioned"
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE")
+        referencing = _fetch(
+            cursor,
+            """
+            SELECT conname FROM pg_constraint
+            WHERE contype = 'f' AND confrelid = %s::regclass
+            AND conrelid <> %s::regclass
+            """,
+            [TABLE, TABLE],
+        )
+        if referencing:
+            names = ", ".join(name for (name,) in referencing)
+            raise PartitionError(f"Other tables reference {TABLE}: {names}")
+        indexes = _fetch(
+            cursor,
+            """
+            SELECT indexdef FROM pg_indexes i
+            WHERE tablename = %s AND NOT EXISTS (
+                SELECT 1 FROM pg_constraint c
+                WHERE c.conindid = (quote_ident(i.indexname))::regclass
+            )
+            """,
+            [TABLE],
+        )
+        # Outgoing foreign keys other than the trail self-references.
+        foreign_keys = _fetch(
+            cursor,
+            """
+            SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+            WHERE contype = 'f' AND conrelid = %s::regclass
+            AND confrelid <> %s::regclass
+            """,
+            [TABLE, TABLE],
+        )
+        (first,) = _fetch(cursor, f"SELECT min(timestamp) FROM {TABLE}")[0]
+
+        statements = [
+            f"ALTER TABLE {TABLE} RENAME TO {legacy}",
+            f"CREATE TABLE {TABLE} (LIKE {legacy} INCLUDING DEFAULTS) "
+            "PARTITION BY RANGE (timestamp)",
+            f"CREATE SEQUENCE {SEQUENCE} AS bigint",
+            f"SELECT setval('{SEQUENCE}', coalesce(max(id), 0) + 1, false) "
+            f"FROM {legacy}",
+            f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{SEQUENCE}')",
+            f"ALTER SEQUENCE {SEQUENCE} OWNED BY {TABLE}.id",
+            f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT",
+        ]
+        current = month_start(now or datetime.now(timezone.utc))
+        month = month_start(first) if first else current
+        while month <= add_months(current, months_ahead):
+            statements += create_partition_statements(month)
+            month = add_months(month, 1)
+        statements += [
+            f"INSERT INTO {TABLE} SELECT * FROM {legacy}",
+            f"DROP TABLE {legacy}",
+            f"ALTER TABLE {TABLE} ADD PRIMARY KEY (id, timestamp)",
+            f"CREATE INDEX {TABLE}_id_idx ON {TABLE} (id)",
+            *(indexdef for (indexdef,) in indexes),
+            *(
+                f"ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}"
+                for name, definition in foreign_keys
+            ),
+        ]
+        for sql in statements:
+            cursor.execute(sql)
+    return partitions(connection)
+
+
+def detach_trails(start, end):
+    """
+    Turns pings outside [start, end) that answer pings inside it into trail
+    roots, as deleting their parents would, and returns their ids.
+    """
+    children = list(
+        Ping.objects.exclude(timestamp__gte=start, timestamp__lt=end)
+        .filter(parent_ping__timestamp__gte=start, parent_ping__timestamp__lt=end)
+        .values_list("id", flat=True)
+    )
+    if children:
+        Ping.objects.filter(id__in=children).update(parent_ping=None)
+        Ping.objects.rebuild_trails(children)
+    return children
+
+
+def detach_partitions(connection, keep_months, drop=False, now=None):
+    """
+    Detaches the monthly partitions older than the last ``keep_months``
+    months, which are kept as standalone tables unless ``drop`` is set.
+    Returns the names of the detached partitions.
+    """
+    _require_postgres(connection)
+    if keep_months < 1:
+        raise PartitionError("At least the current month must be kept.")
+    current = month_start(now or datetime.now(timezone.utc))
+    cutoff = add_months(current, 1 - keep_months)
+    detached = []
+    for month, name in partitions(connection).items():
+        if month >= cutoff:
+            break
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            detach_trails(month, add_months(month, 1))
+            cursor.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {name}")
+            if drop:
+                cursor.execute(f"DROP TABLE {name}")
+            ping_changes.changed()
+        detached.append(name)
+    return detached
@@ -5,4 +5,5 @@ class IsOwnerOrReadOnly(permissions.BasePermission):
     def has_object_permission(self, request, view, obj):
         if request.method in permissions.SAFE_METHODS:
             return True
-        return obj.user == request.user
+        # Compares ids, so the ping's user is not loaded.
+        return obj.user_id == request.user.pk
@@ -0,0 +1,96 @@
+import csv
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def flatten(data, prefix=""):
+    """Flattens nested dicts into one level with dotted keys."""
+    flat = {}
+    for key, value in data.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+class _Echo:
+    """A file-like object whose write() returns what was written."""
+
+    def write(self, value):
+        return value
+
+
+class StreamingRenderer(BaseRenderer):
+    """
+    A renderer for exports. ``stream()`` renders an iterable of records
+    lazily in chunks of ``chunk_size`` records for a StreamingHttpResponse;
+    ``render()`` handles ordinary response data such as error bodies.
+    """
+
+    charset = "utf-8"
+    chunk_size = 1000
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        records = data if isinstance(data, list) else [data]
+        return b"".join(self.stream(records))
+
+    def stream(self, records):
+        lines = []
+        for record in records:
+            lines.append(self.render_record(record))
+            if len(lines) >= self.chunk_size:
+                yield "".join(lines).encode(self.charset)
+                lines = []
+        if lines:
+            yield "".join(lines).encode(self.charset)
+
+    def render_record(self, record):
+        raise NotImplementedError
+
+
+class NDJSONRenderer(StreamingRenderer):
+    """Newline delimited JSON, one compact JSON document per record."""
+
+    media_type = "application/x-ndjson"
+    format = "ndjson"
+
+    def render_record(self, record):
+        return (
+            json.dumps(
+                record,
+                cls=JSONEncoder,
+                ensure_ascii=False,
+                allow_nan=False,
+                separators=(",", ":"),
+            )
+            + "\n"
+        )
+
+
+class CSVRenderer(StreamingRenderer):
+    """
+    CSV with a header row taken from the first record. Nested objects are
+    flattened into dotted columns, e.g. ``user.email``.
+    """
+
+    media_type = "text/csv"
+    format = "csv"
+
+    def stream(self, records):
+        self.writer = csv.writer(_Echo())
+        self.header = None
+        return super().stream(records)
+
+    def render_record(self, record):
+        record = flatten(record)
+        if self.header is None:
+            self.header = list(record)
+            return self.writer.writerow(self.header) + self.writer.writerow(
+                record.values()
+            )
+        return self.writer.writerow(record[column] for column in self.header)
@@ -0,0 +1,68 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+
+class PreRenderedJSONResponse(Response):
+    """
+    A Response for a body that was already rendered with JSONRenderer, e.g.
+    one served from a cache. JSON requests get the bytes as they are; other
+    renderers (the browsable API) and ``.data`` decode them on demand.
+    """
+
+    def __init__(self, rendered, **kwargs):
+        self.rendered = rendered
+        super().__init__(**kwargs)
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = json.loads(self.rendered)
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._data = value
+
+    @property
+    def rendered_content(self):
+        renderer = getattr(self, "accepted_renderer", None)
+        if type(renderer) is JSONRenderer and not renderer.get_indent(
+            self.accepted_media_type, self.renderer_context
+        ):
+            self["Content-Type"] = self.content_type or renderer.media_type
+            return self.rendered
+        return super().rendered_content
+
+
+async def iterate_in_thread(iterator):
+    """
+    Yields the items of a sync iterator one at a time, each fetched on the
+    thread sync views run on, so database cursors it reads keep their
+    connection.
+    """
+    iterator = iter(iterator)
+    done = object()
+    try:
+        while (item := await sync_to_async(next)(iterator, done)) is not done:
+            yield item
+    finally:
+        if hasattr(iterator, "close"):
+            await sync_to_async(iterator.close)()
+
+
+def streaming_response(request, content, **kwargs):
+    """
+    A StreamingHttpResponse sending the sync iterator ``content`` chunk by
+    chunk under both handlers. Django's ASGI handler reads a sync iterator
+    into a list before sending any of it, and its WSGI handler does the same
+    to an async one, so ASGI requests get ``content`` through
+    iterate_in_thread().
+    """
+    if isinstance(request, ASGIRequest):
+        content = iterate_in_thread(content)
+    return StreamingHttpResponse(content, **kwargs)
@@ -0,0 +1,175 @@
+"""
+Archival of old pings into gzip-compressed NDJSON files, run with
+``manage.py archive_pings``.
+
+Pings are archived a whole trail at a time, and only once every ping of the
+trail is older than the retention cutoff, so a trail that has been answered
+recently stays in the database in full. Each batch of trails is locked,
+written to ``<name>.partial``, deleted and committed in one short
+transaction, after which the file is renamed into place.
+
+An interrupted run leaves at most one ``.partial`` file. recover() resolves
+it on the next run: if its pings are still in the database the transaction
+never committed and the file is discarded, otherwise the file is kept.
+
+Each line holds one ping with the ids of its user, parent and root, so
+archives can be loaded back with their trails as they were.
+"""
+
+import gzip
+import json
+import os
+from pathlib import Path
+
+from django.db import connection, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+from .caches import ping_changes
+from .models import Ping
+
+ARCHIVE_FIELDS = [
+    "id",
+    "user_id",
+    "latitude",
+    "longitude",
+    "timestamp",
+    "parent_ping_id",
+    "root_ping_id",
+    "depth",
+]
+ARCHIVE_BATCH_SIZE = 500
+
+
+def archivable_roots(cutoff):
+    """
+    Roots of the trails whose pings are all older than ``cutoff``, oldest
+    first. Pings whose root has been deleted count as roots of their own.
+
+    Deleting a root through the ORM without rebuilding its trail, as a
+    cascade from its user does, leaves answers within the trail with no
+    root_ping. Such answers are roots of their own, so the trail of the
+    ping they answer doesn't include them. That trail is skipped until they
+    are archived, since deleting it would leave them pointing at a missing
+    parent.
+    """
+    recent = Ping.objects.filter(root_ping=OuterRef("pk"), timestamp__gte=cutoff)
+    strays = Ping.objects.filter(
+        Q(parent_ping=OuterRef("pk")) | Q(parent_ping__root_ping=OuterRef("pk"))
+    ).exclude(root_ping=OuterRef("pk"))
+    return (
+        Ping.objects.filter(root_ping__isnull=True, timestamp__lt=cutoff)
+        .exclude(Exists(recent))
+        .exclude(Exists(strays))
+        .order_by("timestamp", "id")
+    )
+
+
+def trail_pings(root_ids):
+    """The pings of the trails rooted at ``root_ids``, parents first."""
+    return Ping.objects.filter(
+        Q(root_ping__in=root_ids) | Q(id__in=root_ids)
+    ).order_by("depth", "timestamp", "id")
+
+
+def delete_trails(root_ids):
+    """
+    Deletes the trails rooted at ``root_ids`` in one statement. Their
+    parent_ping and root_ping references stay within the deleted pings, so
+    there is nothing for the ORM's SET_NULL handling to update.
+    """
+    table = Ping._meta.db_table
+    placeholders = ", ".join(["%s"] * len(root_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {table} WHERE root_ping_id IN ({placeholders}) "
+            f"OR id IN ({placeholders})",
+            [*root_ids, *root_ids],
+        )
+        return cursor.rowcount
+
+
+def write_archive(path, rows):
+    """Writes ``rows`` as gzip-compressed NDJSON and syncs them to disk."""
+    with open(path, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as archive:
+            for row in rows:
+                line = json.dumps(row, cls=JSONEncoder, separators=(",", ":"))
+                archive.write(line.encode() + b"\n")
+        raw.flush()
+        os.fsync(raw.fileno())
+
+
+def read_archive(path):
+    """Yields the pings of an archive file as dicts."""
+    with gzip.open(path, "rt") as archive:
+        for line in archive:
+            yield json.loads(line)
+
+
+def recover(directory):
+    """
+    Resolves the ``.partial`` files an interrupted run left in
+    ``directory``. Returns the paths of the archives kept.
+    """
+    kept = []
+    for partial in sorted(Path(directory).glob("*.partial")):
+        first = next(read_archive(partial), None)
+        if first is None or Ping.objects.filter(id=first["id"]).exists():
+            partial.unlink()
+        else:
+            final = partial.with_suffix("")
+            partial.rename(final)
+            kept.append(final)
+    return kept
+
+
+def archive_batch(directory, cutoff, after=None, batch_size=ARCHIVE_BATCH_SIZE):
+    """
+    Archives the next ``batch_size`` trails older than ``cutoff`` whose root
+    sorts after ``after``, a ``(timestamp, id)`` pair. Returns ``(path,
+    archived, last)``, where ``last`` is the position to continue from, or
+    ``(None, 0, None)`` when nothing is left.
+    """
+    roots = archivable_roots(cutoff)
+    if after is not None:
+        timestamp, root_id = after
+        roots = roots.filter(
+            Q(timestamp__gte=timestamp),
+            Q(timestamp__gt=timestamp) | Q(id__gt=root_id),
+        )
+    with transaction.atomic():
+        batch = list(
+            roots.select_for_update().values_list("timestamp", "id")[:batch_size]
+        )
+        if not batch:
+            return None, 0, None
+        root_ids = [root_id for _, root_id in batch]
+        pings = trail_pings(root_ids).select_for_update()
+        rows = list(pings.values(*ARCHIVE_FIELDS))
+        first, last = batch[0], batch[-1]
+        name = f"pings-{first[0]:%Y%m%dT%H%M%S}-{first[1]}-{last[1]}.ndjson.gz"
+        partial = Path(directory) / f"{name}.partial"
+        write_archive(partial, rows)
+        delete_trails(root_ids)
+        ping_changes.changed()
+    path = partial.rename(partial.with_suffix(""))
+    return path, len(rows), last
+
+
+def archive_pings(directory, older_than, batch_size=ARCHIVE_BATCH_SIZE, now=None):
+    """
+    Archives every trail older than ``older_than`` (a timedelta) into
+    ``directory``, batch by batch. Yields ``(path, archived)`` per batch.
+    """
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    for path in recover(directory):
+        yield path, sum(1 for _ in read_archive(path))
+    cutoff = (now or timezone.now()) - older_than
+    after = None
+    while True:
+        path, archived, after = archive_batch(directory, cutoff, after, batch_size)
+        if path is None:
+            return
+        yield path, archived
@@ -0,0 +1,138 @@
+"""
+Per-minute ping counts kept in PingRollup for time-bucketed statistics.
+
+``rollup_pings()`` recomputes whole minutes from the pings and upserts
+them, so running it again over the same period is harmless and rolling up
+from the first ping backfills everything. Each run starts ROLLUP_LAG
+before the newest rolled up minute to pick up pings from transactions that
+committed late.
+
+Statistics add up rollups before the newest rolled up minute and count the
+pings after it live. The live part only covers the pings created since the
+last run, so reads cost the same however many pings exist.
+
+Rollups count pings as they were created; deleting or archiving pings does
+not change them.
+"""
+
+from collections import Counter
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import Trunc, TruncMinute
+from django.utils import timezone
+
+from .models import Ping, PingRollup
+
+INTERVALS = {
+    "minute": timedelta(minutes=1),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+ROLLUP_LAG = timedelta(minutes=5)
+ROLLUP_BATCH_SIZE = 5000
+
+
+def floor_time(value, interval):
+    """Truncates ``value`` to the start of its ``interval`` bucket."""
+    value = timezone.localtime(value).replace(second=0, microsecond=0)
+    if interval in ("hour", "day"):
+        value = value.replace(minute=0)
+    if interval == "day":
+        value = value.replace(hour=0)
+    return value
+
+
+def newest_rollup():
+    return PingRollup.objects.aggregate(bucket=Max("bucket"))["bucket"]
+
+
+def rollup_pings(since=None):
+    """
+    Recomputes the rollups of every minute from ``since`` on, by default
+    from ROLLUP_LAG before the newest rollup (or the first ping when there
+    are none yet). Returns the number of user-minute buckets written.
+    """
+    if since is None:
+        newest = newest_rollup()
+        since = newest - ROLLUP_LAG if newest else None
+    pings = Ping.objects.all()
+    if since is not None:
+        pings = pings.filter(timestamp__gte=floor_time(since, "minute"))
+    rows = (
+        pings.annotate(minute=TruncMinute("timestamp"))
+        .values("minute", "user")
+        .annotate(total=Count("id"))
+        .order_by()
+    )
+
+    written = 0
+    batch = []
+    with transaction.atomic():
+        for row in rows.iterator(chunk_size=ROLLUP_BATCH_SIZE):
+            batch.append(
+                PingRollup(
+                    bucket=row["minute"], user_id=row["user"], count=row["total"]
+                )
+            )
+            if len(batch) >= ROLLUP_BATCH_SIZE:
+                written += _upsert(batch)
+                batch = []
+        if batch:
+            written += _upsert(batch)
+    return written
+
+
+def _upsert(rollups):
+    PingRollup.objects.bulk_create(
+        rollups,
+        update_conflicts=True,
+        unique_fields=["bucket", "user"],
+        update_fields=["count"],
+    )
+    return len(rollups)
+
+
+def rebuild_rollups():
+    """Replaces every rollup with counts recomputed from all pings."""
+    with transaction.atomic():
+        PingRollup.objects.all().delete()
+        return rollup_pings()
+
+
+def bucket_querysets(interval, since, until, user_id=None):
+    """
+    The queries bucket_counts() adds up, each yielding ``start`` and
+    ``total`` rows: one over rollups and one over the pings after them.
+    """
+    newest = newest_rollup()
+    split = min(max(newest, since), until) if newest else since
+    rollups = PingRollup.objects.filter(bucket__gte=since, bucket__lt=split)
+    pings = Ping.objects.filter(timestamp__gte=split, timestamp__lt=until)
+    if user_id is not None:
+        rollups = rollups.filter(user=user_id)
+        pings = pings.filter(user=user_id)
+    return [
+        queryset.annotate(start=Trunc(field, interval))
+        .values("start")
+        .annotate(total=total)
+        .order_by()
+        for queryset, field, total in (
+            (rollups, "bucket", Sum("count")),
+            (pings, "timestamp", Count("id")),
+        )
+    ]
+
+
+def bucket_counts(interval, since, until, user_id=None):
+    """
+    Returns ``{bucket start: count}`` of the pings created in [since,
+    until), both of which must be aligned to ``interval``. Empty buckets are
+    left out.
+    """
+    counts = Counter()
+    for rows in bucket_querysets(interval, since, until, user_id):
+        for row in rows:
+            counts[row["start"]] += row["total"]
+    return counts
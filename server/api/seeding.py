@@ -0,0 +1,188 @@
+"""
+Synthetic users and pings for load tests and benchmarks, generated by
+``manage.py seed_db --users N --pings M``.
+
+The same seed always produces the same users, positions and trails, and
+the same timestamps given the same ``until``. Pings are generated in time
+order; each one answers an earlier ping with probability ``reply_ratio``,
+picked among a window of recent pings that have fewer than
+``max_children`` answers and are shallower than ``max_depth``, so trails
+come out bushy near the root and thin out with depth.
+
+Ping ids are assigned up front so that trails can be written in bulk with
+their parent_ping, root_ping and depth already set. Rows are streamed in
+batches through COPY on Postgres and a prepared INSERT elsewhere, so memory
+use stays flat however many pings are generated.
+"""
+
+import io
+import math
+import random
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+
+from .models import Ping, User
+
+PING_COLUMNS = [
+    "id",
+    "user_id",
+    "latitude",
+    "longitude",
+    "timestamp",
+    "parent_ping_id",
+    "root_ping_id",
+    "depth",
+]
+SEED_PASSWORD = "seedAgent123!"
+SEED_BATCH_SIZE = 10000
+# Recent pings new pings may answer.
+REPLY_WINDOW = 1000
+
+
+def seed_users(count, seed=0):
+    """
+    Creates ``count`` agents, skipping those that already exist, and returns
+    the ids of all of them. They share SEED_PASSWORD, which is hashed once.
+    """
+    password = make_password(SEED_PASSWORD, salt=f"seed{seed}")
+    prefix = f"seed{seed}a"
+    users = [
+        User(
+            email=f"{prefix}{i:07d}@seed.example",
+            name="Seed Agent",
+            code_name=f"{prefix}{i:07d}",
+            password=password,
+        )
+        for i in range(count)
+    ]
+    User.objects.bulk_create(users, batch_size=SEED_BATCH_SIZE, ignore_conflicts=True)
+    return list(
+        User.objects.filter(code_name__startswith=prefix)
+        .order_by("code_name")
+        .values_list("id", flat=True)[:count]
+    )
+
+
+def generate_pings(
+    user_ids,
+    count,
+    first_id,
+    start,
+    span,
+    seed=0,
+    reply_ratio=0.3,
+    max_depth=10,
+    max_children=3,
+):
+    """
+    Yields ``count`` ping rows, tuples in PING_COLUMNS order, with ids from
+    ``first_id`` and timestamps spread evenly over ``span`` from ``start``.
+    """
+    rng = random.Random(seed)
+    step = span / max(count, 1)
+    # [id, root id or None, depth, answers] of the pings open for answers.
+    window = []
+    for i in range(count):
+        ping_id = first_id + i
+        parent = None
+        if window and rng.random() < reply_ratio:
+            index = rng.randrange(len(window))
+            parent = window[index]
+            parent[3] += 1
+            if parent[3] >= max_children:
+                window[index] = window[-1]
+                window.pop()
+        if parent is None:
+            root_id, depth = None, 0
+        else:
+            root_id, depth = parent[1] or parent[0], parent[2] + 1
+        if depth < max_depth:
+            if len(window) >= REPLY_WINDOW:
+                window[rng.randrange(len(window))] = window[-1]
+                window.pop()
+            window.append([ping_id, root_id, depth, 0])
+        # Uniform over the sphere rather than over latitudes.
+        latitude = math.degrees(math.asin(rng.uniform(-1.0, 1.0)))
+        longitude = rng.uniform(-180.0, 180.0)
+        yield (
+            ping_id,
+            user_ids[rng.randrange(len(user_ids))],
+            round(latitude, 6),
+            round(longitude, 6),
+            start + step * i,
+            parent and parent[0],
+            root_id,
+            depth,
+        )
+
+
+def _copy_text(value):
+    if value is None:
+        return r"\N"
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return str(value)
+
+
+def copy_pings(rows):
+    """Loads ping rows with COPY FROM STDIN on Postgres."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(map(_copy_text, row)) + "\n")
+    buffer.seek(0)
+    columns = ", ".join(PING_COLUMNS)
+    with connection.cursor() as cursor:
+        cursor.cursor.copy_expert(
+            f"COPY {Ping._meta.db_table} ({columns}) FROM STDIN", buffer
+        )
+
+
+def insert_pings(rows):
+    """
+    Loads ping rows with a single prepared INSERT executed for every row,
+    which skips the model instances and per-batch SQL compilation of
+    bulk_create.
+    """
+    adapt = connection.ops.adapt_datetimefield_value
+    index = PING_COLUMNS.index("timestamp")
+    columns = ", ".join(PING_COLUMNS)
+    placeholders = ", ".join(["%s"] * len(PING_COLUMNS))
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"INSERT INTO {Ping._meta.db_table} ({columns}) VALUES ({placeholders})",
+            [(*row[:index], adapt(row[index]), *row[index + 1 :]) for row in rows],
+        )
+
+
+def seed_pings(
+    user_ids, count, until, days=30, seed=0, batch_size=SEED_BATCH_SIZE, **trails
+):
+    """
+    Generates ``count`` pings by ``user_ids`` over the ``days`` before
+    ``until`` and loads them in batches of ``batch_size``, each committed on
+    its own. ``trails`` are passed on to generate_pings(). Returns the
+    generated ``(first id, last id)``.
+    """
+    load = copy_pings if connection.vendor == "postgresql" else insert_pings
+    span = timedelta(days=days)
+    first_id = (Ping.objects.aggregate(last=Max("id"))["last"] or 0) + 1
+    rows = generate_pings(user_ids, count, first_id, until - span, span, seed, **trails)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            with transaction.atomic():
+                load(batch)
+            batch = []
+    if batch:
+        with transaction.atomic():
+            load(batch)
+    # The ids were set explicitly, so move the sequence past them.
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), [Ping]):
+            cursor.execute(sql)
+    return first_id, first_id + count - 1
@@ -1,8 +1,19 @@
+import math
+from collections import defaultdict
+from functools import cache
+from operator import attrgetter
+
 from django.contrib.auth import password_validation as validators
 from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from rest_framework import serializers
 
+from .caches import user_cache
+from .metrics import serializing
 from .models import Ping, User
+from .rollups import INTERVALS, floor_time
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -17,9 +28,15 @@ class RegisterSerializer(serializers.ModelSerializer):
         }
 
     def validate_password(self, value):
+        # Validated against the submitted details, and only here: create()
+        # skips create_user's validation and hashes the password once.
+        user = User(
+            email=self.initial_data.get("email", ""),
+            name=self.initial_data.get("name", ""),
+            code_name=self.initial_data.get("code_name", ""),
+        )
         try:
-            User.objects.model().set_password(value)
-            validators.validate_password(password=value, user=User())
+            validators.validate_password(password=value, user=user)
         except DjangoValidationError as e:
             raise serializers.ValidationError(e.messages)
         return value
@@ -28,25 +45,393 @@ class RegisterSerializer(serializers.ModelSerializer):
         user = User.objects.create_user(
             email=validated_data["email"],
             password=validated_data["password"],
+            validate=False,
             name=validated_data.get("name", ""),
             code_name=validated_data.get("code_name", ""),
         )
         return user
 
 
-class UserSerializer(serializers.ModelSerializer):
+class TimedRepresentationMixin:
+    """Counts representing instances as serializer time in api.metrics."""
+
+    def to_representation(self, instance):
+        with serializing():
+            return super().to_representation(instance)
+
+
+class UserSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ("id", "email", "name", "code_name")
         read_only_fields = ("id",)
 
 
-class PingSerializer(serializers.ModelSerializer):
+class CachedUserField(serializers.PrimaryKeyRelatedField):
+    """A PrimaryKeyRelatedField to users that looks them up in user_cache."""
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+        try:
+            return user_cache.get(User._meta.pk.to_python(data))
+        except User.DoesNotExist:
+            self.fail("does_not_exist", pk_value=data)
+        except (TypeError, ValueError, DjangoValidationError):
+            self.fail("incorrect_type", data_type=type(data).__name__)
+
+
+class PingSerializer(TimedRepresentationMixin, serializers.ModelSerializer):
     user = UserSerializer(read_only=True)
-    user_id = serializers.PrimaryKeyRelatedField(
+    user_id = CachedUserField(
         queryset=User.objects.all(), source="user", write_only=True
     )
+    # Roots are stored without a root_ping but reported as their own.
+    root_ping = serializers.IntegerField(source="trail_root_id", read_only=True)
 
     class Meta:
         model = Ping
         fields = "__all__"
+        read_only_fields = ("depth",)
+
+
+# Upper bound on pings accepted by a single bulk request.
+MAX_BULK_PINGS = 5000
+BULK_BATCH_SIZE = 1000
+
+
+class PingBulkItemSerializer(serializers.Serializer):
+    """
+    One ping of a bulk request. ``ref`` is a client chosen name that later
+    pings of the same batch can respond to with ``parent_ref``;
+    ``parent_ping`` responds to an existing ping.
+    """
+
+    ref = serializers.CharField(required=False, max_length=64)
+    latitude = serializers.FloatField()
+    longitude = serializers.FloatField()
+    parent_ping = serializers.IntegerField(required=False, allow_null=True)
+    parent_ref = serializers.CharField(required=False, max_length=64)
+
+    def validate(self, attrs):
+        if attrs.get("parent_ping") is not None and "parent_ref" in attrs:
+            raise serializers.ValidationError(
+                "Only one of parent_ping and parent_ref may be given."
+            )
+        return attrs
+
+    @staticmethod
+    def clean(data):
+        """
+        Returns the validated attributes of an already well-typed item
+        without going through the fields, or None if the item needs full
+        validation. run_validation() gives the same result for items this
+        accepts and produces the error messages for everything else.
+        """
+        if not isinstance(data, dict):
+            return None
+        attrs = {}
+        for name in ("latitude", "longitude"):
+            value = data.get(name)
+            if type(value) not in (int, float) or not math.isfinite(value):
+                return None
+            attrs[name] = float(value)
+        for name in ("ref", "parent_ref"):
+            if name in data:
+                value = data[name]
+                if type(value) is not str or not 0 < len(value) <= 64:
+                    return None
+                if value != value.strip():
+                    return None
+                attrs[name] = value
+        parent_ping = data.get("parent_ping")
+        if parent_ping is not None:
+            if type(parent_ping) is not int or "parent_ref" in attrs:
+                return None
+            attrs["parent_ping"] = parent_ping
+        elif "parent_ping" in data:
+            attrs["parent_ping"] = None
+        return attrs
+
+
+class PingBulkSerializer(serializers.Serializer):
+    """
+    Validates and creates a batch of pings for one user with partial
+    success: invalid items are reported by index and the rest are created.
+
+    Items share a single PingBulkItemSerializer, parent pings outside the
+    batch are looked up in one query, and the rows are written with
+    bulk_create in one transaction, one statement per trail depth within
+    the batch so that parents have primary keys before their responses.
+    """
+
+    # Items are validated one by one in validate() so that errors are
+    # reported per item rather than failing the whole request.
+    pings = serializers.ListField(allow_empty=False, max_length=MAX_BULK_PINGS)
+
+    def validate(self, attrs):
+        item_serializer = PingBulkItemSerializer()
+        self.item_errors = {}
+        items = {}
+        refs = {}
+        for index, raw in enumerate(attrs["pings"]):
+            item = item_serializer.clean(raw)
+            if item is None:
+                try:
+                    item = item_serializer.run_validation(raw)
+                except serializers.ValidationError as exc:
+                    self.item_errors[index] = exc.detail
+            if item is not None:
+                ref = item.get("ref")
+            else:
+                ref = raw.get("ref") if isinstance(raw, dict) else None
+            if isinstance(ref, str):
+                if ref in refs:
+                    self.item_errors[index] = {
+                        "ref": ["Duplicate ref within the batch."]
+                    }
+                    continue
+                refs[ref] = index
+            if item is not None:
+                items[index] = item
+
+        parent_ids = {
+            item["parent_ping"]
+            for item in items.values()
+            if item.get("parent_ping") is not None
+        }
+        parents = {
+            pk: (root_ping_id or pk, depth)
+            for pk, root_ping_id, depth in Ping.objects.filter(
+                id__in=parent_ids
+            ).values_list("id", "root_ping_id", "depth")
+        }
+
+        # Items are checked in order, so a parent_ref to an invalid item makes
+        # its responses invalid as well.
+        for index, item in list(items.items()):
+            error = None
+            if item.get("parent_ping") is not None:
+                if item["parent_ping"] not in parents:
+                    error = {
+                        "parent_ping": [
+                            f'Invalid pk "{item["parent_ping"]}" - '
+                            "object does not exist."
+                        ]
+                    }
+            elif "parent_ref" in item:
+                parent_index = refs.get(item["parent_ref"])
+                if parent_index is None or parent_index >= index:
+                    error = {
+                        "parent_ref": ["Must be the ref of an earlier ping."]
+                    }
+                elif parent_index not in items:
+                    error = {"parent_ref": ["The referenced ping is invalid."]}
+                else:
+                    item["parent_index"] = parent_index
+            if error is not None:
+                del items[index]
+                self.item_errors[index] = error
+
+        attrs["items"] = items
+        attrs["parents"] = parents
+        return attrs
+
+    def create(self, validated_data):
+        user = validated_data["user"]
+        items = validated_data["items"]
+        parents = validated_data["parents"]
+
+        levels = defaultdict(list)
+        level_of = {}
+        for index, item in items.items():
+            parent_index = item.get("parent_index")
+            level = 0 if parent_index is None else level_of[parent_index] + 1
+            level_of[index] = level
+            levels[level].append(index)
+
+        created = {}
+        with transaction.atomic():
+            for level in sorted(levels):
+                pings = []
+                for index in levels[level]:
+                    item = items[index]
+                    ping = Ping(
+                        user=user,
+                        latitude=item["latitude"],
+                        longitude=item["longitude"],
+                    )
+                    if "parent_index" in item:
+                        parent = created[item["parent_index"]]
+                        ping.parent_ping_id = parent.pk
+                        ping.root_ping_id = parent.trail_root_id
+                        ping.depth = parent.depth + 1
+                    elif item.get("parent_ping") is not None:
+                        ping.parent_ping_id = item["parent_ping"]
+                        ping.root_ping_id, depth = parents[item["parent_ping"]]
+                        ping.depth = depth + 1
+                    created[index] = ping
+                    pings.append(ping)
+                Ping.objects.bulk_create(pings, batch_size=BULK_BATCH_SIZE)
+        return dict(sorted(created.items()))
+
+    def to_representation(self, instance):
+        items = self.validated_data["items"]
+        return {
+            "created": [
+                {"index": index, "ref": items[index].get("ref"), "id": ping.pk}
+                for index, ping in instance.items()
+            ],
+            "errors": [
+                {"index": index, "errors": errors}
+                for index, errors in sorted(self.item_errors.items())
+            ],
+        }
+
+
+# Computed ping attributes PingSerializer reads, as query expressions.
+TRAIL_ANNOTATIONS = {"trail_root_id": Coalesce("root_ping", "id")}
+
+
+def _read_plan(serializer, prefix=""):
+    """
+    Flattens the readable fields of ``serializer`` into ``(name, values key,
+    converter, nested plan)`` tuples, resolving nested serializers to
+    ``__`` lookups the way ``.values()`` names them.
+    """
+    plan = []
+    for name, field in serializer.fields.items():
+        if field.write_only:
+            continue
+        key = prefix + field.source
+        if isinstance(field, serializers.BaseSerializer):
+            plan.append((name, key, None, _read_plan(field, f"{key}__")))
+        elif isinstance(field, serializers.RelatedField):
+            # .values() already yields the related primary key.
+            plan.append((name, key, None, None))
+        else:
+            plan.append((name, key, field.to_representation, None))
+    return plan
+
+
+def _value_keys(plan):
+    for _, key, _, nested in plan:
+        if nested is None:
+            yield key
+        else:
+            yield from _value_keys(nested)
+
+
+def _attribute_getter(model, key):
+    """Returns a getter for the value ``.values(key)`` yields on ``model``."""
+    *path, name = key.split("__")
+    for part in path:
+        model = model._meta.get_field(part).related_model
+    if name in TRAIL_ANNOTATIONS:
+        # Annotated in queries, a property on instances.
+        return attrgetter(".".join([*path, name]))
+    return attrgetter(".".join([*path, model._meta.get_field(name).attname]))
+
+
+def _represent(row, plan):
+    ret = {}
+    for name, key, convert, nested in plan:
+        if nested is not None:
+            ret[name] = _represent(row, nested)
+            continue
+        value = row[key]
+        if value is not None and convert is not None:
+            value = convert(value)
+        ret[name] = value
+    return ret
+
+
+class PingReadSerializer:
+    """
+    Read-only replacement for PingSerializer output that works on
+    ``.values()`` rows. The field plan is derived from PingSerializer once,
+    so the output is identical without building a serializer per instance.
+    """
+
+    serializer_class = PingSerializer
+
+    def __init__(self, instance=None, many=False, **kwargs):
+        self.instance = instance
+        self.many = many
+
+    @classmethod
+    @cache
+    def get_plan(cls):
+        return _read_plan(cls.serializer_class())
+
+    @classmethod
+    def values(cls, queryset):
+        return queryset.annotate(**TRAIL_ANNOTATIONS).values(
+            *_value_keys(cls.get_plan())
+        )
+
+    @classmethod
+    def rows(cls, instances):
+        """
+        Builds ``.values()`` rows from instances already in memory, such as
+        freshly created ones, without querying them back.
+        """
+        model = cls.serializer_class.Meta.model
+        getters = [
+            (key, _attribute_getter(model, key))
+            for key in _value_keys(cls.get_plan())
+        ]
+        return [{key: get(instance) for key, get in getters} for instance in instances]
+
+    @property
+    def data(self):
+        plan = self.get_plan()
+        with serializing():
+            if self.many:
+                return [_represent(row, plan) for row in self.instance]
+            return _represent(self.instance, plan)
+
+    def iter_data(self):
+        """Yields the representation of each row without building a list."""
+        plan = self.get_plan()
+        for row in self.instance:
+            yield _represent(row, plan)
+
+
+DEFAULT_STATS_BUCKETS = 60
+MAX_STATS_BUCKETS = 1440
+
+
+class PingStatsQuerySerializer(serializers.Serializer):
+    """
+    Query parameters of /pings/stats/. ``since`` and ``until`` are widened
+    to whole buckets; ``until`` is exclusive and defaults to the end of the
+    current bucket.
+    """
+
+    interval = serializers.ChoiceField(choices=list(INTERVALS), default="hour")
+    since = serializers.DateTimeField(required=False)
+    until = serializers.DateTimeField(required=False)
+    user = serializers.PrimaryKeyRelatedField(
+        queryset=User.objects.all(), required=False
+    )
+
+    def validate(self, attrs):
+        interval = attrs["interval"]
+        step = INTERVALS[interval]
+        until = attrs.get("until") or timezone.now()
+        end = floor_time(until, interval)
+        if end != until:
+            end += step
+        if "since" in attrs:
+            start = floor_time(attrs["since"], interval)
+        else:
+            start = end - DEFAULT_STATS_BUCKETS * step
+        if start >= end:
+            raise serializers.ValidationError({"since": ["Must be before until."]})
+        if (end - start) / step > MAX_STATS_BUCKETS:
+            raise serializers.ValidationError(
+                {"since": [f"At most {MAX_STATS_BUCKETS} buckets can be requested."]}
+            )
+        attrs["since"], attrs["until"] = start, end
+        return attrs
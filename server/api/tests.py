@@ -1,11 +1,70 @@
+import asyncio
+import io
+import json
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from datetime import timezone as dt_timezone
+from pathlib import Path
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError, transaction
-from django.test import TestCase
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Count
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from rest_framework import status
-from rest_framework.test import APITestCase
+from django.utils import timezone
+from rest_framework import permissions, serializers, status
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework.throttling import BaseThrottle
+from rest_framework_simplejwt.token_blacklist.models import OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
 
-from .models import Ping, User
+from . import (
+    async_views,
+    authentication,
+    geo,
+    hashing,
+    index_audit,
+    metrics,
+    partitions,
+    retention,
+    seeding,
+)
+from .authentication import StreamTicket, UserClaimsRefreshToken
+from .blacklist import CacheBlacklist, DatabaseBlacklist
+from .broker import InProcessBroker, get_broker
+from .caches import UserCache, latest_pings_cache, user_cache
+from .filters import GeoFilterBackend, PointInBox
+from .hashing import HashingPool, PasswordHashingBusy
+from .loadtest import Connection, LoadTestError, compare, load_scenario
+from .middleware import PerformanceMiddleware
+from .models import Ping, PingRollup, RevokedToken, User
+from .rollups import rollup_pings
+from .pagination import KeysetPagination
+from .permissions import IsOwnerOrReadOnly
+from .renderers import NDJSONRenderer
+from .serializers import (
+    PingBulkItemSerializer,
+    PingReadSerializer,
+    PingSerializer,
+    UserSerializer,
+)
+from .throttling import CacheBucketStore, LocalBucketStore, get_store
+from .views import PingViewSet
 
 VALID_USER_DATA = {
     "email": "test@example.com",
@@ -110,6 +169,41 @@ class PingModelTests(TestCase):
         )
         self.assertIsNone(ping.parent_ping)
 
+    def test_ping_trail_position_is_materialized(self):
+        root = Ping.objects.create(user=self.user, latitude=10.0, longitude=20.0)
+        child = Ping.objects.create(
+            user=self.user, latitude=11.0, longitude=21.0, parent_ping=root
+        )
+        grandchild = Ping.objects.create(
+            user=self.user, latitude=12.0, longitude=22.0, parent_ping=child
+        )
+        root.refresh_from_db()
+        self.assertEqual((root.root_ping_id, root.trail_root_id), (None, root.id))
+        self.assertEqual(root.depth, 0)
+        self.assertEqual(child.root_ping_id, root.id)
+        self.assertEqual(child.depth, 1)
+        self.assertEqual(grandchild.root_ping_id, root.id)
+        self.assertEqual(grandchild.depth, 2)
+
+    def test_creating_root_is_one_query(self):
+        with self.assertNumQueries(1):
+            Ping.objects.create(user=self.user, latitude=10.0, longitude=20.0)
+
+    def test_rebuild_trails_reroots_subtree(self):
+        root = Ping.objects.create(user=self.user, latitude=10.0, longitude=20.0)
+        child = Ping.objects.create(
+            user=self.user, latitude=11.0, longitude=21.0, parent_ping=root
+        )
+        grandchild = Ping.objects.create(
+            user=self.user, latitude=12.0, longitude=22.0, parent_ping=child
+        )
+        root.delete()
+        Ping.objects.rebuild_trails([child.id])
+        child.refresh_from_db()
+        grandchild.refresh_from_db()
+        self.assertEqual((child.trail_root_id, child.depth), (child.id, 0))
+        self.assertEqual((grandchild.trail_root_id, grandchild.depth), (child.id, 1))
+
     def test_str_representation(self):
         ping = Ping.objects.create(user=self.user, latitude=10.0, longitude=20.0)
         self.assertIn(self.user.email, str(ping))
@@ -117,6 +211,7 @@ class PingModelTests(TestCase):
 
 class AuthTests(APITestCase):
     def setUp(self):
+        get_store().clear()
         self.user_email = "test@example.com"
         self.user_password = "$trongPass123!"
         self.user = User.objects.create_user(
@@ -166,8 +261,356 @@ class AuthTests(APITestCase):
         self.assertNotIn("refresh_token", logout_response.cookies)
 
 
+class UserClaimsTests(APITestCase):
+    def setUp(self):
+        get_store().clear()
+        self.user = User.objects.create_user(**VALID_USER_DATA)
+
+    def login(self):
+        response = self.client.post(
+            reverse("token_obtain_pair"),
+            {
+                "code_name": VALID_USER_DATA["code_name"],
+                "password": VALID_USER_DATA["password"],
+            },
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_login_embeds_user_claims(self):
+        response = self.login()
+        expected = UserSerializer(self.user).data
+        self.assertEqual(response.data["user"], expected)
+        token = AccessToken(response.data["access"])
+        for claim in ("email", "name", "code_name"):
+            self.assertEqual(token[claim], expected[claim])
+        self.assertEqual(
+            token[authentication.VERSION_CLAIM], self.user.updated_at.isoformat()
+        )
+
+    def test_authenticates_without_queries(self):
+        access = self.login().data["access"]
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                "/api/v1/auth/current_user/", HTTP_AUTHORIZATION=f"Bearer {access}"
+            )
+        self.assertEqual(response.data, UserSerializer(self.user).data)
+
+    def test_other_fields_load_together(self):
+        token = AccessToken(self.login().data["access"])
+        user = authentication.user_from_claims(token)
+        self.assertEqual(user, self.user)
+        with self.assertNumQueries(1):
+            self.assertFalse(user.is_staff)
+            self.assertTrue(user.is_active)
+            self.assertTrue(user.check_password(VALID_USER_DATA["password"]))
+
+    def test_claims_user_owns_pings(self):
+        access = self.login().data["access"]
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {access}")
+        response = self.client.post(
+            reverse("ping-list"),
+            {"latitude": 1.0, "longitude": 2.0, "user_id": self.user.id},
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.patch(
+            reverse("ping-detail", kwargs={"pk": response.data["id"]}),
+            {"latitude": 3.0},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_refresh_reloads_claims(self):
+        self.login()
+        refresh = self.client.cookies["refresh_token"].value
+        self.user.name = "Renamed Agent"
+        self.user.save()
+        response = self.client.post(
+            reverse("token_refresh"), {"refresh": refresh}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["user"]["name"], "Renamed Agent")
+        token = AccessToken(response.data["access"])
+        self.assertEqual(token["name"], "Renamed Agent")
+        self.assertEqual(
+            token[authentication.VERSION_CLAIM], self.user.updated_at.isoformat()
+        )
+
+    def test_refresh_loads_the_user_once(self):
+        self.login()
+        refresh = self.client.cookies["refresh_token"].value
+        self.client.cookies.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                reverse("token_refresh"), {"refresh": refresh}, format="json"
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        user_table = User._meta.db_table
+        self.assertEqual(
+            sum(f'FROM "{user_table}"' in query["sql"] for query in queries), 1
+        )
+
+    def test_refresh_refuses_inactive_users(self):
+        self.login()
+        refresh = self.client.cookies["refresh_token"].value
+        self.client.cookies.clear()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        response = self.client.post(
+            reverse("token_refresh"), {"refresh": refresh}, format="json"
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_newer_cached_user_takes_precedence(self):
+        access = self.login().data["access"]
+        self.user.name = "Renamed Agent"
+        self.user.save()
+        # Stale claims are used until the user is cached.
+        token = AccessToken(access)
+        self.assertEqual(authentication.user_from_claims(token).name, "Test User")
+        user_cache.get(self.user.pk)
+        with self.assertNumQueries(0):
+            user = authentication.user_from_claims(token)
+            self.assertEqual(user.name, "Renamed Agent")
+            self.assertEqual(user.get_deferred_fields(), set())
+
+        self.user.is_active = False
+        self.user.save()
+        user_cache.get(self.user.pk)
+        response = self.client.get(
+            "/api/v1/auth/current_user/", HTTP_AUTHORIZATION=f"Bearer {access}"
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.data["error"]["message"], "User is inactive")
+
+    def test_tokens_without_claims_load_the_user(self):
+        token = AccessToken.for_user(self.user)
+        self.assertIsNone(authentication.user_from_claims(token))
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                "/api/v1/auth/current_user/", HTTP_AUTHORIZATION=f"Bearer {token}"
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class TokenBlacklistTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(**VALID_USER_DATA)
+        self.refresh = str(UserClaimsRefreshToken.for_user(self.user))
+
+    def post(self, name, token):
+        # The views prefer the refresh_token cookie to the body.
+        self.client.cookies.clear()
+        return self.client.post(reverse(name), {"refresh": token}, format="json")
+
+    def test_refresh_rotates_once(self):
+        response = self.post("token_refresh", self.refresh)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rotated = response.cookies["refresh_token"].value
+        response = self.post("token_refresh", self.refresh)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.data["error"]["code"], "token_not_valid")
+        self.assertEqual(self.post("token_refresh", rotated).status_code, 200)
+        self.assertEqual(RevokedToken.objects.count(), 2)
+        self.assertFalse(OutstandingToken.objects.exists())
+
+    def test_logout_revokes(self):
+        response = self.post("token_blacklist", self.refresh)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response = self.post("token_refresh", self.refresh)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_revoke_is_atomic(self):
+        expires_at = timezone.now() + timedelta(hours=1)
+        for blacklist in (DatabaseBlacklist(), CacheBlacklist()):
+            self.assertFalse(blacklist.is_revoked("jti"))
+            self.assertTrue(blacklist.revoke("jti", expires_at))
+            self.assertFalse(blacklist.revoke("jti", expires_at))
+            self.assertTrue(blacklist.is_revoked("jti"))
+        cache.clear()
+
+    def test_prune_tokens(self):
+        now = timezone.now()
+        RevokedToken.objects.bulk_create(
+            RevokedToken(jti=str(i), expires_at=now + timedelta(minutes=i * 60 - 210))
+            for i in range(6)
+        )
+        OutstandingToken.objects.create(
+            jti="legacy", token="", expires_at=now - timedelta(hours=1)
+        )
+        out = io.StringIO()
+        call_command("prune_tokens", batch_size=2, stdout=out)
+        self.assertIn("Pruned 4 revoked and 1 outstanding tokens.", out.getvalue())
+        self.assertEqual(
+            set(RevokedToken.objects.values_list("jti", flat=True)), {"4", "5"}
+        )
+
+
+class UserCacheTests(APITestCase):
+    def setUp(self):
+        user_cache.clear()
+        user_cache.reset_stats()
+        self.user = User.objects.create_user(**VALID_USER_DATA)
+
+    def test_hits_misses_and_copies(self):
+        with self.assertNumQueries(1):
+            first = user_cache.get(self.user.pk)
+            second = user_cache.get(self.user.pk)
+        self.assertEqual(first, self.user)
+        self.assertIsNot(first, second)
+        stats = user_cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"]), (1, 1))
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+    def test_expiry_eviction_and_disabling(self):
+        other = User.objects.create_user(**VALID_USER_DATA_2)
+        cache = UserCache(size=1, timeout=60)
+        cache.get(self.user.pk)
+        cache.get(other.pk)
+        self.assertEqual(cache.stats()["evictions"], 1)
+        with self.assertNumQueries(1):
+            cache.get(self.user.pk)
+        for cache in (UserCache(timeout=0), UserCache(enabled=False)):
+            with self.assertNumQueries(2):
+                cache.get(self.user.pk)
+                cache.get(self.user.pk)
+
+    def test_invalidated_on_save_and_delete(self):
+        user_cache.get(self.user.pk)
+        self.user.name = "Renamed Agent"
+        self.user.save()
+        self.assertEqual(user_cache.get(self.user.pk).name, "Renamed Agent")
+        self.user.delete()
+        with self.assertRaises(User.DoesNotExist):
+            user_cache.get(self.user.pk)
+
+    def test_stats_are_exported_as_metrics(self):
+        user_cache.get(self.user.pk)
+        user_cache.get(self.user.pk)
+        body = metrics.registry.render()
+        self.assertIn(
+            "# TYPE user_cache_hits_total counter\nuser_cache_hits_total 1\n", body
+        )
+        self.assertIn("user_cache_misses_total 1\n", body)
+        self.assertIn("# TYPE user_cache_size gauge\nuser_cache_size 1\n", body)
+
+    def test_ping_user_id_field(self):
+        field = PingSerializer().fields["user_id"]
+        user_cache.get(self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(field.to_internal_value(str(self.user.pk)), self.user)
+        with self.assertRaisesMessage(serializers.ValidationError, "does not exist"):
+            field.to_internal_value(self.user.pk + 1000)
+        with self.assertRaisesMessage(serializers.ValidationError, "Incorrect type"):
+            field.to_internal_value("agent")
+
+    def test_tokens_without_claims_use_the_cache(self):
+        authorization = f"Bearer {AccessToken.for_user(self.user)}"
+        self.client.get("/api/v1/auth/current_user/", HTTP_AUTHORIZATION=authorization)
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                "/api/v1/auth/current_user/", HTTP_AUTHORIZATION=authorization
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(
+            "/api/v1/auth/current_user/", HTTP_AUTHORIZATION=authorization
+        )
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_owner_permission_compares_ids(self):
+        ping = Ping.objects.create(user=self.user, latitude=1.0, longitude=2.0)
+        ping = Ping.objects.get(pk=ping.pk)
+        request = APIRequestFactory().patch("/")
+        request.user = self.user
+        with self.assertNumQueries(0):
+            self.assertTrue(
+                IsOwnerOrReadOnly().has_object_permission(request, None, ping)
+            )
+
+
+class PasswordHashingTests(APITestCase):
+    def setUp(self):
+        get_store().clear()
+
+    def login(self, password=VALID_USER_DATA["password"]):
+        return self.client.post(
+            reverse("token_obtain_pair"),
+            {"code_name": VALID_USER_DATA["code_name"], "password": password},
+        )
+
+    def test_registration_hashes_once(self):
+        with mock.patch.object(
+            hashers, "make_password", wraps=hashers.make_password
+        ) as make_password:
+            response = self.client.post(reverse("register"), VALID_USER_DATA)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(make_password.call_count, 1)
+
+    def test_registration_validates_against_details(self):
+        data = {
+            **VALID_USER_DATA,
+            "email": "smith@example.com",
+            "password": "smith1234",
+        }
+        response = self.client.post(reverse("register"), data)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn(
+            "too similar to the email",
+            " ".join(response.data["error"]["details"]["password"]),
+        )
+
+    @override_settings(
+        PASSWORD_HASHERS=[
+            "api.hashing.PBKDF2PasswordHasher",
+            "django.contrib.auth.hashers.MD5PasswordHasher",
+        ],
+        PASSWORD_PBKDF2_ITERATIONS=1000,
+    )
+    def test_login_rehashes(self):
+        with self.settings(
+            PASSWORD_HASHERS=["django.contrib.auth.hashers.MD5PasswordHasher"]
+        ):
+            user = User.objects.create_user(**VALID_USER_DATA)
+        self.assertTrue(user.password.startswith("md5$"))
+        self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith("pbkdf2_sha256$1000$"))
+        with self.settings(PASSWORD_PBKDF2_ITERATIONS=2000):
+            self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith("pbkdf2_sha256$2000$"))
+        self.assertEqual(self.login("WrongPass123!").status_code, 401)
+
+    def test_pool_is_bounded(self):
+        pool = HashingPool(workers=1, queue_size=0, timeout=0.01)
+        started, release = threading.Event(), threading.Event()
+
+        def hold():
+            started.set()
+            release.wait()
+
+        holder = threading.Thread(target=pool.run, args=(hold,))
+        holder.start()
+        started.wait()
+        with self.assertRaises(PasswordHashingBusy):
+            pool.run(hashers.make_password, "password")
+        release.set()
+        holder.join()
+        self.assertTrue(pool.run(hashers.make_password, "password"))
+
+    def test_busy_pool_answers_503(self):
+        User.objects.create_user(**VALID_USER_DATA)
+        with mock.patch.object(
+            hashing.HashingPool, "run", side_effect=PasswordHashingBusy
+        ):
+            response = self.login()
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response.data["error"]["code"], "password_hashing_busy")
+
+
 class RegistrationTests(APITestCase):
     def setUp(self):
+        get_store().clear()
         self.register_url = reverse("register")
         self.valid_data = VALID_USER_DATA.copy()
 
@@ -227,9 +670,120 @@ class RegistrationTests(APITestCase):
             " ".join(response.data["error"]["details"]["password"]),
         )
 
+THROTTLE_RATES = {
+    "login": "4/min",
+    "login_account": "2/min",
+    "register": "3/min",
+    "register_account": "1/min",
+}
+
+
+@override_settings(
+    REST_FRAMEWORK={**settings.REST_FRAMEWORK, "DEFAULT_THROTTLE_RATES": THROTTLE_RATES}
+)
+class ThrottlingTests(APITestCase):
+    def setUp(self):
+        get_store().clear()
+        self.login_url = reverse("token_obtain_pair")
+        self.register_url = reverse("register")
+        User.objects.create_user(**VALID_USER_DATA)
+
+    def login(self, code_name=VALID_USER_DATA["code_name"], **extra):
+        return self.client.post(
+            self.login_url, {"code_name": code_name, "password": "x"}, **extra
+        )
+
+    def test_login_throttled_by_account(self):
+        self.assertEqual(self.login().status_code, 401)
+        self.assertEqual(self.login(REMOTE_ADDR="10.0.0.2").status_code, 401)
+        response = self.login(REMOTE_ADDR="10.0.0.3")
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(response.data["error"]["code"], "throttled")
+        self.assertGreater(int(response["Retry-After"]), 0)
+        # Case and whitespace don't make a new account.
+        code_name = f" {VALID_USER_DATA['code_name'].upper()} "
+        self.assertEqual(self.login(code_name).status_code, 429)
+        self.assertEqual(self.login("someoneelse").status_code, 401)
+
+    def test_login_throttled_by_ip(self):
+        for i in range(4):
+            self.assertEqual(self.login(f"user{i}").status_code, 401)
+        self.assertEqual(self.login("user4").status_code, 429)
+        self.assertEqual(self.login("user4", REMOTE_ADDR="10.0.0.2").status_code, 401)
+
+    def test_forwarded_for_is_only_trusted_behind_proxies(self):
+        for i in range(4):
+            spoofed = f"192.0.2.{i}"
+            response = self.login(f"user{i}", HTTP_X_FORWARDED_FOR=spoofed)
+            self.assertEqual(response.status_code, 401)
+        response = self.login("user4", HTTP_X_FORWARDED_FOR="192.0.2.4")
+        self.assertEqual(response.status_code, 429)
+
+        rest_framework = {**settings.REST_FRAMEWORK, "NUM_PROXIES": 1}
+        with override_settings(REST_FRAMEWORK=rest_framework):
+            # The address the proxy appended, not the one the client sent.
+            response = self.login(
+                "user4", HTTP_X_FORWARDED_FOR="127.0.0.1, 192.0.2.4"
+            )
+            self.assertEqual(response.status_code, 401)
+
+    def test_throttled_login_skips_database_and_hashing(self):
+        self.login()
+        self.login()
+        with (
+            mock.patch.object(hashers, "verify_password") as verify_password,
+            self.assertNumQueries(0),
+        ):
+            response = self.login()
+        self.assertEqual(response.status_code, 429)
+        verify_password.assert_not_called()
+
+    def test_register_throttled(self):
+        data = {**VALID_USER_DATA, "email": "new@example.com", "code_name": "new"}
+        self.assertEqual(self.client.post(self.register_url, data).status_code, 201)
+        with mock.patch.object(hashers, "make_password") as make_password:
+            response = self.client.post(
+                self.register_url, {**data, "code_name": "other"}
+            )
+        self.assertEqual(response.status_code, 429)
+        make_password.assert_not_called()
+        for i in range(2):
+            data = {**data, "email": f"new{i}@example.com", "code_name": f"new{i}"}
+            self.client.post(self.register_url, data)
+        data = {**data, "email": "last@example.com", "code_name": "last"}
+        self.assertEqual(self.client.post(self.register_url, data).status_code, 429)
+
+    @override_settings(THROTTLE_LOGINS=False)
+    def test_throttling_can_be_disabled(self):
+        for _ in range(5):
+            self.assertEqual(self.login().status_code, 401)
+
+    def test_local_bucket_refills(self):
+        store = LocalBucketStore(max_keys=2)
+        self.assertEqual(store.hit("a", 2, 60, now=0), 0)
+        self.assertEqual(store.hit("a", 2, 60, now=0), 0)
+        self.assertEqual(store.hit("a", 2, 60, now=0), 30)
+        self.assertEqual(store.hit("a", 2, 60, now=15), 15)
+        self.assertEqual(store.hit("a", 2, 60, now=60), 0)
+        store.hit("b", 2, 60, now=60)
+        store.hit("c", 2, 60, now=60)
+        self.assertEqual(list(store.buckets), ["b", "c"])
+
+    def test_cache_sliding_window(self):
+        store = CacheBucketStore()
+        store.cache.clear()
+        for _ in range(2):
+            self.assertEqual(store.hit("a", 2, 60, now=600), 0)
+        self.assertEqual(store.hit("a", 2, 60, now=630), 30)
+        # Half of the previous window's 3 attempts still count.
+        self.assertEqual(store.hit("a", 2, 60, now=690), 30)
+        self.assertEqual(store.hit("a", 2, 60, now=720), 0)
+        self.assertEqual(store.hit("b", 2, 60, now=720), 0)
+
 
 class PingAPITests(APITestCase):
     def setUp(self):
+        cache.clear()
         self.user = User.objects.create_user(**VALID_USER_DATA)
         self.other_user = User.objects.create_user(**VALID_USER_DATA_2)
         self.ping = Ping.objects.create(user=self.user, latitude=10.0, longitude=20.0)
@@ -326,6 +880,38 @@ class PingAPITests(APITestCase):
         self.assertEqual(response.data["parent_ping"], parent_ping.id)
         self.assertEqual(response.data["user"], self.user.id)
 
+    def test_respond_extends_parent_trail(self):
+        self.client.force_authenticate(user=self.user)
+        url = reverse("ping-respond", kwargs={"pk": self.ping.id})
+        response = self.client.post(url, {"latitude": 1.0, "longitude": 2.0})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        child = Ping.objects.get(id=response.data["ping"]["id"])
+        self.assertEqual(child.trail_root_id, self.ping.id)
+        self.assertEqual(child.depth, 1)
+
+    def test_deleting_ping_reroots_its_responses(self):
+        self.client.force_authenticate(user=self.user)
+        child = Ping.objects.create(
+            user=self.other_user, latitude=1.0, longitude=1.0, parent_ping=self.ping
+        )
+        response = self.client.delete(self.ping_detail_url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        child.refresh_from_db()
+        self.assertEqual((child.trail_root_id, child.depth), (child.id, 0))
+
+    def test_ping_list_filter_by_root_ping(self):
+        self.client.force_authenticate(user=self.user)
+        child = Ping.objects.create(
+            user=self.other_user, latitude=1.0, longitude=1.0, parent_ping=self.ping
+        )
+        Ping.objects.create(user=self.user, latitude=2.0, longitude=2.0)
+        response = self.client.get(self.ping_list_url, {"root_ping": self.ping.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {ping["id"]: ping["root_ping"] for ping in response.data["results"]},
+            {self.ping.id: self.ping.id, child.id: self.ping.id},
+        )
+
     def test_unauthenticated_user_cannot_respond_to_ping(self):
         parent_ping = Ping.objects.create(user=self.user, latitude=50.0, longitude=60.0)
         url = reverse("ping-respond", args=[parent_ping.id])
@@ -344,3 +930,1528 @@ class PingAPITests(APITestCase):
         self.assertEqual(response.status_code, 200)
         for ping in response.data["results"]:
             self.assertEqual(ping["user"], self.user.id)
+
+
+class PingTrailAPITests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(**VALID_USER_DATA)
+        self.other_user = User.objects.create_user(**VALID_USER_DATA_2)
+        self.root = Ping.objects.create(user=self.user, latitude=1.0, longitude=1.0)
+        self.middle = Ping.objects.create(
+            user=self.other_user, latitude=2.0, longitude=2.0, parent_ping=self.root
+        )
+        self.leaf = Ping.objects.create(
+            user=self.user, latitude=3.0, longitude=3.0, parent_ping=self.middle
+        )
+        self.unrelated = Ping.objects.create(
+            user=self.user, latitude=4.0, longitude=4.0
+        )
+
+    def test_trail_returns_ancestors_and_descendants(self):
+        self.client.force_authenticate(user=self.user)
+        url = reverse("ping-trail", kwargs={"pk": self.middle.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["root_ping"], self.root.id)
+        self.assertEqual(
+            [(p["id"], p["depth"]) for p in response.data["pings"]],
+            [(self.root.id, 0), (self.middle.id, 1), (self.leaf.id, 2)],
+        )
+        for ping in response.data["pings"]:
+            self.assertEqual(ping["root_ping"], self.root.id)
+
+    def test_trail_of_standalone_ping(self):
+        self.client.force_authenticate(user=self.user)
+        url = reverse("ping-trail", kwargs={"pk": self.unrelated.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["root_ping"], self.unrelated.id)
+        self.assertEqual(len(response.data["pings"]), 1)
+
+    def test_trail_query_count_does_not_grow_with_depth(self):
+        self.client.force_authenticate(user=self.user)
+        parent = self.leaf
+        for i in range(10):
+            parent = Ping.objects.create(
+                user=self.user, latitude=i, longitude=i, parent_ping=parent
+            )
+        url = reverse("ping-trail", kwargs={"pk": self.root.pk})
+        # get_object, validators, recursive trail query, user prefetch
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data["pings"]), 13)
+        self.assertEqual(response.data["pings"][-1]["depth"], 12)
+
+    def test_unauthenticated_user_cannot_get_trail(self):
+        url = reverse("ping-trail", kwargs={"pk": self.root.pk})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 401)
+
+
+@mock.patch.object(KeysetPagination, "page_size", 3)
+class PingPaginationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(**VALID_USER_DATA)
+        self.pings = [
+            Ping.objects.create(user=self.user, latitude=i, longitude=i)
+            for i in range(7)
+        ]
+        self.ping_list_url = reverse("ping-list")
+        self.client.force_authenticate(user=self.user)
+
+    def collect_pages(self, url, params=None, link="next"):
+        ids = []
+        response = self.client.get(url, params)
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids.extend(p["id"] for p in response.data["results"])
+            if not response.data[link]:
+                return ids, response
+            response = self.client.get(response.data[link])
+
+    def test_list_walks_all_pings_newest_first(self):
+        ids, last = self.collect_pages(self.ping_list_url)
+        self.assertEqual(ids, [p.id for p in reversed(self.pings)])
+        self.assertEqual(self.client.get(self.ping_list_url).data["count"], 7)
+
+    def test_cursor_pages_are_not_counted(self):
+        first = self.client.get(self.ping_list_url)
+        # Only the page itself, without an aggregate over the listing.
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(first.data["next"])
+        self.assertEqual(list(second.data), ["next", "previous", "results"])
+        ping_table = Ping._meta.db_table
+        self.assertEqual(
+            sum(f'FROM "{ping_table}"' in query["sql"] for query in queries), 1
+        )
+        self.assertFalse(any("COUNT(" in query["sql"] for query in queries))
+
+    def test_cursor_pages_are_validated_by_their_rows(self):
+        first = self.client.get(self.ping_list_url)
+        second = self.client.get(first.data["next"])
+        etag = second["ETag"]
+        repeat = self.client.get(first.data["next"], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(repeat.status_code, status.HTTP_304_NOT_MODIFIED)
+        # Deleted without going through the API, e.g. with their user.
+        Ping.objects.filter(pk=second.data["results"][0]["id"]).delete()
+        repeat = self.client.get(first.data["next"], HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(repeat.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(repeat.data["results"]), 3)
+
+    def test_count_is_of_filtered_pings(self):
+        other_user = User.objects.create_user(**VALID_USER_DATA_2)
+        Ping.objects.create(user=other_user, latitude=1, longitude=1)
+        response = self.client.get(self.ping_list_url, {"user": other_user.id})
+        self.assertEqual(response.data["count"], 1)
+        response = self.client.get(self.ping_list_url)
+        self.assertEqual(list(response.data), ["count", "next", "previous", "results"])
+        self.assertEqual(response.data["count"], 8)
+
+    def test_pages_do_not_shift_when_pings_are_created(self):
+        first = self.client.get(self.ping_list_url)
+        Ping.objects.create(user=self.user, latitude=50, longitude=50)
+        second = self.client.get(first.data["next"])
+        self.assertEqual(
+            [p["id"] for p in second.data["results"]],
+            [p.id for p in reversed(self.pings[1:4])],
+        )
+
+    def test_previous_link_returns_to_earlier_page(self):
+        first = self.client.get(self.ping_list_url)
+        second = self.client.get(first.data["next"])
+        previous = self.client.get(second.data["previous"])
+        self.assertEqual(previous.data["results"], first.data["results"])
+
+    def test_ascending_ordering_with_filter(self):
+        other_user = User.objects.create_user(**VALID_USER_DATA_2)
+        Ping.objects.create(user=other_user, latitude=1, longitude=1)
+        ids, _ = self.collect_pages(
+            self.ping_list_url, {"ordering": "timestamp", "user": self.user.id}
+        )
+        self.assertEqual(ids, [p.id for p in self.pings])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.ping_list_url, {"cursor": "garbage"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_page_param_falls_back_to_page_numbers(self):
+        with mock.patch.object(PageNumberPagination, "page_size", 3):
+            response = self.client.get(self.ping_list_url, {"page": 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["count"], 7)
+        self.assertEqual(len(response.data["results"]), 3)
+
+
+class PingQueryCountTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(**VALID_USER_DATA)
+        self.other_user = User.objects.create_user(**VALID_USER_DATA_2)
+        self.ping = Ping.objects.create(user=self.user, latitude=1.0, longitude=1.0)
+        self.client.force_authenticate(user=self.user)
+
+    def create_pings(self, count):
+        for i in range(count):
+            Ping.objects.create(
+                user=self.user if i % 2 else self.other_user, latitude=i, longitude=i
+            )
+
+    def count_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context)
+
+    def test_list_query_count_is_constant(self):
+        url = reverse("ping-list")
+        filters = {"user": self.user.id}
+        self.create_pings(2)
+        small = self.count_queries(url)
+        small_filtered = self.count_queries(url, filters)
+        self.create_pings(30)
+        self.assertEqual(self.count_queries(url), small)
+        self.assertEqual(self.count_queries(url, filters), small_filtered)
+        # validators aggregate and the page itself
+        self.assertEqual(small, 2)
+
+    def test_latest_query_count_is_constant(self):
+        self.create_pings(5)
+        with self.assertNumQueries(1):
+            self.client.get(reverse("ping-latest"))
+        with self.assertNumQueries(0):
+            self.client.get(reverse("ping-latest"))
+
+    def test_retrieve_query_count(self):
+        with self.assertNumQueries(1):
+            self.client.get(reverse("ping-detail", kwargs={"pk": self.ping.pk}))
+
+    def test_respond_does_not_reload_users_for_output(self):
+        url = reverse("ping-respond", kwargs={"pk": self.ping.pk})
+        # parent lookup, user_id and parent_ping validation, insert
+        with self.assertNumQueries(4):
+            response = self.client.post(url, {"latitude": 1.0, "longitude": 2.0})
+        self.assertEqual(response.data["ping"]["user"]["id"], self.user.id)
+
+    def test_user_columns_are_restricted_to_serialized_fields(self):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse("ping-latest"))
+        self.assertNotIn("password", context.captured_queries[0]["sql"])
+
+
+class PingReadSerializerTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(**VALID_USER_DATA)
+        root = Ping.objects.create(user=self.user, latitude=51.5074, longitude=-0.1278)
+        Ping.objects.create(
+            user=self.user, latitude=-33.8688, longitude=151, parent_ping=root
+        )
+        self.client.force_authenticate(user=self.user)
+
+    def test_output_matches_ping_serializer(self):
+        pings = Ping.objects.select_related("user").order_by("id")
+        expected = JSONRenderer().render(PingSerializer(pings, many=True).data)
+        rows = PingReadSerializer.values(pings)
+        actual = JSONRenderer().render(PingReadSerializer(rows, many=True).data)
+        self.assertEqual(actual, expected)
+
+    def test_rows_from_instances_match_values(self):
+        pings = Ping.objects.select_related("user").order_by("id")
+        self.assertEqual(
+            PingReadSerializer.rows(pings), list(PingReadSerializer.values(pings))
+        )
+
+    def test_fast_and_model_serializer_responses_are_identical(self):
+        for name in ("ping-list", "ping-latest"):
+            fast = self.client.get(reverse(name))
+            with mock.patch.object(PingViewSet, "fast_read_actions", ()):
+                cache.clear()
+                slow = self.client.get(reverse(name))
+            self.assertEqual(fast.status_code, status.HTTP_200_OK)
+            self.assertEqual(fast.content, slow.content)
+
+
+class LatestPingsCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(**VALID_USER_DATA)
+        self.ping = Ping.objects.create(user=self.user, latitude=1.0, longitude=1.0)
+        self.latest_url = reverse("ping-latest")
+        self.client.force_authenticate(user=self.user)
+
+    def test_second_request_is_served_from_cache(self):
+        first = self.client.get(self.latest_url)
+        second = self.client.get(self.latest_url)
+        self.assertEqual(first["X-Cache"], "MISS")
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(latest_pings_cache.stats()["hits"], 1)
+        self.assertEqual(latest_pings_cache.stats()["misses"], 1)
+
+    def test_create_invalidates_cache(self):
+        self.client.get(self.latest_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("ping-list"),
+                {"latitude": 5.0, "longitude": 5.0, "user_id": self.user.id},
+            )
+        response = self.client.get(self.latest_url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data[0]["latitude"], 5.0)
+
+    def test_respond_invalidates_cache(self):
+        self.client.get(self.latest_url)
+        url = reverse("ping-respond", kwargs={"pk": self.ping.pk})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(url, {"latitude": 6.0, "longitude": 6.0})
+        response = self.client.get(self.latest_url)
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.data[0]["parent_ping"], self.ping.id)
+
+    def test_stats_require_admin(self):
+        response = self.client.get(reverse("ping-latest-stats"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse("ping-latest-stats"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("hit_ratio", response.data)
+
+
+class PingConditionalGetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(**VALID_USER_DATA)
+        self.ping = Ping.objects.create(user=self.user, latitude=1.0, longitude=1.0)
+        self.client.force_authenticate(user=self.user)
+
+    def assertNotModified(self, url, params=None):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("Last-Modified", response)
+        repeat = self.client.get(url, params, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(repeat.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(repeat.content, b"")
+        return response
+
+    def test_unchanged_endpoints_return_not_modified(self):
+        self.assertNotModified(reverse("ping-list"))
+        self.assertNotModified(reverse("ping-list"), {"user": self.user.id})
+        self.assertNotModified(reverse("ping-detail", kwargs={"pk": self.ping.pk}))
+        self.assertNotModified(reverse("ping-trail", kwargs={"pk": self.ping.pk}))
+        cache.clear()
+        self.assertNotModified(reverse("ping-latest"))
+
+    def test_not_modified_skips_serialization_queries(self):
+        url = reverse("ping-list")
+        etag = self.client.get(url)["ETag"]
+        with self.assertNumQueries(1):
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_new_ping_changes_list_etag(self):
+        url = reverse("ping-list")
+        etag = self.client.get(url)["ETag"]
+        Ping.objects.create(user=self.user, latitude=2.0, longitude=2.0)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 2)
+
+    def test_edit_changes_detail_etag(self):
+        url = reverse("ping-detail", kwargs={"pk": self.ping.pk})
+        etag = self.client.get(url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {"latitude": 3.0})
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["latitude"], 3.0)
+
+    def test_respond_changes_trail_etag(self):
+        url = reverse("ping-trail", kwargs={"pk": self.ping.pk})
+        etag = self.client.get(url)["ETag"]
+        Ping.objects.create(
+            user=self.user, latitude=2.0, longitude=2.0, parent_ping=self.ping
+        )
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["pings"]), 2)
+
+
+class PingStreamTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(**VALID_USER_DATA)
+        self.ping = Ping.objects.create(user=self.user, latitude=1.0, longitude=1.0)
+        self.stream_url = reverse("ping-stream")
+        self.access = AccessToken.for_user(self.user)
+
+    def ticket(self, access=None):
+        return str(StreamTicket.for_access_token(self.user, access or self.access))
+
+    def test_stream_requires_valid_ticket(self):
+        response = self.client.get(self.stream_url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.json()["error"]["code"], "not_authenticated")
+        response = self.client.get(self.stream_url, {"ticket": "invalid"})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertEqual(response.json()["error"]["code"], "token_not_valid")
+        # Access tokens stay out of query strings and access logs.
+        response = self.client.get(self.stream_url, {"token": str(self.access)})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get(self.stream_url, {"ticket": str(self.access)})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_ticket_endpoint(self):
+        url = reverse("ping-stream-ticket")
+        self.assertEqual(self.client.post(url).status_code, 401)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.access}")
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        ticket = StreamTicket(response.data["ticket"])
+        self.assertEqual(ticket["stream_exp"], self.access["exp"])
+        self.assertEqual(ticket["user_id"], self.user.id)
+
+    def test_stream_is_refused_under_wsgi(self):
+        response = self.client.get(
+            self.stream_url, HTTP_AUTHORIZATION=f"Bearer {self.access}"
+        )
+        self.assertEqual(response.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+        self.assertEqual(response.json()["error"]["code"], "streaming_unavailable")
+
+    async def test_stream_delivers_published_events(self):
+        ticket = self.ticket()
+        response = await self.async_client.get(self.stream_url, {"ticket": ticket})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b"retry: 3000\n\n")
+        get_broker().publish({"type": "ping", "id": 7, "data": '{"id":7}'})
+        self.assertEqual(
+            await anext(stream), b'event: ping\nid: 7\ndata: {"id":7}\n\n'
+        )
+        await stream.aclose()
+        # Tickets are single use.
+        response = await self.async_client.get(self.stream_url, {"ticket": ticket})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_stream_ends_when_access_token_expires(self):
+        expired = {"exp": int(time.time())}
+        response = await self.async_client.get(
+            self.stream_url, {"ticket": self.ticket(expired)}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        chunks = [chunk async for chunk in response.streaming_content]
+        self.assertEqual(chunks[-1], b"event: expired\ndata: {}\n\n")
+
+    @mock.patch.object(async_views, "STREAM_KEEPALIVE_INTERVAL", 0.01)
+    async def test_stream_ends_when_user_is_deactivated(self):
+        response = await self.async_client.get(
+            self.stream_url, {"ticket": self.ticket()}
+        )
+        stream = aiter(response.streaming_content)
+        await anext(stream)
+        self.assertEqual(await anext(stream), b": keepalive\n\n")
+        self.user.is_active = False
+        await self.user.asave()
+        self.assertEqual(await anext(stream), b"event: expired\ndata: {}\n\n")
+        with self.assertRaises(StopAsyncIteration):
+            await anext(stream)
+
+    def test_respond_publishes_response_event(self):
+        self.client.force_authenticate(user=self.user)
+        url = reverse("ping-respond", kwargs={"pk": self.ping.pk})
+        with mock.patch.object(InProcessBroker, "publish") as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(url, {"latitude": 2.0, "longitude": 2.0})
+        event = publish.call_args.args[0]
+        self.assertEqual(event["type"], "response")
+        self.assertEqual(json.loads(event["data"])["parent_ping"], self.ping.id)
+
+
+class PingBulkAPITests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(**VALID_USER_DATA)
+        self.existing = Ping.objects.create(
+            user=self.user, latitude=1.0, longitude=1.0
+        )
+        self.url = reverse("ping-bulk")
+        self.client.force_authenticate(user=self.user)
+
+    def post(self, pings):
+        return self.client.post(self.url, {"pings": pings}, format="json")
+
+    def test_bulk_create_builds_trails(self):
+        response = self.post(
+            [
+                {"ref": "a", "latitude": 2.0, "longitude": 2.0},
+                {"ref": "b", "latitude": 3.0, "longitude": 3.0, "parent_ref": "a"},
+                {"latitude": 4.0, "longitude": 4.0, "parent_ref": "b"},
+                {"latitude": 5.0, "longitude": 5.0, "parent_ping": self.existing.id},
+            ]
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["errors"], [])
+        ids = [item["id"] for item in response.data["created"]]
+        self.assertEqual(
+            [item["index"] for item in response.data["created"]], [0, 1, 2, 3]
+        )
+        pings = Ping.objects.in_bulk(ids)
+        root, child, grandchild, reply = (pings[pk] for pk in ids)
+        self.assertEqual((root.trail_root_id, root.depth), (root.id, 0))
+        self.assertEqual((child.parent_ping_id, child.depth), (root.id, 1))
+        self.assertEqual((grandchild.root_ping_id, grandchild.depth), (root.id, 2))
+        self.assertEqual(
+            (reply.parent_ping_id, reply.root_ping_id, reply.depth),
+            (self.existing.id, self.existing.id, 1),
+        )
+        self.assertTrue(all(ping.user_id == self.user.id for ping in pings.values()))
+
+    def test_partial_success_reports_errors_by_index(self):
+        response = self.post(
+            [
+                {"ref": "bad", "latitude": "north", "longitude": 2.0},
+                {"latitude": 3.0, "longitude": 3.0, "parent_ref": "bad"},
+                {"latitude": 4.0, "longitude": 4.0, "parent_ping": 0},
+                {"latitude": 5.0, "longitude": 5.0, "parent_ref": "later"},
+                {"ref": "later", "latitude": 6.0, "longitude": 6.0},
+                "not a ping",
+            ]
+        )
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([item["index"] for item in response.data["created"]], [4])
+        errors = {item["index"]: item["errors"] for item in response.data["errors"]}
+        self.assertEqual(set(errors), {0, 1, 2, 3, 5})
+        self.assertIn("latitude", errors[0])
+        self.assertIn("parent_ref", errors[1])
+        self.assertIn("parent_ping", errors[2])
+        self.assertIn("parent_ref", errors[3])
+        self.assertEqual(Ping.objects.count(), 2)
+
+    def test_nothing_created(self):
+        response = self.post([{"latitude": 1.0}])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["created"], [])
+        self.assertIn("longitude", response.data["errors"][0]["errors"])
+
+    def test_request_must_contain_pings(self):
+        response = self.post([])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["error"]["code"], "validation_error")
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        def batch(size):
+            return [{"ref": "root", "latitude": 1.0, "longitude": 1.0}] + [
+                {"latitude": 1.0, "longitude": 1.0, "parent_ref": "root"}
+                for _ in range(size - 1)
+            ]
+
+        with CaptureQueriesContext(connection) as small:
+            self.post(batch(5))
+        with CaptureQueriesContext(connection) as large:
+            self.post(batch(100))
+        self.assertEqual(len(small), len(large))
+
+    def test_fast_path_matches_full_validation(self):
+        serializer = PingBulkItemSerializer()
+        items = [
+            {"latitude": 1, "longitude": 2.5},
+            {"ref": "a", "latitude": 1.0, "longitude": 2.0, "parent_ping": None},
+            {"latitude": 1.0, "longitude": 2.0, "parent_ping": self.existing.id},
+            {"latitude": 1.0, "longitude": 2.0, "parent_ref": "a", "extra": 1},
+            {"latitude": "1.5", "longitude": 2.0},
+            {"ref": " a ", "latitude": 1.0, "longitude": 2.0},
+            {"latitude": True, "longitude": 2.0},
+        ]
+        for item in items:
+            cleaned = serializer.clean(item)
+            if cleaned is not None:
+                self.assertEqual(cleaned, serializer.run_validation(item))
+        self.assertEqual(
+            [serializer.clean(item) is not None for item in items],
+            [True, True, True, True, False, False, False],
+        )
+
+    def test_bulk_publishes_one_event(self):
+        with mock.patch.object(InProcessBroker, "publish") as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.post([{"latitude": 1.0, "longitude": 1.0}] * 3)
+        publish.assert_called_once()
+        event = publish.call_args.args[0]
+        self.assertEqual(event["type"], "pings")
+        self.assertEqual(len(json.loads(event["data"])), 3)
+
+
+class PingExportTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(**VALID_USER_DATA)
+        self.other = User.objects.create_user(**VALID_USER_DATA_2)
+        self.root = Ping.objects.create(user=self.user, latitude=1.0, longitude=1.0)
+        Ping.objects.create(
+            user=self.other, latitude=2.0, longitude=2.0, parent_ping=self.root
+        )
+        Ping.objects.create(user=self.user, latitude=3.0, longitude=3.0)
+        self.url = reverse("ping-export")
+        self.client.force_authenticate(user=self.user)
+
+    def export(self, params=None):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_ndjson_matches_ping_serializer(self):
+        response, content = self.export()
+        self.assertEqual(
+            response["Content-Type"], "application/x-ndjson; charset=utf-8"
+        )
+        self.assertIn('filename="pings.ndjson"', response["Content-Disposition"])
+        pings = Ping.objects.select_related("user").order_by("-timestamp")
+        self.assertEqual(
+            content.splitlines(),
+            [
+                JSONRenderer().render(data).decode()
+                for data in PingSerializer(pings, many=True).data
+            ],
+        )
+
+    def test_csv_honors_filters_and_ordering(self):
+        response, content = self.export(
+            {
+                "format": "csv",
+                "user": self.user.id,
+                "timestamp__gte": self.root.timestamp.isoformat(),
+                "ordering": "latitude",
+            }
+        )
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        header, *rows = content.splitlines()
+        self.assertIn("user.email", header.split(","))
+        latitude = header.split(",").index("latitude")
+        self.assertEqual([row.split(",")[latitude] for row in rows], ["1.0", "3.0"])
+
+    def test_export_requires_authentication(self):
+        self.client.force_authenticate(user=None)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        error = json.loads(response.content)["error"]
+        self.assertEqual(error["code"], "not_authenticated")
+
+    @mock.patch.object(NDJSONRenderer, "chunk_size", 1)
+    async def test_export_is_streamed_under_asgi(self):
+        rendered = []
+        render_record = NDJSONRenderer.render_record
+
+        def record_rendering(renderer, record):
+            rendered.append(record["id"])
+            return render_record(renderer, record)
+
+        authorization = f"Bearer {AccessToken.for_user(self.user)}"
+        with mock.patch.object(NDJSONRenderer, "render_record", record_rendering):
+            response = await self.async_client.get(
+                self.url, headers={"Authorization": authorization}
+            )
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.is_async)
+            chunks = aiter(response.streaming_content)
+            await anext(chunks)
+            # Not read to the end before the first chunk is sent.
+            self.assertEqual(len(rendered), 1)
+            rest = [chunk async for chunk in chunks]
+        self.assertEqual(len(rest), 2)
+        self.assertEqual(len(rendered), 3)
+
+    def test_memory_stays_bounded_for_large_exports(self):
+        # Materializing this many rows takes far more than the bound below.
+        rows = 10_000
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                WITH RECURSIVE n(i) AS (
+                    SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < %s
+                )
+                INSERT INTO api_ping
+                    (user_id, latitude, longitude, timestamp, depth)
+                SELECT %s, i %% 90, i %% 180, %s, 0 FROM n
+                """,
+                [rows, self.user.id, self.root.timestamp],
+            )
+        response = self.client.get(self.url)
+        lines = 0
+        tracemalloc.start()
+        try:
+            for chunk in response.streaming_content:
+                lines += chunk.count(b"\n")
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(lines, rows + 3)
+        self.assertLess(peak, 4 * 1024 * 1024)
+
+
+class GeoTests(TestCase):
+    def test_bbox_across_antimeridian_is_split(self):
+        self.assertEqual(
+            geo.bbox_boxes(170, -20, -170, -10),
+            [(-20, 170.0, -10, 180.0), (-20, -180.0, -10, -170.0)],
+        )
+        self.assertEqual(
+            geo.bbox_boxes(170, -20, 190, -10),
+            [(-20, 170.0, -10, 180.0), (-20, -180.0, -10, -170.0)],
+        )
+        self.assertEqual(geo.bbox_boxes(-10, 40, 10, 50), [(40, -10.0, 50, 10.0)])
+        self.assertEqual(
+            geo.bbox_boxes(-180, -90, 180, 90), [(-90, -180.0, 90, 180.0)]
+        )
+
+    def test_radius_around_pole_spans_all_longitudes(self):
+        (box,) = geo.radius_boxes(89.0, 20.0, 500)
+        self.assertEqual(box[1:], (-180.0, 90.0, 180.0))
+
+    def test_point_in_box_sql(self):
+        queryset = Ping.objects.filter(PointInBox((-20, 170, -10, 180)))
+        sql, params = queryset.query.sql_with_params()
+        self.assertIn(
+            '(point("api_ping"."longitude", "api_ping"."latitude") '
+            "<@ box(point(%s, %s), point(%s, %s)))",
+            sql,
+        )
+        self.assertEqual(params, (170.0, -20.0, 180.0, -10.0))
+
+
+class PingGeoFilterTests(APITestCase):
+    CITIES = {
+        "london": (51.5074, -0.1278),
+        "paris": (48.8566, 2.3522),
+        "new_york": (40.7128, -74.006),
+        "fiji_east": (-17.7, 179.5),
+        "fiji_west": (-17.7, -179.5),
+    }
+
+    def setUp(self):
+        self.user = User.objects.create_user(**VALID_USER_DATA)
+        self.pings = {
+            name: Ping.objects.create(user=self.user, latitude=lat, longitude=lon)
+            for name, (lat, lon) in self.CITIES.items()
+        }
+        self.client.force_authenticate(user=self.user)
+
+    def names(self, params):
+        response = self.client.get(reverse("ping-list"), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = {ping["id"] for ping in response.data["results"]}
+        return {name for name, ping in self.pings.items() if ping.id in ids}
+
+    def test_radius(self):
+        self.assertEqual(
+            self.names({"near": "51.5074,-0.1278", "radius_km": 500}),
+            {"london", "paris"},
+        )
+        self.assertEqual(
+            self.names({"near": "51.5074,-0.1278", "radius_km": 300}), {"london"}
+        )
+
+    def test_bbox(self):
+        self.assertEqual(self.names({"bbox": "-10,40,10,55"}), {"london", "paris"})
+
+    def test_queries_across_antimeridian(self):
+        self.assertEqual(
+            self.names({"bbox": "170,-25,-170,-10"}), {"fiji_east", "fiji_west"}
+        )
+        self.assertEqual(
+            self.names({"near": "-17.7,179.9", "radius_km": 150}),
+            {"fiji_east", "fiji_west"},
+        )
+
+    def test_invalid_parameters(self):
+        for params in (
+            {"bbox": "1,2,3"},
+            {"bbox": "0,50,10,40"},
+            {"near": "51,0"},
+            {"near": "north", "radius_km": 10},
+            {"near": "51,0", "radius_km": -1},
+        ):
+            response = self.client.get(reverse("ping-list"), params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data["error"]["code"], "validation_error")
+
+    def test_filters_match_brute_force(self):
+        rng = random.Random(1)
+        Ping.objects.bulk_create(
+            Ping(
+                user=self.user,
+                latitude=rng.uniform(-90, 90),
+                longitude=rng.uniform(-180, 180),
+            )
+            for _ in range(2000)
+        )
+        pings = list(Ping.objects.values_list("id", "latitude", "longitude"))
+        backend = GeoFilterBackend()
+
+        def filtered(params):
+            request = Request(APIRequestFactory().get("/", params))
+            queryset = backend.filter_queryset(request, Ping.objects.all(), None)
+            return set(queryset.values_list("id", flat=True))
+
+        for lat, lon, radius in ((51.5, -0.1, 2000), (-60, 175, 3000), (85, 0, 1500)):
+            expected = {
+                pk
+                for pk, p_lat, p_lon in pings
+                if geo.haversine_km(lat, lon, p_lat, p_lon) <= radius
+            }
+            self.assertEqual(
+                filtered({"near": f"{lat},{lon}", "radius_km": radius}), expected
+            )
+        for west, south, east, north in ((-30, -10, 40, 60), (150, -50, -120, 10)):
+            wraps = west > east
+            expected = {
+                pk
+                for pk, p_lat, p_lon in pings
+                if south <= p_lat <= north
+                and (
+                    (p_lon >= west or p_lon <= east)
+                    if wraps
+                    else west <= p_lon <= east
+                )
+            }
+            bbox = f"{west},{south},{east},{north}"
+            self.assertEqual(filtered({"bbox": bbox}), expected)
+
+
+class PingClusterTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(**VALID_USER_DATA)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("ping-clusters")
+
+    def create(self, *positions, user=None):
+        return [
+            Ping.objects.create(user=user or self.user, latitude=lat, longitude=lon)
+            for lat, lon in positions
+        ]
+
+    def test_cells_centroids_and_latest(self):
+        london, paris, new_york = self.create(
+            (51.5074, -0.1278), (48.8566, 2.3522), (40.7128, -74.006)
+        )
+        response = self.client.get(self.url, {"zoom": 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["zoom"], 1)
+        clusters = {(c["row"], c["column"]): c for c in response.data["clusters"]}
+        self.assertEqual(set(clusters), {(1, 0), (1, 1)})
+        east = clusters[(1, 1)]
+        self.assertEqual(east["bounds"], (0.0, 0.0, 90.0, 180.0))
+        self.assertEqual(east["count"], 1)
+        self.assertAlmostEqual(east["latitude"], 48.8566)
+        self.assertEqual(
+            east["latest"], PingSerializer(Ping.objects.get(pk=paris.pk)).data
+        )
+        west = clusters[(1, 0)]
+        self.assertEqual(west["count"], 2)
+        self.assertAlmostEqual(west["latitude"], (51.5074 + 40.7128) / 2)
+        self.assertAlmostEqual(west["longitude"], (-0.1278 - 74.006) / 2)
+        self.assertEqual(west["latest"]["id"], new_york.id)
+
+    def test_edges_fall_into_last_cell(self):
+        self.create((90.0, 180.0), (-90.0, -180.0))
+        response = self.client.get(self.url, {"zoom": 3})
+        cells = {(c["row"], c["column"]) for c in response.data["clusters"]}
+        self.assertEqual(cells, {(7, 7), (0, 0)})
+
+    def test_list_filters_apply(self):
+        other = User.objects.create_user(**VALID_USER_DATA_2)
+        self.create((10.0, 10.0), (-40.0, -100.0))
+        self.create((10.5, 10.5), user=other)
+        response = self.client.get(self.url, {"zoom": 0, "user": other.id})
+        (cell,) = response.data["clusters"]
+        self.assertEqual(cell["count"], 1)
+        response = self.client.get(self.url, {"zoom": 4, "bbox": "0,0,20,20"})
+        (cell,) = response.data["clusters"]
+        self.assertEqual(cell["count"], 2)
+
+    def test_query_count_does_not_grow_with_pings(self):
+        rng = random.Random(2)
+        self.create((0.0, 0.0))
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(self.url, {"zoom": 3})
+        Ping.objects.bulk_create(
+            Ping(
+                user=self.user,
+                latitude=rng.uniform(-90, 90),
+                longitude=rng.uniform(-180, 180),
+            )
+            for _ in range(2000)
+        )
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(self.url, {"zoom": 3})
+        self.assertEqual(len(many), len(few))
+        self.assertLessEqual(len(response.data["clusters"]), 64)
+        self.assertEqual(
+            sum(cell["count"] for cell in response.data["clusters"]), 2001
+        )
+
+    def test_cell_limit(self):
+        response = self.client.get(self.url, {"zoom": 7})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["error"]["code"], "validation_error")
+        response = self.client.get(self.url, {"zoom": 12, "bbox": "-1,50,0,51"})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        for zoom in ("-1", "21", "deep"):
+            response = self.client.get(self.url, {"zoom": zoom})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_matches_python_grouping(self):
+        rng = random.Random(3)
+        Ping.objects.bulk_create(
+            Ping(
+                user=self.user,
+                latitude=rng.uniform(-90, 90),
+                longitude=rng.uniform(-180, 180),
+            )
+            for _ in range(1000)
+        )
+        height, width = geo.cell_size(4)
+        expected = {}
+        for pk, lat, lon in Ping.objects.values_list("id", "latitude", "longitude"):
+            cell = (int((lat + 90) // height), int((lon + 180) // width))
+            count, latest = expected.get(cell, (0, 0))
+            expected[cell] = (count + 1, max(latest, pk))
+        response = self.client.get(self.url, {"zoom": 4})
+        self.assertEqual(
+            {
+                (c["row"], c["column"]): (c["count"], c["latest"]["id"])
+                for c in response.data["clusters"]
+            },
+            expected,
+        )
+
+
+class PingStatsTests(APITestCase):
+    START = datetime(2026, 1, 1, 12, 0, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        self.user = User.objects.create_user(**VALID_USER_DATA)
+        self.other = User.objects.create_user(**VALID_USER_DATA_2)
+        self.client.force_authenticate(user=self.user)
+        self.url = reverse("ping-stats")
+        # Minutes after START at which each user pinged.
+        for user, minutes in ((self.user, (0, 0, 1, 59, 61)), (self.other, (1, 90))):
+            for minute in minutes:
+                ping = Ping.objects.create(user=user, latitude=0.0, longitude=0.0)
+                Ping.objects.filter(pk=ping.pk).update(
+                    timestamp=self.START + timedelta(minutes=minute, seconds=30)
+                )
+
+    def stats(self, **params):
+        params.setdefault("since", self.START.isoformat())
+        params.setdefault("until", (self.START + timedelta(hours=2)).isoformat())
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def counts(self, **params):
+        return [bucket["count"] for bucket in self.stats(**params)["buckets"]]
+
+    def test_hourly_and_per_minute_counts(self):
+        data = self.stats(interval="hour")
+        self.assertEqual(data["total"], 7)
+        self.assertEqual(
+            [bucket["start"] for bucket in data["buckets"]],
+            [self.START, self.START + timedelta(hours=1)],
+        )
+        self.assertEqual(self.counts(interval="hour"), [5, 2])
+        minutes = self.counts(interval="minute")
+        self.assertEqual(len(minutes), 120)
+        self.assertEqual(minutes[:3], [2, 2, 0])
+        self.assertEqual(self.counts(interval="hour", user=self.other.id), [1, 1])
+
+    def test_rollups_match_live_counts(self):
+        live = {
+            interval: self.counts(interval=interval)
+            for interval in ("minute", "hour", "day")
+        }
+        self.assertEqual(rollup_pings(), 6)
+        # Re-running recomputes the same buckets instead of adding to them.
+        rollup_pings(since=self.START)
+        self.assertEqual(PingRollup.objects.count(), 6)
+        for interval, counts in live.items():
+            self.assertEqual(self.counts(interval=interval), counts)
+
+    def test_pings_before_newest_rollup_are_not_counted_live(self):
+        call_command("rollup_pings", "--rebuild", stdout=io.StringIO())
+        newest = PingRollup.objects.latest("bucket").bucket
+        Ping.objects.filter(timestamp__lt=newest).delete()
+        self.assertEqual(self.counts(interval="hour"), [5, 2])
+
+        with self.assertNumQueries(3):
+            self.client.get(self.url, {"interval": "day"})
+
+    def test_pings_after_rollup_are_counted_live(self):
+        rollup_pings()
+        Ping.objects.create(user=self.user, latitude=0.0, longitude=0.0)
+        data = self.client.get(self.url, {"interval": "minute"}).data
+        self.assertEqual(data["total"], 1)
+        self.assertEqual(len(data["buckets"]), 60)
+
+    def test_invalid_parameters(self):
+        for params in (
+            {"interval": "week"},
+            {"since": "2026-01-02T00:00Z", "until": "2026-01-01T00:00Z"},
+            {"interval": "minute", "since": "2026-01-01T00:00Z"},
+            {"user": 0},
+        ):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertEqual(response.data["error"]["code"], "validation_error")
+
+
+class IndexAuditTests(TestCase):
+    def test_find_issues(self):
+        tables = {"api_ping", "api_user"}
+        sql = 'SELECT * FROM "api_ping" p JOIN chain c ON p.id = c.id'
+        self.assertEqual(
+            index_audit.find_issues(
+                ["Limit", "  ->  Sort", "    ->  Seq Scan on api_ping p"],
+                sql,
+                True,
+                tables,
+            ),
+            ["sort", "full scan of api_ping"],
+        )
+        self.assertEqual(
+            index_audit.find_issues(
+                ["  ->  Incremental Sort", "SCAN c", "SCAN p USING INDEX i"],
+                sql,
+                True,
+                tables,
+            ),
+            [],
+        )
+        self.assertEqual(
+            index_audit.find_issues(["SCAN p USING INDEX i"], sql, False, tables),
+            ["full scan of api_ping"],
+        )
+
+    def test_ping_queries_have_no_unexpected_issues(self):
+        user = User.objects.create_user(**VALID_USER_DATA)
+        ping = Ping.objects.create(user=user, latitude=1.0, longitude=1.0)
+        report = index_audit.audit(ping)
+        self.assertGreater(len(report), 80)
+        self.assertEqual(
+            [e["query"] for e in report if e["issues"] and not e["accepted"]], []
+        )
+        out = io.StringIO()
+        call_command("audit_indexes", "--fail", stdout=out)
+        self.assertIn("0 of", out.getvalue())
+
+
+class PartitionTests(TestCase):
+    def test_months(self):
+        month = partitions.month_start(
+            datetime(2025, 12, 31, 23, tzinfo=dt_timezone.utc)
+        )
+        self.assertEqual(month, datetime(2025, 12, 1, tzinfo=dt_timezone.utc))
+        self.assertEqual(partitions.add_months(month, 1).year, 2026)
+        self.assertEqual(partitions.add_months(month, -12).month, 12)
+        self.assertEqual(partitions.partition_name(month), "api_ping_p2025_12")
+
+    def test_create_partition_statements(self):
+        month = datetime(2026, 2, 1, tzinfo=dt_timezone.utc)
+        (create,) = partitions.create_partition_statements(month)
+        self.assertEqual(
+            create,
+            "CREATE TABLE api_ping_p2026_02 PARTITION OF api_ping FOR VALUES "
+            "FROM ('2026-02-01T00:00:00+00:00') TO ('2026-03-01T00:00:00+00:00')",
+        )
+        moving = partitions.create_partition_statements(month, True)
+        self.assertTrue(moving[0].endswith("DETACH PARTITION api_ping_default"))
+        self.assertEqual(moving[1], create)
+        self.assertEqual(
+            moving[-1], "ALTER TABLE api_ping ATTACH PARTITION api_ping_default DEFAULT"
+        )
+
+    def test_detach_trails_reroots_later_pings(self):
+        user = User.objects.create_user(**VALID_USER_DATA)
+        old = Ping.objects.create(user=user, latitude=0.0, longitude=0.0)
+        reply = Ping.objects.create(
+            user=user, latitude=0.0, longitude=0.0, parent_ping=old
+        )
+        answer = Ping.objects.create(
+            user=user, latitude=0.0, longitude=0.0, parent_ping=reply
+        )
+        january = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        Ping.objects.filter(id=old.id).update(timestamp=january)
+
+        rerooted = partitions.detach_trails(january, partitions.add_months(january, 1))
+        self.assertEqual(rerooted, [reply.id])
+        reply.refresh_from_db()
+        answer.refresh_from_db()
+        self.assertEqual(
+            (reply.parent_ping_id, reply.trail_root_id), (None, reply.id)
+        )
+        self.assertEqual(reply.depth, 0)
+        self.assertEqual((answer.trail_root_id, answer.depth), (reply.id, 1))
+
+    def test_command_requires_postgres(self):
+        with self.assertRaisesMessage(CommandError, "requires PostgreSQL"):
+            call_command("ping_partitions", "create", stdout=io.StringIO())
+
+
+class RetentionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(**VALID_USER_DATA)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.old = timezone.now() - timedelta(days=400)
+
+    def create_trail(self, *ages):
+        """Creates a trail with one ping per age, each answering the last."""
+        pings, parent = [], None
+        for age in ages:
+            parent = Ping.objects.create(
+                user=self.user, latitude=1.0, longitude=2.0, parent_ping=parent
+            )
+            Ping.objects.filter(id=parent.id).update(
+                timestamp=timezone.now() - timedelta(days=age)
+            )
+            pings.append(parent)
+        return pings
+
+    def archived(self):
+        paths = sorted(Path(self.directory.name).glob("*.ndjson.gz"))
+        return [row for path in paths for row in retention.read_archive(path)]
+
+    def test_archives_whole_old_trails_only(self):
+        old_trail = self.create_trail(400, 399, 398)
+        old_single = self.create_trail(500)
+        answered = self.create_trail(400, 1)
+        recent = self.create_trail(2)
+
+        out = io.StringIO()
+        call_command(
+            "archive_pings",
+            "--directory",
+            self.directory.name,
+            "--older-than-days",
+            "365",
+            "--batch-size",
+            "1",
+            stdout=out,
+        )
+        self.assertIn("Archived 4 pings into 2 files.", out.getvalue())
+        rows = self.archived()
+        self.assertEqual(
+            [row["id"] for row in rows], [p.id for p in old_single + old_trail]
+        )
+        self.assertEqual(
+            [(row["parent_ping_id"], row["depth"]) for row in rows[1:]],
+            [(None, 0), (old_trail[0].id, 1), (old_trail[1].id, 2)],
+        )
+        self.assertEqual(rows[2]["root_ping_id"], old_trail[0].id)
+        self.assertEqual(
+            set(Ping.objects.values_list("id", flat=True)),
+            {p.id for p in answered + recent},
+        )
+
+        call_command("archive_pings", "--directory", self.directory.name, stdout=out)
+        self.assertEqual(len(self.archived()), 4)
+
+    def test_keeps_pings_answered_outside_their_trail(self):
+        root, answer, stray = self.create_trail(400, 399, 1)
+        (old_single,) = self.create_trail(500)
+        # Leaves answer and stray without a root, stray still answering answer.
+        Ping.objects.filter(id=root.id).delete()
+        stray.refresh_from_db()
+        self.assertEqual((stray.parent_ping_id, stray.root_ping_id), (answer.id, None))
+
+        archived = list(
+            retention.archive_pings(self.directory.name, timedelta(days=365))
+        )
+        self.assertEqual(sum(count for _, count in archived), 1)
+        self.assertEqual([row["id"] for row in self.archived()], [old_single.id])
+        self.assertEqual(
+            set(Ping.objects.values_list("id", flat=True)), {answer.id, stray.id}
+        )
+        connection.check_constraints()
+
+    def test_recover_interrupted_batches(self):
+        (kept,) = self.create_trail(400)
+        (rolled_back,) = self.create_trail(400)
+        directory = Path(self.directory.name)
+        for ping in (kept, rolled_back):
+            rows = Ping.objects.filter(id=ping.id).values(*retention.ARCHIVE_FIELDS)
+            retention.write_archive(directory / f"{ping.id}.ndjson.gz.partial", rows)
+        Ping.objects.filter(id=kept.id).delete()
+
+        self.assertEqual(
+            retention.recover(directory), [directory / f"{kept.id}.ndjson.gz"]
+        )
+        self.assertEqual(list(directory.glob("*.partial")), [])
+        self.assertEqual([row["id"] for row in self.archived()], [kept.id])
+
+
+class SeedingTests(TestCase):
+    def generate(self, seed):
+        start = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        return list(
+            seeding.generate_pings([1, 2], 500, 10, start, timedelta(days=1), seed)
+        )
+
+    def test_generate_pings_is_deterministic(self):
+        self.assertEqual(self.generate(1), self.generate(1))
+        self.assertNotEqual(self.generate(1), self.generate(2))
+
+    def test_seed_db_generates_consistent_trails(self):
+        out = io.StringIO()
+        call_command(
+            "seed_db",
+            "--users",
+            "5",
+            "--pings",
+            "2000",
+            "--max-depth",
+            "4",
+            "--max-children",
+            "2",
+            "--until",
+            "2026-01-01T00:00:00Z",
+            "--batch-size",
+            "300",
+            stdout=out,
+        )
+        self.assertIn("Created pings", out.getvalue())
+        seeded = Ping.objects.filter(user__code_name__startswith="seed0a")
+        self.assertEqual(seeded.count(), 2000)
+        self.assertEqual(seeded.values("user").distinct().count(), 5)
+        self.assertTrue(seeded.filter(depth=4).exists())
+        self.assertFalse(seeded.filter(depth__gt=4).exists())
+        for ping in seeded.filter(depth__gt=0).select_related("parent_ping"):
+            parent = ping.parent_ping
+            self.assertEqual(ping.depth, parent.depth + 1)
+            self.assertEqual(ping.root_ping_id, parent.trail_root_id)
+            self.assertLess(parent.timestamp, ping.timestamp)
+        answers = seeded.values("parent_ping").annotate(count=Count("id"))
+        self.assertEqual(
+            max(row["count"] for row in answers if row["parent_ping"]), 2
+        )
+
+        # The sequence continues after the explicit ids.
+        last_id = seeded.order_by("-id")[0].id
+        user = User.objects.get(code_name="seed0a0000000")
+        ping = Ping.objects.create(user=user, latitude=0.0, longitude=0.0)
+        self.assertGreater(ping.id, last_id)
+
+
+class AsyncReadViewTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(**VALID_USER_DATA)
+        self.root = Ping.objects.create(user=self.user, latitude=1.0, longitude=1.0)
+        for i in range(3):
+            Ping.objects.create(
+                user=self.user, latitude=2.0 + i, longitude=2.0, parent_ping=self.root
+            )
+        self.authorization = f"Bearer {AccessToken.for_user(self.user)}"
+        self.client.credentials(HTTP_AUTHORIZATION=self.authorization)
+
+    async def async_get(self, view, url, params=None, **kwargs):
+        request = AsyncRequestFactory().get(
+            url, params, headers={"Authorization": self.authorization}
+        )
+        return await view(request, **kwargs)
+
+    async def assertMatchesSync(self, view, url, params=None, **kwargs):
+        expected = await sync_to_async(self.client.get)(url, params)
+        response = await self.async_get(view, url, params, **kwargs)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(response["ETag"], expected["ETag"])
+        return response
+
+    async def test_responses_match_sync_views(self):
+        await self.assertMatchesSync(async_views.ping_list, reverse("ping-list"))
+        await self.assertMatchesSync(
+            async_views.ping_list, reverse("ping-list"), {"user": self.user.id}
+        )
+        await self.assertMatchesSync(
+            async_views.ping_detail,
+            reverse("ping-detail", kwargs={"pk": self.root.pk}),
+            pk=self.root.pk,
+        )
+        response = await self.assertMatchesSync(
+            async_views.ping_latest, reverse("ping-latest")
+        )
+        self.assertEqual(response["X-Cache"], "HIT")
+
+    async def test_list_cursor_pages_match_sync_views(self):
+        url = reverse("ping-list")
+        with mock.patch.object(KeysetPagination, "page_size", 2):
+            response = await self.assertMatchesSync(async_views.ping_list, url)
+            next_url = urlparse(json.loads(response.content)["next"])
+            cursor = parse_qs(next_url.query)["cursor"][0]
+            await self.assertMatchesSync(async_views.ping_list, url, {"cursor": cursor})
+
+    async def test_detail_applies_filters(self):
+        other_user = await sync_to_async(User.objects.create_user)(
+            **VALID_USER_DATA_2
+        )
+        url = reverse("ping-detail", kwargs={"pk": self.root.pk})
+        for params in ({"user": other_user.id}, {"bbox": "10,10,20,20"}):
+            expected = await sync_to_async(self.client.get)(url, params)
+            self.assertEqual(expected.status_code, status.HTTP_404_NOT_FOUND)
+            response = await self.async_get(
+                async_views.ping_detail, url, params, pk=self.root.pk
+            )
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+            self.assertEqual(response.content, expected.content)
+        await self.assertMatchesSync(
+            async_views.ping_detail, url, {"user": self.user.id}, pk=self.root.pk
+        )
+
+    async def test_permissions_and_throttles_match_sync_views(self):
+        class DenyAll(permissions.BasePermission):
+            def has_permission(self, request, view):
+                return False
+
+        class ThrottleAll(BaseThrottle):
+            def allow_request(self, request, view):
+                return False
+
+            def wait(self):
+                return 30
+
+        detail_url = reverse("ping-detail", kwargs={"pk": self.root.pk})
+        views = [
+            (async_views.ping_list, reverse("ping-list"), {}),
+            (async_views.ping_detail, detail_url, {"pk": self.root.pk}),
+            # Its @action sets permission classes, but not throttles.
+            (async_views.ping_latest, reverse("ping-latest"), None),
+        ]
+        for attribute, value, code in (
+            ("permission_classes", [DenyAll], status.HTTP_403_FORBIDDEN),
+            ("throttle_classes", [ThrottleAll], status.HTTP_429_TOO_MANY_REQUESTS),
+        ):
+            for view, url, kwargs in views:
+                if kwargs is None:
+                    if attribute == "permission_classes":
+                        continue
+                    kwargs = {}
+                with mock.patch.object(PingViewSet, attribute, value):
+                    expected = await sync_to_async(self.client.get)(url)
+                    response = await self.async_get(view, url, **kwargs)
+                self.assertEqual(expected.status_code, code)
+                self.assertEqual(response.status_code, code)
+                self.assertEqual(response.content, expected.content)
+                self.assertEqual(
+                    response.get("Retry-After"), expected.get("Retry-After")
+                )
+
+    async def test_current_user(self):
+        response = await self.async_get(
+            async_views.current_user, reverse("current_user")
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)["email"], self.user.email)
+
+    async def test_errors_use_api_error_envelope(self):
+        url = reverse("ping-detail", kwargs={"pk": 0})
+        response = await self.async_get(async_views.ping_detail, url, pk="0")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(json.loads(response.content)["error"]["code"], "not_found")
+        self.authorization = ""
+        response = await self.async_get(async_views.ping_list, reverse("ping-list"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    async def test_not_modified(self):
+        url = reverse("ping-list")
+        etag = (await self.async_get(async_views.ping_list, url))["ETag"]
+        request = AsyncRequestFactory().get(
+            url, headers={"Authorization": self.authorization, "If-None-Match": etag}
+        )
+        response = await async_views.ping_list(request)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    async def test_writes_fall_back_to_sync_views(self):
+        request = AsyncRequestFactory().post(
+            reverse("ping-list"),
+            {"latitude": 5.0, "longitude": 5.0, "user_id": self.user.id},
+            content_type="application/json",
+            headers={"Authorization": self.authorization},
+        )
+        response = await async_views.ping_list_view(request)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(await Ping.objects.acount(), 5)
+
+
+class LoadTestConnectionTests(TestCase):
+    def test_reads_chunked_responses_over_one_connection(self):
+        async def handle(reader, writer):
+            while await reader.readuntil(b"\r\n\r\n"):
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n"
+                    b"3\r\nabc\r\n2;ext=1\r\nde\r\n0\r\n\r\n"
+                )
+
+        async def scenario():
+            server = await asyncio.start_server(handle, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            connection = Connection(f"http://127.0.0.1:{port}/")
+            responses = [await connection.request("GET", "/") for _ in range(2)]
+            writer = connection.writer
+            connection.close()
+            server.close()
+            return responses, writer
+
+        responses, writer = asyncio.run(scenario())
+        self.assertEqual(responses, [(200, b"abcde"), (200, b"abcde")])
+        self.assertIsNotNone(writer)
+
+
+class LoadTestScenarioTests(APITestCase):
+    def test_load_scenario(self):
+        self.assertEqual(load_scenario("write"), {"create": 1, "respond": 1})
+        with tempfile.NamedTemporaryFile("w", suffix=".json") as f:
+            json.dump({"list": 3, "teleport": 1}, f)
+            f.flush()
+            with self.assertRaisesMessage(LoadTestError, "unknown steps teleport"):
+                load_scenario(f.name)
+        with self.assertRaisesMessage(LoadTestError, "No scenario"):
+            load_scenario("missing")
+
+    def test_compare(self):
+        baseline = {
+            "list": {"p95_ms": 10.0, "throughput_rps": 100.0, "queries_mean": 3.0},
+            "create": {"p95_ms": 20.0, "throughput_rps": 50.0, "errors": 0},
+        }
+        current = {
+            "list": {"p95_ms": 11.0, "throughput_rps": 70.0, "queries_mean": 4.0},
+            "create": {"p95_ms": 30.0, "throughput_rps": 49.0, "errors": 2},
+        }
+        self.assertEqual(
+            compare(baseline, current, tolerance=0.2),
+            [
+                "list: throughput 100.0 -> 70.0 rps",
+                "list: queries 3.0 -> 4.0",
+                "create: p95 20.0ms -> 30.0ms",
+                "create: 2 errors",
+            ],
+        )
+        self.assertEqual(compare(baseline, baseline), [])
+
+    @override_settings(DB_QUERY_COUNT_HEADER=True)
+    def test_query_count_header(self):
+        user = User.objects.create_user(**VALID_USER_DATA)
+        self.client.force_authenticate(user=user)
+        response = self.client.get("/api/v1/auth/current_user/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response["X-DB-Queries"], "0")
+        Ping.objects.create(user=user, latitude=1.0, longitude=2.0)
+        response = self.client.get("/api/v1/pings/")
+        self.assertGreater(int(response["X-DB-Queries"]), 0)
+
+    def test_query_count_header_off_by_default(self):
+        response = self.client.get("/api/v1/pings/")
+        self.assertNotIn("X-DB-Queries", response)
+
+
+class PerformanceMetricsTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(**VALID_USER_DATA)
+        self.client.force_authenticate(user=self.user)
+        Ping.objects.create(user=self.user, latitude=1.0, longitude=2.0)
+
+    def test_server_timing_header(self):
+        response = self.client.get("/api/v1/pings/")
+        timing = dict(
+            part.split(";", 1) for part in response["Server-Timing"].split(", ")
+        )
+        self.assertEqual(set(timing), {"total", "db", "serializer"})
+        self.assertRegex(timing["db"], r'^dur=[\d.]+;desc="[1-9]\d* queries"$')
+
+    def test_histograms(self):
+        histogram = metrics.Histogram("h", "A histogram.", ["view"], buckets=(1, 5))
+        for value in (0.5, 1, 3, 10):
+            histogram.observe(value, "pings")
+        self.assertEqual(
+            list(histogram.samples()),
+            [
+                ("h_bucket", '{view="pings",le="1"}', 2),
+                ("h_bucket", '{view="pings",le="5"}', 3),
+                ("h_bucket", '{view="pings",le="+Inf"}', 4),
+                ("h_sum", '{view="pings"}', 14.5),
+                ("h_count", '{view="pings"}', 4),
+            ],
+        )
+
+    def test_metrics_endpoint(self):
+        self.client.get("/api/v1/pings/")
+        staff = User.objects.create_user(**VALID_USER_DATA_2, is_staff=True)
+        self.client.force_login(staff)
+        response = self.client.get("/api/v1/metrics/")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        body = response.content.decode()
+        self.assertIn("# TYPE http_request_duration_seconds histogram", body)
+        self.assertIn(
+            'http_request_db_queries_bucket{view="ping-list",method="GET",le="+Inf"}',
+            body,
+        )
+
+    @override_settings(METRICS_TOKEN="secret")
+    def test_metrics_token(self):
+        response = self.client.get("/api/v1/metrics/")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        response = self.client.get(
+            "/api/v1/metrics/", HTTP_AUTHORIZATION="Bearer secret"
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_metrics_are_denied_by_default(self):
+        response = self.client.get("/api/v1/metrics/", HTTP_AUTHORIZATION="Bearer ")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_login(self.user)
+        response = self.client.get("/api/v1/metrics/")
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    async def test_async_views_are_timed_without_adapting(self):
+        middleware = PerformanceMiddleware(async_views.ping_list)
+        self.assertTrue(iscoroutinefunction(middleware))
+        request = AsyncRequestFactory().get(
+            "/api/v1/pings/",
+            headers={"Authorization": f"Bearer {AccessToken.for_user(self.user)}"},
+        )
+        response = await middleware(request)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        timing = dict(
+            part.split(";", 1) for part in response["Server-Timing"].split(", ")
+        )
+        # Queries the async ORM ran in worker threads are counted.
+        self.assertRegex(timing["db"], r'desc="[1-9]\d* queries"$')
+
+    @override_settings(PERFORMANCE_SAMPLE_RATE=0.0)
+    def test_unsampled_requests_are_only_counted(self):
+        labels = ("ping-list", "GET", "200")
+        before = metrics.requests_total.values.get(labels, 0)
+        response = self.client.get("/api/v1/pings/")
+        self.assertNotIn("Server-Timing", response)
+        self.assertEqual(metrics.requests_total.values[labels], before + 1)
+
+
+class InProcessBrokerTests(TestCase):
+    def test_slow_subscriber_is_cut_off(self):
+        async def scenario():
+            broker = InProcessBroker(max_queue_size=2)
+            subscription = broker.subscribe()
+            for i in range(3):
+                broker.publish({"type": "ping", "id": i, "data": "{}"})
+            await asyncio.sleep(0)
+            return await subscription.get()
+
+        self.assertIsNone(asyncio.run(scenario()))
+
+    def test_publish_from_another_thread(self):
+        async def scenario():
+            broker = InProcessBroker()
+            subscription = broker.subscribe()
+            event = {"type": "ping", "id": 1, "data": "{}"}
+            await asyncio.to_thread(broker.publish, event)
+            return await asyncio.wait_for(subscription.get(), timeout=1)
+
+        self.assertEqual(asyncio.run(scenario())["id"], 1)
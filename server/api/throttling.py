@@ -0,0 +1,185 @@
+"""
+Rate limits on logins and registrations, by client IP and by the account
+they name.
+
+The throttles run before the view, so a throttled request is turned away
+with 429 Too Many Requests, in the custom_exception_handler envelope and
+with a Retry-After header, before its password is hashed or the database
+is touched. Rates are the login, login_account, register and
+register_account entries of DEFAULT_THROTTLE_RATES, and THROTTLE_LOGINS
+turns them all off, e.g. for load tests. Limiting by account
+means a stuffing attack on one code name also locks out its owner for as
+long as the attack lasts; limiting by IP alone would let an attacker
+spread over addresses.
+
+Attempts are counted in the store named by THROTTLE_STORE:
+
+- LocalBucketStore keeps a token bucket per key in process memory. Each
+  server process counts separately.
+- CacheBucketStore keeps a sliding window counter per key in a Django
+  cache, shared by every process using it.
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+from .caches import increment
+
+
+class LocalBucketStore:
+    """
+    Token buckets holding up to ``limit`` tokens and refilled at ``limit``
+    per ``period``; each attempt takes one. The least recently used buckets
+    are dropped beyond ``max_keys``.
+    """
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        # {key: (tokens, updated)}, least recently used first.
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def hit(self, key, limit, period, now=None):
+        """Counts an attempt; returns 0 or the seconds until one is allowed."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (limit, now))
+            tokens = min(limit, tokens + (now - updated) * limit / period)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0.0
+            else:
+                wait = (1 - tokens) * period / limit
+            self.buckets[key] = (tokens, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        with self.lock:
+            self.buckets.clear()
+
+
+class CacheBucketStore:
+    """
+    Sliding window counters: the attempts in the current fixed window plus
+    those of the previous one, weighted by how much of it still overlaps
+    the sliding window. Counting uses the cache's atomic increment, so the
+    limit holds across processes; turned away attempts count as well.
+    """
+
+    def __init__(self):
+        self.cache = caches[getattr(settings, "THROTTLE_CACHE", "default")]
+
+    def hit(self, key, limit, period, now=None):
+        now = time.time() if now is None else now
+        window, elapsed = divmod(now, period)
+        # Keys embed user input, which not every cache backend accepts.
+        digest = hashlib.md5(key.encode(), usedforsecurity=False).hexdigest()
+        current_key = f"api:throttle:{digest}:{int(window)}"
+        previous_key = f"api:throttle:{digest}:{int(window) - 1}"
+        count = increment(self.cache, current_key, timeout=period * 2)
+        previous = self.cache.get(previous_key, 0)
+        overlap = 1 - elapsed / period
+        if previous * overlap + count <= limit:
+            return 0.0
+        if previous and count < limit:
+            # Until enough of the previous window slides out for one more.
+            return period * (overlap - (limit - count - 1) / previous)
+        return period - elapsed
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                store_class = import_string(
+                    getattr(
+                        settings, "THROTTLE_STORE", "api.throttling.LocalBucketStore"
+                    )
+                )
+                _store = store_class()
+    return _store
+
+
+class StoreRateThrottle(SimpleRateThrottle):
+    """
+    A SimpleRateThrottle counting in get_store() rather than keeping a
+    history of request times in the cache.
+    """
+
+    def get_rate(self):
+        # Read on each use, so changes to REST_FRAMEWORK apply.
+        return api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+
+    def allow_request(self, request, view):
+        if self.rate is None or not getattr(settings, "THROTTLE_LOGINS", True):
+            return True
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+        self.wait_time = get_store().hit(
+            f"{self.scope}:{key}", self.num_requests, self.duration
+        )
+        return self.wait_time == 0
+
+    def wait(self):
+        return self.wait_time
+
+
+class IPRateThrottle(StoreRateThrottle):
+    """
+    Throttles by the client address. X-Forwarded-For is only read when
+    NUM_PROXIES says how many trusted proxies append to it; get_ident would
+    otherwise key on the whole header, which clients choose.
+    """
+
+    def get_cache_key(self, request, view):
+        if api_settings.NUM_PROXIES is None:
+            return request.META.get("REMOTE_ADDR")
+        return self.get_ident(request)
+
+
+class AccountRateThrottle(StoreRateThrottle):
+    """Throttles attempts on the account named by the request's ``field``."""
+
+    field = None
+
+    def get_cache_key(self, request, view):
+        data = request.data
+        value = data.get(self.field) if hasattr(data, "get") else None
+        if not isinstance(value, str) or not value.strip():
+            return None
+        return value.strip().lower()
+
+
+class LoginRateThrottle(IPRateThrottle):
+    scope = "login"
+
+
+class LoginAccountRateThrottle(AccountRateThrottle):
+    scope = "login_account"
+    field = "code_name"
+
+
+class RegisterRateThrottle(IPRateThrottle):
+    scope = "register"
+
+
+class RegisterAccountRateThrottle(AccountRateThrottle):
+    scope = "register_account"
+    field = "email"
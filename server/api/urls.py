@@ -1,6 +1,8 @@
+from django.conf import settings
 from django.urls import path
 from rest_framework import routers
 
+from . import async_views
 from .views import (
     CurrentUserView,
     CustomTokenBlacklistView,
@@ -8,15 +10,34 @@ from .views import (
     CustomTokenRefreshView,
     PingViewSet,
     RegisterView,
+    metrics_view,
 )
 
 router = routers.SimpleRouter()
 router.register(r"pings", PingViewSet, basename="ping")
 
+if settings.ASYNC_READ_VIEWS:
+    current_user_view = async_views.current_user_view
+else:
+    current_user_view = CurrentUserView.as_view()
+
 urlpatterns = [
     path("auth/login/", CustomTokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("auth/refresh/", CustomTokenRefreshView.as_view(), name="token_refresh"),
     path("auth/logout/", CustomTokenBlacklistView.as_view(), name="token_blacklist"),
     path("auth/register/", RegisterView.as_view(), name="register"),
-    path("auth/current_user/", CurrentUserView.as_view(), name="current_user"),
-] + router.urls
+    path("auth/current_user/", current_user_view, name="current_user"),
+    path("pings/stream/", async_views.ping_stream, name="ping-stream"),
+    path("metrics/", metrics_view, name="metrics"),
+]
+
+if settings.ASYNC_READ_VIEWS:
+    # Async read views take over the router's URLs and names, so they have
+    # to be matched first.
+    urlpatterns += [
+        path("pings/", async_views.ping_list_view, name="ping-list"),
+        path("pings/latest/", async_views.ping_latest, name="ping-latest"),
+        path("pings/<int:pk>/", async_views.ping_detail_view, name="ping-detail"),
+    ]
+
+urlpatterns += router.urls
@@ -1,22 +1,61 @@
+import hashlib
 import random
+from functools import partial
 
+from django.conf import settings
+from django.db.models import Avg, Count, Max, Prefetch, prefetch_related_objects
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
+from django.utils.dateparse import parse_datetime
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.http import require_GET
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters, permissions, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
-from rest_framework_simplejwt.tokens import AccessToken
 from rest_framework_simplejwt.views import (
     TokenBlacklistView,
     TokenObtainPairView,
     TokenRefreshView,
 )
 
+from . import geo, metrics
+from .authentication import StreamTicket
+from .broker import publish_on_commit
+from .caches import latest_pings_cache, ping_changes
+from .filters import GeoFilterBackend, PingFilterSet, grid_cell
 from .models import Ping, User
+from .pagination import KeysetPagination
 from .permissions import IsOwnerOrReadOnly
-from .serializers import PingSerializer, RegisterSerializer, UserSerializer
+from .renderers import CSVRenderer, NDJSONRenderer
+from .responses import PreRenderedJSONResponse, streaming_response
+from .rollups import INTERVALS, bucket_counts
+from .serializers import (
+    PingBulkSerializer,
+    PingReadSerializer,
+    PingSerializer,
+    PingStatsQuerySerializer,
+    RegisterSerializer,
+    UserSerializer,
+)
+from .throttling import (
+    LoginAccountRateThrottle,
+    LoginRateThrottle,
+    RegisterAccountRateThrottle,
+    RegisterRateThrottle,
+)
 
 LATEST_PINGS_COUNT = 3
+# Rows fetched per round trip from the server-side cursor of an export.
+EXPORT_CHUNK_SIZE = 2000
+DEFAULT_CLUSTER_ZOOM = 2
+MAX_CLUSTER_ZOOM = 20
+# Upper bound on the grid cells one clusters request may span.
+MAX_CLUSTER_CELLS = 4096
 
 
 def set_refresh_token_cookie(response, refresh_token):
@@ -33,22 +72,9 @@ def set_refresh_token_cookie(response, refresh_token):
     return response
 
 
-def attach_user_to_response(response):
-    access_token = response.data.get("access", None)
-    if access_token:
-        try:
-            token = AccessToken(access_token)
-            user_id = token["user_id"]
-            user = User.objects.get(id=user_id)
-            response.data["user"] = UserSerializer(user).data
-            response.data["user"] = UserSerializer(user).data
-        except Exception:
-            # Optionally log or handle error
-            pass
-    return response
-
-
 class CustomTokenObtainPairView(TokenObtainPairView):
+    throttle_classes = [LoginRateThrottle, LoginAccountRateThrottle]
+
     def post(self, request, *args, **kwargs):
         try:
             response = super().post(request, *args, **kwargs)
@@ -59,7 +85,6 @@ class CustomTokenObtainPairView(TokenObtainPairView):
             response = set_refresh_token_cookie(
                 response, response.data.get("refresh", None)
             )
-            attach_user_to_response(response)
         return response
 
 
@@ -74,7 +99,6 @@ class CustomTokenRefreshView(TokenRefreshView):
                 response = set_refresh_token_cookie(
                     response, response.data.get("refresh", None)
                 )
-            attach_user_to_response(response)
         return response
 
 
@@ -90,6 +114,8 @@ class CustomTokenBlacklistView(TokenBlacklistView):
 
 
 class RegisterView(APIView):
+    throttle_classes = [RegisterRateThrottle, RegisterAccountRateThrottle]
+
     def post(self, request, *args, **kwargs):
         serializer = RegisterSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -113,6 +139,114 @@ class CurrentUserView(APIView):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
 
+PING_SET_AGGREGATES = {
+    "count": Count("id"),
+    "max_id": Max("id"),
+    "max_timestamp": Max("timestamp"),
+}
+
+
+@require_GET
+def metrics_view(request):
+    """
+    The metrics of api.metrics in the Prometheus text format, for requests
+    with the bearer METRICS_TOKEN, if one is set, and for staff signed in
+    to the admin.
+    """
+    token = getattr(settings, "METRICS_TOKEN", "")
+    authorization = request.headers.get("Authorization", "")
+    has_token = token and constant_time_compare(authorization, f"Bearer {token}")
+    if not has_token and not request.user.is_staff:
+        return HttpResponse(
+            status=status.HTTP_401_UNAUTHORIZED if token else status.HTTP_403_FORBIDDEN
+        )
+    return HttpResponse(
+        metrics.registry.render(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+
+def validators_from_aggregates(stats):
+    max_timestamp = stats["max_timestamp"]
+    return (
+        (stats["count"], stats["max_id"]),
+        max_timestamp.timestamp() if max_timestamp else None,
+    )
+
+
+def validators_from_rows(rows):
+    """
+    Validators of a page of ping rows: their ids and newest timestamp, for
+    pages that are cheaper to fetch than to aggregate the whole listing for.
+    """
+    timestamps = [row["timestamp"] for row in rows]
+    return (
+        tuple(row["id"] for row in rows),
+        max(timestamps).timestamp() if timestamps else None,
+    )
+
+
+def ping_set_validators(queryset):
+    """
+    Cheap stand-ins for the content of a ping listing: the row count, highest
+    id and newest timestamp, which change whenever pings are added or
+    removed. Edits are covered by the ping_changes generation.
+    """
+    return validators_from_aggregates(
+        queryset.order_by().aggregate(**PING_SET_AGGREGATES)
+    )
+
+
+def make_validators(
+    path, renderer_format, generation, tracked_modified, etag_parts, last_modified
+):
+    digest = hashlib.md5(
+        repr((path, renderer_format, generation, *etag_parts)).encode(),
+        usedforsecurity=False,
+    ).hexdigest()
+    modified_times = [t for t in (last_modified, tracked_modified) if t is not None]
+    return quote_etag(digest), int(max(modified_times)) if modified_times else None
+
+
+def attach_validators(response, etag, last_modified):
+    if response.status_code in (status.HTTP_200_OK, status.HTTP_304_NOT_MODIFIED):
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+    return response
+
+
+def conditional_response(request, render, etag_parts, last_modified=None):
+    """
+    Answers If-None-Match / If-Modified-Since with 304 Not Modified when the
+    validators match, otherwise calls ``render`` and attaches them.
+    """
+    etag, last_modified = make_validators(
+        request.get_full_path(),
+        request.accepted_renderer.format,
+        ping_changes.generation(),
+        ping_changes.last_modified(),
+        etag_parts,
+        last_modified,
+    )
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        response = render()
+    return attach_validators(response, etag, last_modified)
+
+
+def hash_payload(payload):
+    return hashlib.md5(payload, usedforsecurity=False).hexdigest()
+
+
+def render_latest_payload(data):
+    """Renders latest pings for caching, with the newest ping's timestamp."""
+    newest = parse_datetime(data[0]["timestamp"]).timestamp() if data else None
+    return JSONRenderer().render(data), newest
+
+
 def get_random_latitude():
     return random.uniform(-90.0, 90.0)
 
@@ -122,21 +256,362 @@ def get_random_longitude():
 
 
 class PingViewSet(viewsets.ModelViewSet):
-    queryset = Ping.objects.all()
+    # Users are joined in and limited to the columns PingSerializer emits, so
+    # a page of pings is a single query.
+    queryset = Ping.objects.select_related("user").only(
+        *(field.name for field in Ping._meta.concrete_fields),
+        *(f"user__{name}" for name in UserSerializer.Meta.fields),
+    )
     serializer_class = PingSerializer
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrReadOnly]
-    filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
-    filterset_fields = ["user", "timestamp"]
+    pagination_class = KeysetPagination
+    filter_backends = [DjangoFilterBackend, GeoFilterBackend, filters.OrderingFilter]
+    filterset_class = PingFilterSet
     ordering_fields = ["timestamp", "latitude", "longitude"]
     ordering = ["-timestamp"]
+    # Read-heavy actions rendered from .values() rows by PingReadSerializer.
+    fast_read_actions = ("list", "latest", "export", "clusters")
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in self.fast_read_actions:
+            queryset = PingReadSerializer.values(queryset)
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action in self.fast_read_actions:
+            return PingReadSerializer
+        if self.action == "bulk":
+            return PingBulkSerializer
+        return super().get_serializer_class()
+
+    def list(self, request, *args, **kwargs):
+        if self.paginator.is_cursor_page(request):
+            # Aggregating the whole listing on every page would cost what
+            # keyset pagination saves, so cursor pages are validated by
+            # their own rows and carry no count.
+            page = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
+            etag_parts, last_modified = validators_from_rows(page)
+            return conditional_response(
+                request,
+                lambda: self.get_paginated_response(
+                    self.get_serializer(page, many=True).data
+                ),
+                etag_parts,
+                last_modified,
+            )
+        # Validators are aggregated over the plain, unjoined table, and the
+        # page reports the same count.
+        stats = (
+            self.filter_queryset(Ping.objects.all())
+            .order_by()
+            .aggregate(**PING_SET_AGGREGATES)
+        )
+        self.paginator.count = stats["count"]
+        etag_parts, last_modified = validators_from_aggregates(stats)
+        return conditional_response(
+            request,
+            partial(super().list, request, *args, **kwargs),
+            etag_parts,
+            last_modified,
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return conditional_response(
+            request,
+            lambda: Response(self.get_serializer(instance).data),
+            (instance.id,),
+            instance.timestamp.timestamp(),
+        )
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        ping_changes.changed()
+        event_type = "response" if serializer.instance.parent_ping_id else "ping"
+        publish_on_commit(event_type, serializer.instance.id, serializer.data)
+
+    def perform_update(self, serializer):
+        reparented = "parent_ping" in serializer.validated_data
+        ping = serializer.save()
+        if reparented:
+            Ping.objects.rebuild_trails([ping.id])
+        ping_changes.changed()
+
+    def perform_destroy(self, instance):
+        # Children become the roots of their own trails once their parent
+        # is gone, so their subtrees need re-rooting.
+        child_ids = list(instance.child_pings.values_list("id", flat=True))
+        instance.delete()
+        Ping.objects.rebuild_trails(child_ids)
+        ping_changes.changed()
+
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="bulk",
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def bulk(self, request):
+        """
+        Creates up to MAX_BULK_PINGS pings for the current user from
+        ``{"pings": [...]}``. Valid items are created even when others fail:
+        the response is 201 when all were created, 207 when some were and
+        400 when none were, listing created ids and errors by index.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        created = serializer.save(user=request.user)
+        if created:
+            ping_changes.changed()
+            pings = list(created.values())
+            # One event for the whole batch rather than one per ping.
+            publish_on_commit(
+                "pings",
+                pings[-1].id,
+                PingReadSerializer(PingReadSerializer.rows(pings), many=True).data,
+            )
+
+        if not serializer.item_errors:
+            response_status = status.HTTP_201_CREATED
+        elif created:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+        return Response(serializer.data, status=response_status)
+
+    @action(
+        detail=False,
+        methods=["get"],
+        renderer_classes=[NDJSONRenderer, CSVRenderer],
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def export(self, request):
+        """
+        Streams every ping matching the list filters and ordering as NDJSON
+        (default) or CSV, picked with ``?format=csv`` or the Accept header.
+        Rows are read through a server-side cursor and rendered in chunks,
+        under WSGI and ASGI alike, so memory use does not grow with the size
+        of the export.
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        serializer = self.get_serializer(
+            queryset.iterator(chunk_size=EXPORT_CHUNK_SIZE), many=True
+        )
+        renderer = request.accepted_renderer
+        response = streaming_response(
+            request._request,
+            renderer.stream(serializer.iter_data()),
+            content_type=f"{renderer.media_type}; charset={renderer.charset}",
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="pings.{renderer.format}"'
+        )
+        return response
+
+    @action(
+        detail=False,
+        methods=["post"],
+        url_path="stream/ticket",
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def stream_ticket(self, request):
+        """
+        Issues a StreamTicket for opening ``pings/stream/?ticket=``, since
+        EventSource cannot send the access token in a header.
+        """
+        ticket = StreamTicket.for_access_token(request.user, request.auth)
+        return Response(
+            {
+                "ticket": str(ticket),
+                "expires_in": int(StreamTicket.lifetime.total_seconds()),
+            },
+            status=status.HTTP_201_CREATED,
+        )
+
+    @action(
+        detail=False, methods=["get"], permission_classes=[permissions.IsAuthenticated]
+    )
+    def clusters(self, request):
+        """
+        Aggregates the pings matching the list filters into the cells of a
+        grid with 2**zoom rows and columns, for ``?zoom=`` from 0 to
+        MAX_CLUSTER_ZOOM. Each non-empty cell reports its bounds, ping count,
+        centroid and latest ping, all computed in SQL.
+
+        A request may span at most MAX_CLUSTER_CELLS cells, so the payload
+        size does not depend on how many pings exist; deeper zooms need a
+        ``bbox`` viewport.
+        """
+        zoom = self.get_cluster_zoom(request.query_params)
+        boxes = GeoFilterBackend().get_boxes(request.query_params)
+        if geo.grid_cell_count(boxes, zoom) > MAX_CLUSTER_CELLS:
+            raise ValidationError(
+                {
+                    "zoom": [
+                        f"More than {MAX_CLUSTER_CELLS} cells requested; lower "
+                        "the zoom or narrow the bbox."
+                    ]
+                }
+            )
+        queryset = self.filter_queryset(Ping.objects.all())
+        etag_parts, last_modified = ping_set_validators(queryset)
+        return conditional_response(
+            request,
+            partial(self.render_clusters, queryset, zoom),
+            etag_parts,
+            last_modified,
+        )
+
+    def get_cluster_zoom(self, params):
+        try:
+            zoom = int(params.get("zoom", DEFAULT_CLUSTER_ZOOM))
+        except ValueError:
+            zoom = -1
+        if not 0 <= zoom <= MAX_CLUSTER_ZOOM:
+            raise ValidationError(
+                {"zoom": [f"Expected an integer from 0 to {MAX_CLUSTER_ZOOM}."]}
+            )
+        return zoom
+
+    def cluster_cells(self, queryset, zoom):
+        row, column = grid_cell(zoom)
+        return (
+            queryset.annotate(row=row, column=column)
+            .values("row", "column")
+            .annotate(
+                count=Count("id"),
+                centroid_latitude=Avg("latitude"),
+                centroid_longitude=Avg("longitude"),
+                # Ids grow with the auto_now_add timestamps.
+                latest_id=Max("id"),
+            )
+            .order_by("row", "column")
+        )
+
+    def render_clusters(self, queryset, zoom):
+        cells = list(self.cluster_cells(queryset, zoom))
+        latest = {
+            ping["id"]: ping
+            for ping in self.get_queryset().filter(
+                id__in=[cell["latest_id"] for cell in cells]
+            )
+        }
+        return Response(
+            {
+                "zoom": zoom,
+                "clusters": [
+                    {
+                        "row": cell["row"],
+                        "column": cell["column"],
+                        "bounds": geo.cell_bounds(cell["row"], cell["column"], zoom),
+                        "count": cell["count"],
+                        "latitude": cell["centroid_latitude"],
+                        "longitude": cell["centroid_longitude"],
+                        "latest": self.get_serializer(latest[cell["latest_id"]]).data,
+                    }
+                    for cell in cells
+                ],
+            },
+            status=status.HTTP_200_OK,
+        )
+
+    @action(
+        detail=False, methods=["get"], permission_classes=[permissions.IsAuthenticated]
+    )
+    def stats(self, request):
+        """
+        Counts of pings created per ``?interval=minute|hour|day`` bucket
+        between ``since`` and ``until`` (default: the last 60 buckets),
+        overall or for one ``user``. Served from the rollups kept by
+        ``manage.py rollup_pings``, see api/rollups.py.
+        """
+        query = PingStatsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        interval, since, until, user = (
+            query.validated_data.get(name)
+            for name in ("interval", "since", "until", "user")
+        )
+        counts = bucket_counts(interval, since, until, user.id if user else None)
+        buckets = []
+        start = since
+        while start < until:
+            buckets.append({"start": start, "count": counts.get(start, 0)})
+            start += INTERVALS[interval]
+        return Response(
+            {
+                "interval": interval,
+                "since": since,
+                "until": until,
+                "user": user.id if user else None,
+                "total": sum(bucket["count"] for bucket in buckets),
+                "buckets": buckets,
+            },
+            status=status.HTTP_200_OK,
+        )
 
     @action(
         detail=False, methods=["get"], permission_classes=[permissions.IsAuthenticated]
     )
     def latest(self, request):
-        latest_pings = self.queryset.order_by("-timestamp")[:LATEST_PINGS_COUNT]
-        serializer = self.get_serializer(latest_pings, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        def render_latest_pings():
+            latest_pings = self.get_queryset().order_by("-timestamp")[
+                :LATEST_PINGS_COUNT
+            ]
+            return render_latest_payload(
+                self.get_serializer(latest_pings, many=True).data
+            )
+
+        (payload, newest), hit = latest_pings_cache.get_or_set(render_latest_pings)
+        # The rendered payload is its own validator, so no query is needed.
+        return conditional_response(
+            request,
+            partial(
+                PreRenderedJSONResponse,
+                payload,
+                status=status.HTTP_200_OK,
+                headers={"X-Cache": "HIT" if hit else "MISS"},
+            ),
+            (hash_payload(payload),),
+            newest,
+        )
+
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path="latest/stats",
+        permission_classes=[permissions.IsAdminUser],
+    )
+    def latest_stats(self, request):
+        return Response(latest_pings_cache.stats(), status=status.HTTP_200_OK)
+
+    @action(
+        detail=True,
+        methods=["get"],
+        url_path="trail",
+        permission_classes=[permissions.IsAuthenticated],
+    )
+    def trail(self, request, pk=None):
+        ping = self.get_object()
+        # Any change within the ping's trail tree invalidates its validators.
+        etag_parts, last_modified = ping_set_validators(
+            Ping.objects.in_trail(ping.trail_root_id)
+        )
+        return conditional_response(
+            request, partial(self.render_trail, ping), etag_parts, last_modified
+        )
+
+    def render_trail(self, ping):
+        trail_pings = list(Ping.objects.trail(ping.id))
+        prefetch_related_objects(
+            trail_pings,
+            Prefetch("user", queryset=User.objects.only(*UserSerializer.Meta.fields)),
+        )
+        serializer = self.get_serializer(trail_pings, many=True)
+        return Response(
+            {"root_ping": ping.trail_root_id, "pings": serializer.data},
+            status=status.HTTP_200_OK,
+        )
 
     @action(
         detail=True,
@@ -156,10 +631,9 @@ class PingViewSet(viewsets.ModelViewSet):
         )
         serializer = self.get_serializer(data=data)
         serializer.is_valid(raise_exception=True)
-        print(user.id)
-        print(serializer.validated_data)
         self.perform_create(serializer)
         header = self.get_success_headers(serializer.data)
         return Response(
             {"ping": serializer.data}, status=status.HTTP_201_CREATED, headers=header
         )
+
@@ -53,6 +53,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "api.middleware.PerformanceMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -96,11 +97,72 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory by default; point this at a shared backend (Redis, Memcached)
+# in production so cached payloads and their invalidation span all workers.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+
+# Seconds a rendered /pings/latest/ payload may live before it is rebuilt,
+# bounding staleness for changes that do not go through PingViewSet.
+LATEST_PINGS_CACHE_TIMEOUT = 60
+
+
+# Broker fanning out new pings to /pings/stream/ subscribers. The in-process
+# broker only reaches clients connected to the same server process.
+PING_BROKER = "api.broker.InProcessBroker"
+
+# Serve the hot read endpoints (ping list, detail, latest and the current
+# user) from async views. Only worthwhile when running under ASGI.
+ASYNC_READ_VIEWS = os.getenv("ASYNC_READ_VIEWS", "False") == "True"
+
+# Share of requests whose wall, database and serializer time and response
+# size are recorded by api.middleware.PerformanceMiddleware, served at
+# /api/v1/metrics/ in the Prometheus text format to staff signed in to the
+# admin and, when it is set, to requests with the bearer METRICS_TOKEN.
+PERFORMANCE_SAMPLE_RATE = float(os.getenv("PERFORMANCE_SAMPLE_RATE", "1.0"))
+SERVER_TIMING_HEADER = os.getenv("SERVER_TIMING_HEADER", "True") == "True"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+
+# Time every request and report its database queries in an X-DB-Queries
+# header, which `manage.py loadtest` collects. For load testing only.
+DB_QUERY_COUNT_HEADER = os.getenv("DB_QUERY_COUNT_HEADER", "False") == "True"
+
+# Pings whose whole trail is older than this many days are moved into
+# gzip-compressed NDJSON files in PING_ARCHIVE_DIR by `manage.py archive_pings`.
+PING_RETENTION_DAYS = int(os.getenv("PING_RETENTION_DAYS", "365"))
+PING_ARCHIVE_DIR = os.getenv("PING_ARCHIVE_DIR", str(BASE_DIR / "archive"))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
 AUTH_USER_MODEL = "api.User"
 
+# The first hasher hashes new passwords; hashes made by the others, or with
+# another PASSWORD_PBKDF2_ITERATIONS, are upgraded when their user logs in.
+PASSWORD_HASHERS = [
+    "api.hashing.PBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+PASSWORD_PBKDF2_ITERATIONS = int(os.getenv("PASSWORD_PBKDF2_ITERATIONS", "1000000"))
+
+# Passwords are hashed on a pool of this many threads per process (default:
+# half the CPUs), with this many more hashes waiting before logins are
+# answered with 503 after PASSWORD_HASHING_TIMEOUT seconds. See api/hashing.py.
+PASSWORD_HASHING_WORKERS = int(
+    os.getenv("PASSWORD_HASHING_WORKERS", str(max(1, (os.cpu_count() or 2) // 2)))
+)
+PASSWORD_HASHING_QUEUE = int(os.getenv("PASSWORD_HASHING_QUEUE", "64"))
+PASSWORD_HASHING_TIMEOUT = float(os.getenv("PASSWORD_HASHING_TIMEOUT", "5"))
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         "NAME": "django.contrib.auth.password_validation.UserAttributeSimilarityValidator",
@@ -143,7 +205,7 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 REST_FRAMEWORK = {
     "EXCEPTION_HANDLER": "api.exception_handlers.custom_exception_handler",
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "api.authentication.UserClaimsJWTAuthentication",
     ),
     "DEFAULT_FILTER_BACKENDS": [
         "django_filters.rest_framework.DjangoFilterBackend",
@@ -151,8 +213,31 @@ REST_FRAMEWORK = {
     ],
     "DEFAULT_PAGINATION_CLASS": "rest_framework.pagination.PageNumberPagination",
     "PAGE_SIZE": 50,
+    # Login and registration attempts, by client IP and by the code name or
+    # email they name. See api/throttling.py.
+    "DEFAULT_THROTTLE_RATES": {
+        "login": os.getenv("LOGIN_THROTTLE_RATE", "30/min"),
+        "login_account": os.getenv("LOGIN_ACCOUNT_THROTTLE_RATE", "5/min"),
+        "register": os.getenv("REGISTER_THROTTLE_RATE", "10/hour"),
+        "register_account": os.getenv("REGISTER_ACCOUNT_THROTTLE_RATE", "3/hour"),
+    },
+    # Reverse proxies in front of the app, whose X-Forwarded-For entries the
+    # throttles trust. 0 keys them on REMOTE_ADDR.
+    "NUM_PROXIES": int(os.getenv("NUM_PROXIES", "0")),
 }
 
+# Where throttled attempts are counted: api.throttling.LocalBucketStore in
+# each process, or api.throttling.CacheBucketStore in the shared cache.
+THROTTLE_STORE = os.getenv("THROTTLE_STORE", "api.throttling.LocalBucketStore")
+THROTTLE_LOGINS = os.getenv("THROTTLE_LOGINS", "True") == "True"
+
+# In-process cache of users by id (api.caches.user_cache), used by token
+# authentication and the user_id field of pings. Other processes see a
+# changed user after at most USER_CACHE_TIMEOUT seconds.
+USER_CACHE_ENABLED = os.getenv("USER_CACHE_ENABLED", "True") == "True"
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TIMEOUT = int(os.getenv("USER_CACHE_TIMEOUT", "30"))
+
 # JWT Authentication settings
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=5),
@@ -163,8 +248,18 @@ SIMPLE_JWT = {
     "AUTH_TOKEN_CLASSES": ("rest_framework_simplejwt.tokens.AccessToken",),
     "USER_ID_FIELD": "id",
     "USER_ID_CLAIM": "user_id",
+    # Access tokens carry the user's public fields, see api/authentication.py.
+    "TOKEN_OBTAIN_SERIALIZER": "api.authentication.UserClaimsTokenObtainPairSerializer",
+    "TOKEN_REFRESH_SERIALIZER": "api.authentication.UserClaimsTokenRefreshSerializer",
+    "TOKEN_BLACKLIST_SERIALIZER": "api.blacklist.RevocableTokenBlacklistSerializer",
 }
 
+# Where revoked refresh tokens are recorded, see api/blacklist.py. Prune the
+# database backend with `manage.py prune_tokens`.
+TOKEN_BLACKLIST_BACKEND = os.getenv(
+    "TOKEN_BLACKLIST_BACKEND", "api.blacklist.DatabaseBlacklist"
+)
+
 # Logging configuration
 LOGGING = {
     "version": 1,